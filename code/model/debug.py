@@ -1,5 +1,22 @@
 import numpy as np
-from model import system,params,target,fit
+from model import system,params,target,fit,out,strats
+
+def check_dtype(Ps,t,T=None,dtype=np.float32,skeys=('all','w','m','fsw','cli')):
+  # check outputs when storing X, Xk, inc as dtype (see system.get_out) vs float64 (default)
+  # returns the max relative error of each out function across Ps, strata (skeys) & t, plus ll
+  # e.g. check_dtype(params.get_n_all(range(10)),system.get_t(),target.get_all_esw())
+  R1s = system.run_n(Ps,t,T,para=False,Xk=True)
+  R2s = system.run_n(Ps,t,T,para=False,Xk=True,dtype=dtype)
+  R12s = [(R1,R2) for R1,R2 in zip(R1s,R2s) if 'X' in R1 and 'X' in R2]
+  okwds = dict(Nsi={},Psi={},prevalence={},incidence={},cuminfect={},cumdeath={},incavg={},
+    Ph=dict(h=(4,5)),diagnosed={},treated={},vls={},dx_rate={},tx_rate={})
+  if all(out.can_tdsc(R1) for R1,R2 in R12s): okwds.update(tdsc={})
+  relerr = lambda O1,O2: np.nanmax(abs(O2-O1)/np.maximum(abs(O1),1e-12))
+  E = {oname:max(relerr(*[out.by_name(oname)(R,tvec=t,**strats[skey].ind,**kwds) for R in R12])
+    for R12 in R12s for skey in skeys) for oname,kwds in okwds.items()}
+  E['ll'] = max(abs(R2['ll']-R1['ll']) / abs(R1['ll']) for R1,R2 in R12s) if T else None
+  E['failed'] = len(Ps) - len(R12s) # e.g. runs which fail in one case only
+  return E
 
 if __name__ == '__main__':
   t  = system.get_t(tf=2025)
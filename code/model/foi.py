@@ -1,7 +1,7 @@
 # functions for computing (stratified) model outputs
 
 import numpy as np
-from utils import _,deco,linear_comb
+from utils import _,deco,linear_comb,expand
 from model import tol
 
 foi_modes = [
@@ -13,123 +13,249 @@ foi_modes = [
 ]
 
 #@profile
-def get_beta(P,t):
+def get_beta(P,Pt,out=None,Rs=None):
   # beta: probability of transmission per sex act
-  # beta.shape = (a:2, p:4, s:2, i:4, s':2, i':4, h':6, c':5)
-  RbA_condom = linear_comb(P['PF_condom_t'](t) * P['RPF_condom_a'], P['Rbeta_condom'], 1)
-  RbA_circum = linear_comb(P['PF_circum_t'](t), P['Rbeta_circum'], 1)
-  P_gud_t = P['P_gud'] * P['RP_gud_t'](t) # GUD = genital ulcer diseases
-  Rbeta_gud_sus = linear_comb(P_gud_t,1+P['aRbeta_gud_sus'],1).reshape([1,1,2,4,1,1,1,1]) # self
-  Rbeta_gud_inf = linear_comb(P_gud_t,1+P['aRbeta_gud_inf'],1).reshape([1,1,1,1,2,4,1,1]) # other
-  # product of base prob & relative factors, force beta <= 0.5
-  return np.minimum(.5, P['beta_a'] * Rbeta_gud_sus * Rbeta_gud_inf * RbA_condom * RbA_circum)
+  # beta.shape = (..., a:2, p:4, s:2, i:4, i':4, h':6, c':5), where (...) are batch dims
+  # & the partner (i',h',c') has the opposite sex s' = 1 - s (see compact)
+  # Pt: time-varying params at this time (see params.get_Pt); out: buffer for beta
+  # Rs: factors of beta, if already computed (see get_beta_factors)
+  if Rs is None: Rs = get_beta_factors(P,Pt)
+  beta = np.empty(np.broadcast(*Rs).shape) if out is None else out
+  np.multiply(Rs[0],Rs[1],out=beta)
+  for R in Rs[2:]:
+    beta *= R
+  return np.minimum(.5,beta,out=beta) # force beta <= 0.5
+
+def get_beta_factors(P,Pt):
+  # factors of beta (before beta <= 0.5), each with 7 dims like beta, but size 1 in most:
+  # base prob (a,s,h',c'), GUD for self (s,i) & other (s,i'), condoms (a,p), circumcision (a,s)
+  RbA_condom = linear_comb(Pt['PF_condom_t'] * P['RPF_condom_a'], expand(P['Rbeta_condom'],7), 1)
+  RbA_circum = linear_comb(Pt['PF_circum_t'], P['Rbeta_circum'], 1)
+  P_gud_t = P['P_gud'] * Pt['RP_gud_t'] # GUD = genital ulcer diseases
+  Rbeta_gud_sus = linear_comb(P_gud_t,1+expand(P['aRbeta_gud_sus'],2),1)[...,_,_,:,:,_,_,_] # self
+  Rbeta_gud_inf = linear_comb(P_gud_t,1+expand(P['aRbeta_gud_inf'],2),1)[...,_,_,::-1,_,:,_,_] # other
+  return (P['beta_a'],Rbeta_gud_sus,Rbeta_gud_inf,RbA_condom,RbA_circum)
+
+# Newton for get_mix: the log scaling factors (a, b) are only defined up to a + c, b - c,
+# so we add V = v v' with v = (1,1,1,1,-1,-1,-1,-1) / sqrt(8) to the (singular) Jacobian
+V_ab = np.outer(np.repeat([1,-1],4),np.repeat([1,-1],4)) / 8
 
 @deco.nowarn
 #@profile
-def get_mix(XC,P):
-  # mix: population-scale mixing (total partners), mix.shape = (p:4, s:2, i:4, s':2, i':4)
-  # XC: total partners, XC.shape = (p:4, s:2, i:4)
-  # M0: random mixing, M0.shape = (p:4, i:4 {women}, i':4 {men})
-  M0 = XC[:,0,:,_] * XC[:,1,_,:] / XC.sum(axis=2).mean(axis=1)[:,_,_] + tol/10
-  m1 = M0.sum(axis=1) # total for men
-  m2 = M0.sum(axis=2) # total for women
+def get_mix(XC,P,ab=None):
+  # mix: population-scale mixing (total partners), mix.shape = (..., p:4, s:2, i:4, i':4) (see compact)
+  # XC: total partners, XC.shape = (..., p:4, s:2, i:4)
+  # M0: random mixing, M0.shape = (..., p:4, i:4 {women}, i':4 {men})
+  # ab: log scaling factors of M0 * exp(pref_pii) for women (a) & men (b), ab.shape = (..., p:4, s:2, i:4)
+  # which we update in-place, so e.g. system.solve can warm-start from the last step (see get_W)
+  M0 = XC[...,0,:,_] * XC[...,1,_,:] / XC.sum(axis=-1).mean(axis=-1)[...,_,_] + tol/10
+  m1 = M0.sum(axis=-2) # total for men
+  m2 = M0.sum(axis=-1) # total for women
   # print(m1 / XC[:,1,:]) # DEBUG == 1, unless XC unbalanced
   # print(m2 / XC[:,0,:]) # DEBUG == 1, unless XC unbalanced
   M = M0 * np.exp(P['pref_pii']) # apply mixing log-odds
-  # iterative proportional fitting
-  for k in range(100):
-    r1 = m1 / M.sum(axis=1)
-    M *= r1[:,_,:]
-    r2 = m2 / M.sum(axis=2)
-    M *= r2[:,:,_]
-    if (abs(r1-1) < tol).all() and (abs(r2-1) < tol).all():
-      break # close enough, usually k < 20
+  # fit M to the margins of M0: M0 already fits if pref_pii = 0 (e.g. sex work), so we only
+  # fit other p, via Newton's method for log(sum(M)/margin) = 0 (usually 1 step if warm-started)
+  p = np.any(P['pref_pii'] != 0,axis=(-2,-1)).reshape(-1,4).any(axis=0)
+  if p.any():
+    K,m,abp = M[...,p,:,:],np.stack([m2,m1],axis=-2)[...,p,:,:],np.zeros(XC[...,p,:,:].shape)
+    if ab is not None: abp[...] = ab[...,p,:,:]
+    J = np.zeros([*K.shape[:-2],2,4,2,4]) # Jacobian, (..., p:*, s:2, i:4, s':2, i':4)
+    J[...,0,:,0,:] = J[...,1,:,1,:] = np.eye(4)
+    for k in range(20):
+      M[...,p,:,:] = K * np.exp(abp[...,0,:,_] + abp[...,1,_,:])
+      Mp = M[...,p,:,:]
+      Ms = np.stack([Mp.sum(axis=-1),Mp.sum(axis=-2)],axis=-2)
+      r = np.log(Ms / m) # log residuals (..., p:*, s:2, i:4)
+      if (abs(r) < tol).all():
+        break # close enough
+      J[...,0,:,1,:] = Mp / Ms[...,0,:,_]
+      J[...,1,:,0,:] = Mp.swapaxes(-2,-1) / Ms[...,1,:,_]
+      Jr = (J.reshape([*J.shape[:-4],8,8]) + V_ab,r.reshape([*r.shape[:-2],8,1]))
+      abp -= np.linalg.solve(*Jr).reshape(r.shape)
+    if ab is not None: ab[...,p,:,:] = abp
   M[abs(M)<tol] = 0 # fix rounding errors
-  P['mix'][:,0,:,1,:] = M
-  P['mix'][:,1,:,0,:] = M.swapaxes(1,2)
+  P['mix'][...,0,:,:] = M
+  P['mix'][...,1,:,:] = M.swapaxes(-2,-1)
   return P['mix']
 
+def compact(x):
+  # all partnerships are between women & men, so we store arrays by (p, s, i, s', i') like mix,
+  # mix_mask & inc as (..., p:4, s:2, i:4, i':4) with s' = 1 - s, i.e. only the non-zero blocks
+  # compact: (..., p:4, s:2, i:4, s':2, i':4) -> (..., p:4, s:2, i:4, i':4) & full: the inverse,
+  # e.g. for code using the full arrays
+  return np.stack([x[...,0,:,1,:],x[...,1,:,0,:]],axis=-3)
+
+def full(x):
+  # see compact
+  y = np.zeros([*x.shape[:-3],2,4,2,4])
+  y[...,0,:,1,:] = x[...,0,:,:]
+  y[...,1,:,0,:] = x[...,1,:,:]
+  return y
+
+def get_W(X):
+  # workspace for get_apply_inc: preallocated buffers & views, e.g. for many calls in system.solve
+  # X.shape = (..., s:2, i:4, k:5, h:6, c:5), so W must be rebuilt if the batch dims (...) change
+  b = X.shape[:-5]
+  W = {
+    'XC_psikhc':  np.zeros([*b,4,2,4,5,6,5]),
+    'XC_psihc':   np.zeros([*b,4,2,4,6,5]),
+    'XC_psi':     np.zeros([*b,4,2,4]),
+    'Phc_XC_psi': np.zeros([*b,4,2,4,6,5]),
+    'mix':        np.zeros([*b,4,2,4,4]),
+    'mix_ab':     np.zeros([*b,4,2,4]), # warm start for get_mix
+    'beta':       np.zeros([*b,2,4,2,4,4,6,5]),
+    'Fbeta':      np.zeros([*b,4,2,4,4,6,5]), # Fbeta or B_p
+    'inc_hc':     np.zeros([*b,4,2,4,4,6,5]),
+    'inc_mix':    np.zeros([*b,4,2,4,4]),
+    'inc':        np.zeros([*b,4,2,4,4]),
+    'inc_psi':    np.zeros([*b,4,2,4]),
+    'inc_pshc':   np.zeros([*b,4,2,4,6,5]),
+    'inc_shc':    np.zeros([*b,2,4,6,5]),
+    'dXi_k':      np.zeros([*b,2,4,4,6,5]),
+    'XKe':        np.zeros([*b,2,4,4,6,5]),
+  }
+  W.update({ # views
+    'Phc_XC_psi_sus': W['Phc_XC_psi'][...,0,0,_],
+    'Phc_XC_psi_inf': W['Phc_XC_psi'][...,::-1,_,:,:,:], # partner: s' = 1 - s
+    'inc_psi_k':      np.moveaxis(W['inc_psi'],-3,-1),
+    'inc_pshc_k':     np.moveaxis(W['inc_pshc'],-5,-3),
+    'inc_pshc_s':     W['inc_pshc'][...,::-1,:,:,:], # by sex of the susceptible partner
+  })
+  return W
+
 @deco.nowarn
 #@profile
-def get_apply_inc(dX,X,t,P):
-  # inc.shape = (p:4, s:2, i:4, s':2, i':4)
+def get_apply_inc(dX,X,P,Pt,W=None):
+  # inc.shape = (..., p:4, s:2, i:4, i':4), where (...) are any batch dims of X (see compact)
   # > if foi_mode in ['base','lin','rd','ry']: return *absolute* infections (not per susceptible)
   # > if foi_mode in ['py']: return *probability* of infection (aggr must be deferred)
+  # W: workspace (see get_W), so inc & temporaries are written into preallocated buffers
   # C_psik = partner numbers (K) or rates of ptr change (Q); A = sex acts per partnership
-  # C_psik.shape = (p:4, s:2, i:4, k:5)
+  # C_psik.shape = (..., p:4, s:2, i:4, k:5)
+  if W is None: W = get_W(X)
   if P['foi_mode'] in ['base']:
     C_psik = P['K_psi'] - P['aK_pk'] # K (ptr count), EPA adjusted
-    fix_XK(X,P) # see function comments
+    fix_XK(X,P,W) # see function comments
   elif P['foi_mode'] in ['lin']:
     C_psik = P['K_psi'] # K (ptr count), no adjustment
   elif P['foi_mode'] in ['rd']:
-    C_psik = P['K_psi'] / P['dur_p'][:,_,_,_] # Q (ptr rate)
-    A_ap = P['F_ap'] * P['dur_p'] # A (sex acts, full duration)
+    C_psik = P['K_psi'] / P['dur_p'][...,:,_,_,_] # Q (ptr rate)
+    A_ap = P['A_ap'] # A (sex acts, full duration)
   elif P['foi_mode'] in ['ry','py']:
-    C_psik = P['K_psi'] / P['dur_p_1'][:,_,_,_] # Q_1 (ptr rate >= 1)
-    A_ap = P['F_ap'] * P['dur_p_1'] # A (sex acts, duration <= 1 year)
+    C_psik = P['K_psi'] / P['dur_p_1'][...,:,_,_,_] # Q_1 (ptr rate >= 1)
+    A_ap = P['A_ap_1'] # A (sex acts, duration <= 1 year)
   # setup mixing & compute prevalence
-  XC_psihc = (X[_,:,:,:,:,:] * C_psik[:,:,:,:,_,_]).sum(axis=3) # total effective partners
+  XC_psihc = W['XC_psihc'] # total effective partners
+  np.multiply(X[...,_,:,:,:,:,:],C_psik[...,_,_],out=W['XC_psikhc']).sum(axis=-3,out=XC_psihc)
   XC_psihc[XC_psihc<0] = 0 # fix rounding errors
-  XC_psi = XC_psihc.sum(axis=(3,4)) # shape = (p:4, s:2, i:4)
+  XC_psi = XC_psihc.sum(axis=(-2,-1),out=W['XC_psi']) # shape = (..., p:4, s:2, i:4)
   # Phc = % in strata (h,c) among (p,s,i); unless foi_mode = 'base', Phc_XC_psi = Phc_X_psi
-  Phc_XC_psi = XC_psihc / (XC_psi[:,:,:,_,_] + tol/10) # shape = (p:4, s:2, i:4, h:6, c:5)
+  np.divide(XC_psihc,XC_psi[...,_,_]+tol/10,out=W['Phc_XC_psi']) # shape = (..., p:4, s:2, i:4, h:6, c:5)
+  Phc_sus,Phc_inf = W['Phc_XC_psi_sus'],W['Phc_XC_psi_inf']
   # compute population-scale mixing
-  mix = get_mix(XC_psi,P) * P['mix_mask'] # shape = (p:4, s:2, i:4, s':2, i':4)
-  # compute per-act probability
-  beta = get_beta(P,t) # shape = (a:2, p:4, s:2, i:4, s':2, i':4, h':6, c':5)
+  mix = np.multiply(get_mix(XC_psi,P,W['mix_ab']),P['mix_mask'],out=W['mix']) # shape = (..., p:4, s:2, i:4, i':4)
+  # compute per-act probability: beta.shape = (..., a:2, p:4, s:2, i:4, i':4, h':6, c':5)
+  # unless foi_mode = 'base' & beta <= 0.5 cannot bind (max of product <= product of max),
+  # so we can use the factors of beta directly (see get_inc_base)
+  Rs = get_beta_factors(P,Pt)
+  fac = P['foi_mode'] in ['base'] and np.prod([R.max() for R in Rs]) <= .5
+  beta = None if fac else get_beta(P,Pt,out=W['beta'],Rs=Rs)
   # compute & apply force of infection
+  inc = W['inc']
   if P['foi_mode'] in ['base']:
     # inc = {# ptrs} * {% sus} * {% inf} * {beta per-act} * {act freq}
-    Fbeta = (beta * P['F_ap'][:,:,_,_,_,_,_,_]).sum(axis=0) # sum sex act types (a:2)
-    # inc.shape = (p:4, s:2, i:4, s':2, i':4, h':6, c':5)
-    inc = mix[:,:,:,:,:,_,_] * Phc_XC_psi[:,:,:,0,0,_,_,_,_] * Fbeta * Phc_XC_psi[:,_,_,:,:,:,:]
-    dXi = inc.sum(axis=(3,4,5,6)) # acquisition: (p:4, s:2, i:4)
-    dX[:,:,0 ,0,0] -= dXi.sum(axis=0)
-    dX[:,:,1:,1,0] += np.moveaxis(dXi,0,2)
-    dXi = inc.sum(axis=(1,2)) # transmission: (p:4, s':2, i':4, h':6, c':5)
-    dX[:,:,0 ,:,:] -= dXi.sum(axis=0)
-    dX[:,:,1:,:,:] += np.moveaxis(dXi,0,2)
-    dXi = X[:,:,1:,:,:] / P['dur_p'][_,_,:,_,_] # new ptrs: (s:2, i:4, k:4, h:6, c:5)
-    dX[:,:,1:,:,:] -= dXi
-    dX[:,:,0 ,:,:] += dXi.sum(axis=2)
-    return inc.sum(axis=(5,6)) # done
+    if fac:
+      get_inc_base(P,Rs,mix,W) # inc, inc_psi & inc_pshc (below)
+    else:
+      beta *= P['F_ap'][...,_,_,_,_,_]
+      Fbeta = beta.sum(axis=-7,out=W['Fbeta']) # sum sex act types (a:2)
+      # inc_hc.shape = (..., p:4, s:2, i:4, i':4, h':6, c':5)
+      np.multiply(mix,Phc_sus,out=W['inc_mix'])
+      inc_hc = np.multiply(W['inc_mix'][...,_,_],Fbeta,out=W['inc_hc'])
+      inc_hc *= Phc_inf
+      inc_hc.sum(axis=(-3,-2,-1),out=W['inc_psi']) # acquisition: (..., p:4, s:2, i:4)
+      inc_hc.sum(axis=-4,out=W['inc_pshc_s']) # transmission: (..., p:4, s':2, i':4, h':6, c':5)
+      inc_hc.sum(axis=(-2,-1),out=inc)
+    dX[...,0 ,0,0] -= W['inc_psi'].sum(axis=-3)
+    dX[...,1:,1,0] += W['inc_psi_k']
+    dX[...,0 ,:,:] -= W['inc_pshc'].sum(axis=-5,out=W['inc_shc'])
+    dX[...,1:,:,:] += W['inc_pshc_k']
+    dXi = np.divide(X[...,1:,:,:],P['dur_p'][...,_,_,:,_,_],out=W['dXi_k']) # new ptrs: (..., s:2, i:4, k:4, h:6, c:5)
+    dX[...,1:,:,:] -= dXi
+    dX[...,0 ,:,:] += dXi.sum(axis=-3)
+    return inc # done
   elif P['foi_mode'] in ['lin']:
     # inc = {# ptrs} * {% sus} * {% inf} * {beta per-act} * {act freq}
-    Fbeta = (beta * P['F_ap'][:,:,_,_,_,_,_,_]).sum(axis=0) # sum acts
-    inc = mix * Phc_XC_psi[:,:,:,0,0,_,_] * (Fbeta * Phc_XC_psi[:,_,_,:,:,:,:]).sum(axis=(5,6))
-    dXi = aggr_inc(inc,P['foi_mode'],axis=(0,3,4)) # sum across ptrs
+    beta *= P['F_ap'][...,_,_,_,_,_]
+    Fbeta = beta.sum(axis=-7,out=W['Fbeta']) # sum acts
+    np.multiply(mix,Phc_sus,out=inc)
+    inc *= np.multiply(Fbeta,Phc_inf,out=W['inc_hc']).sum(axis=(-2,-1),out=W['inc_mix'])
+    dXi = aggr_inc(inc,P['foi_mode'],axis=(-4,-1)) # sum across ptrs
   elif P['foi_mode'] in ['rd','ry']:
     # inc = {# ptrs} * {% sus} * {% inf} * (1 - (1 - {beta per-act}) ^ {acts per-ptr})
-    B_p = 1 - ((1 - beta) ** A_ap[:,:,_,_,_,_,_,_]).prod(axis=0) # prod acts
-    inc = mix * Phc_XC_psi[:,:,:,0,0,_,_] * (B_p * Phc_XC_psi[:,_,_,:,:,:,:]).sum(axis=(5,6))
-    dXi = aggr_inc(inc,P['foi_mode'],axis=(0,3,4)) # sum across ptrs
+    B_p = get_lB_p(beta,A_ap,out=W['Fbeta']) # prod acts: log(1 - B_p)
+    np.negative(np.expm1(B_p,out=B_p),out=B_p)
+    np.multiply(mix,Phc_sus,out=inc)
+    inc *= np.multiply(B_p,Phc_inf,out=W['inc_hc']).sum(axis=(-2,-1),out=W['inc_mix'])
+    dXi = aggr_inc(inc,P['foi_mode'],axis=(-4,-1)) # sum across ptrs
   elif P['foi_mode'] in ['py']:
     # B = (1 - (1 - {beta per-act}) ^ {acts per-ptr})
     # inc = {% sus} * (1 - (1 - {B} * {% inf}) ^ {# ptrs})
-    B_p = 1 - ((1 - beta) ** A_ap[:,:,_,_,_,_,_,_]).prod(axis=0) # prod acts
-    mix_pp = mix[:,:,:,:,:,_,_] / X.sum(axis=(2,3,4))[_,:,:,_,_,_,_]
-    inc = 1 - ((1 - B_p * Phc_XC_psi[:,_,_,:,:,:,:]) ** mix_pp).prod(axis=(5,6))
-    dXi = aggr_inc(inc,P['foi_mode'],axis=(0,3,4),Xsus=X[:,:,0,0,0]) # prod across ptrs
+    # in log space: 1 - inc = exp({# ptrs} * sum_h'c' log(1 - {B} * {% inf})), so no ** on (h',c')
+    B_p = get_lB_p(beta,A_ap,out=W['Fbeta']) # prod acts: log(1 - B_p)
+    mix_pp = mix / X.sum(axis=(-3,-2,-1))[...,_,:,:,_]
+    inc_hc = np.multiply(np.expm1(B_p,out=B_p),Phc_inf,out=W['inc_hc']) # - B_p * Phc_inf
+    np.log1p(inc_hc,out=inc_hc).sum(axis=(-2,-1),out=inc)
+    np.negative(np.expm1(np.multiply(inc,mix_pp,out=inc),out=inc),out=inc)
+    dXi = aggr_inc(inc,P['foi_mode'],axis=(-4,-1),Xsus=X[...,0,0,0]) # prod across ptrs
   # all non-base cases
-  dX[:,:,0,0,0] -= dXi # sus
-  dX[:,:,0,1,0] += dXi # inf: acute & undx
+  dX[...,0,0,0] -= dXi # sus
+  dX[...,0,1,0] += dXi # inf: acute & undx
+  return inc
+
+def get_inc_base(P,Rs,mix,W):
+  # inc for foi_mode = 'base' (see get_apply_inc) without beta or inc_hc, if beta = prod(Rs):
+  # sum_a F_ap * beta = g_sus (s,i) * g_inf (s,i') * B (p,s,h',c'), so with Y = mix * Phc_sus * g_sus:
+  # inc      (p,s,i,i')     = Y * g_inf * sum_h'c' B * Phc_inf
+  # inc_psi  (p,s,i)        = sum_i' inc
+  # inc_pshc (p,s,i',h',c') = g_inf * Phc_inf * B * sum_i Y, by sex s of the susceptible partner
+  # contractions are pairwise, since np.einsum paths cost more than they save at these sizes
+  beta_a,g_sus,g_inf,RbA_condom,RbA_circum = Rs
+  g_sus,g_inf = g_sus[...,0,0,:,:,0,0,0],g_inf[...,0,0,:,0,:,0,0]
+  Phc,Phc_inf = W['Phc_XC_psi'],W['Phc_XC_psi'][...,::-1,:,:,:] # (..., p:4, s:2, i:4, h:6, c:5)
+  B = np.einsum('...ap,...ashc->...pshc',P['F_ap']*RbA_condom[...,0,0,0,0,0],
+    (beta_a*RbA_circum)[...,:,0,:,0,0,:,:])
+  Y = np.multiply(mix,(Phc[...,0,0]*g_sus[...,_,:,:])[...,_],out=W['inc_mix'])
+  Q = np.einsum('...pshc,...psjhc->...psj',B,Phc_inf) * g_inf[...,_,:,:]
+  inc = np.multiply(Y,Q[...,:,:,_,:],out=W['inc'])
+  inc.sum(axis=-1,out=W['inc_psi'])
+  np.multiply((Y.sum(axis=-2)*g_inf[...,_,:,:])[...,_,_]*B[...,:,:,_,:,:],Phc_inf,out=W['inc_pshc_s'])
   return inc
 
+def get_lB_p(beta,A_ap,out=None):
+  # log(1 - B_p), where B_p = 1 - prod_a (1 - beta) ^ A_ap is the probability of transmission
+  # per partnership over sex act types (a:2), i.e. sum_a A_ap * log(1 - beta); beta is overwritten
+  # NOTE: beta = min(.5, product of time-varying factors), so log(1 - beta) must be computed per step
+  np.log1p(np.negative(beta,out=beta),out=beta)
+  beta *= A_ap[...,_,_,_,_,_]
+  return beta.sum(axis=-7,out=out)
+
 #@profile
 def aggr_inc(inc,foi_mode,axis,Xsus=None,Xinf=None,keepdims=False):
   # returns absolute infections after appropriately aggregating "inc"
   # Xsus only needed if 'foi_mode' in ['py']
   if foi_mode in ['base','lin','rd','ry']:
     return inc.sum(axis=axis,keepdims=keepdims)
-  if foi_mode in ['py']:
-    return (1 - (1 - inc).prod(axis=axis,keepdims=keepdims)) * Xsus
+  if foi_mode in ['py']: # float64 always, since 1 - (1 - inc) loses too much precision in float32
+    return (1 - (1 - inc.astype(float,copy=False)).prod(axis=axis,keepdims=keepdims)) * Xsus
 
 #@profile
-def fix_XK(X,P):
+def fix_XK(X,P,W=None):
   # we cannot remove more partnerships than we have: X[:,:,1:] <= XKm
   # if this happens (due to turnover) then move the extra X[:,:,1:] to X[:,:,0]
-  XKm = X.sum(axis=2,keepdims=True) * np.moveaxis(P['K_psi'],0,2)[...,_]
-  XKe = np.maximum(0, X[:,:,1:] - XKm)
-  X[:,:,1:] -= XKe
-  X[:,:,0 ] += XKe.sum(axis=2)
+  XKm = X.sum(axis=-3,keepdims=True) * np.moveaxis(P['K_psi'],-4,-2)[...,_]
+  XKe = np.subtract(X[...,1:,:,:],XKm,out=None if W is None else W['XKe'])
+  np.maximum(0,XKe,out=XKe)
+  X[...,1:,:,:] -= XKe
+  X[...,0 ,:,:] += XKe.sum(axis=-3)
@@ -0,0 +1,282 @@
+# optional JIT-compiled (numba) kernels for system.get_dX, incl. foi.get_apply_inc
+# each kernel fuses many small numpy ops into loops over (n, ...), where n = all batch dims;
+# if numba is not installed, get_J returns None & system.get_dX uses the numpy code
+
+import numpy as np
+from utils import _,log,expand
+from model import foi,tol
+try:
+  from numba import njit
+  jit = njit(cache=True)
+except ImportError:
+  njit = None
+  jit = lambda fun: fun # kernels still defined, but never used (see get_J)
+nojit = {'logged': False} # so we only log the fallback once
+
+modes = {'base':0,'lin':1,'rd':2,'ry':2,'py':3} # foi_mode -> apply_inc_k mode
+
+def get_J(P):
+  # context for get_dX: constant params, broadcast to (n, ...) so kernels can loop over them
+  # like system.get_L, J must be rebuilt if P changes, e.g. solve_n dropping members
+  if njit is None:
+    if not nojit['logged']:
+      log(2,'kernel.get_J: numba not found, using numpy')
+      nojit['logged'] = True
+    return None
+  b = P['X0'].shape[:-5]
+  bc = lambda x,shape: np.ascontiguousarray(bcn(x,b,shape),dtype=float)
+  mode = P['foi_mode']
+  if mode in ['base']:
+    C_psik = P['K_psi'] - P['aK_pk']
+  elif mode in ['lin']:
+    C_psik = P['K_psi']
+  elif mode in ['rd']:
+    C_psik = P['K_psi'] / P['dur_p'][...,:,_,_,_]
+  elif mode in ['ry','py']:
+    C_psik = P['K_psi'] / P['dur_p_1'][...,:,_,_,_]
+  A_ap = P['A_ap'] if mode == 'rd' else P['A_ap_1']
+  return {
+    'mode':   modes[mode],
+    'C':      bc(C_psik,(4,2,4,5)),
+    'K':      bc(P['K_psi'][...,0],(4,2,4)),
+    'Epref':  bc(np.exp(P['pref_pii']),(4,4,4)),
+    'pfit':   np.any(P['pref_pii'] != 0,axis=(-2,-1)).reshape(-1,4).any(axis=0), # see foi.get_mix
+    'F':      bc(P['F_ap'],(2,4)),
+    'A':      bc(A_ap,(2,4)),
+    'dur':    bc(P['dur_p'],(4,)),
+    'prog':   bc(P['prog_h'],(2,4,5,4,3)),
+    'unprog': bc(P['unprog_h'],(2,4,5,3,2)),
+    'death':  bc(expand(P['death'],5) + P['death_hc'],(2,4,5,6,5)),
+    'vx':     bc(expand(P['vx'],4),(2,4,5,5)),
+  }
+
+def bcn(x,b,shape):
+  # broadcast x to (*b, *shape) & reshape to (n, *shape), where n = prod(b)
+  return np.broadcast_to(x,(*b,*shape)).reshape(-1,*shape)
+
+def get_dX(X,P,Pt,W,J):
+  # same as system.get_dX (numpy), but via the kernels below, given J (see get_J)
+  # W: workspace (see system.get_W), whose buffers we use as (n, ...) views
+  # X must be contiguous too, so that fix_XK_k modifies X in-place
+  b = X.shape[:-5]
+  Xn,dX = X.reshape(-1,2,4,5,6,5),W['dX'].reshape(-1,2,4,5,6,5)
+  dX.fill(0)
+  # force of infection
+  if J['mode'] == 0:
+    fix_XK_k(Xn,J['K'])
+  XC_psi,Phc = W['XC_psi'].reshape(-1,4,2,4),W['Phc_XC_psi'].reshape(-1,4,2,4,6,5)
+  get_XC_k(Xn,J['C'],W['XC_psihc'].reshape(-1,4,2,4,6,5),XC_psi,Phc,tol)
+  mix = W['mix'].reshape(-1,4,2,4,4)
+  get_mix_k(XC_psi,J['Epref'],J['pfit'],foi.V_ab,W['mix_ab'].reshape(-1,4,2,4),
+    P['mix'].reshape(-1,4,2,4,4),bcn(P['mix_mask'],b,(4,2,4,4)),mix,tol)
+  beta = foi.get_beta(P,Pt,out=W['beta']).reshape(-1,2,4,2,4,4,6,5)
+  apply_inc_k(J['mode'],dX,Xn,mix,Phc,beta,J['F'],J['A'],J['dur'],W['inc'].reshape(-1,4,2,4,4))
+  # births (entry), as in system.get_dX
+  W['dX_sus'] += expand(X.sum(axis=(-5,-4,-3,-2,-1)) * Pt['birth_t'],2) * Pt['PXe_si']
+  # all the rest
+  apply_lin_k(dX,Xn,J['prog'],J['unprog'],J['death'],J['vx'],bcn(Pt['turn_sii'],b,(2,4,4)),*[
+    bcn(r,b,(2,4,5,5)) for r in (
+      Pt['dx_sit'] * P['Rdx_scen'],
+      Pt['tx_sit'] * Pt['Rtx_ht'] * P['Rtx_scen'],
+      Pt['unvx_sit'] * P['Rux_scen'],
+      Pt['revx_t'])])
+  return {
+    'dX': W['dX'],
+    'inc': W['inc'],
+  }
+
+@jit
+def fix_XK_k(X,K):
+  # see foi.fix_XK; X: (n, s:2, i:4, k:5, h:6, c:5), K: (n, p:4, s:2, i:4)
+  for n in range(X.shape[0]):
+    for s in range(2):
+      for i in range(4):
+        for h in range(6):
+          for c in range(5):
+            x = 0.
+            for k in range(5):
+              x += X[n,s,i,k,h,c]
+            e = 0.
+            for p in range(4):
+              xe = X[n,s,i,1+p,h,c] - x * K[n,p,s,i]
+              if xe > 0:
+                X[n,s,i,1+p,h,c] -= xe
+                e += xe
+            X[n,s,i,0,h,c] += e
+
+@jit
+def get_XC_k(X,C,XC_psihc,XC_psi,Phc,tol):
+  # see foi.get_apply_inc: total effective partners (XC_*) & Phc = % in strata (h,c) among (p,s,i)
+  for n in range(X.shape[0]):
+    for p in range(4):
+      for s in range(2):
+        for i in range(4):
+          xc = 0.
+          for h in range(6):
+            for c in range(5):
+              x = 0.
+              for k in range(5):
+                x += X[n,s,i,k,h,c] * C[n,p,s,i,k]
+              x = max(x,0.) # fix rounding errors
+              XC_psihc[n,p,s,i,h,c] = x
+              xc += x
+          XC_psi[n,p,s,i] = xc
+          for h in range(6):
+            for c in range(5):
+              Phc[n,p,s,i,h,c] = XC_psihc[n,p,s,i,h,c] / (xc + tol/10)
+
+@jit
+def get_mix_k(XC,Epref,pfit,V,ab,mixP,mask,mix,tol):
+  # see foi.get_mix: Newton's method only for p in pfit, warm-started from ab (updated in-place),
+  # but converged per batch member (n); mixP: P['mix'], & mix includes mask
+  # XC: (n, p:4, s:2, i:4), mix: (n, p:4, s:2, i:4, i':4) (see foi.compact)
+  M,m,Ms = np.empty((4,4)),np.empty((2,4)),np.empty((2,4))
+  r,Jr = np.empty(8),np.empty((8,8))
+  for n in range(XC.shape[0]):
+    for p in range(4):
+      xm = (XC[n,p,0,:].sum() + XC[n,p,1,:].sum()) / 2
+      for i in range(4):
+        for j in range(4):
+          M[i,j] = XC[n,p,0,i] * XC[n,p,1,j] / xm + tol/10
+      for i in range(4):
+        m[0,i] = M[i,:].sum() # total for women
+        m[1,i] = M[:,i].sum() # total for men
+      for i in range(4):
+        for j in range(4):
+          M[i,j] *= Epref[n,p,i,j]
+      if pfit[p]:
+        for k in range(20):
+          for i in range(4):
+            for j in range(4):
+              M[i,j] = XC[n,p,0,i] * XC[n,p,1,j] / xm + tol/10
+              M[i,j] *= Epref[n,p,i,j] * np.exp(ab[n,p,0,i] + ab[n,p,1,j])
+          ok = True
+          for i in range(4):
+            Ms[0,i] = M[i,:].sum()
+            Ms[1,i] = M[:,i].sum()
+            r[i],r[4+i] = np.log(Ms[0,i] / m[0,i]),np.log(Ms[1,i] / m[1,i]) # log residuals
+            ok = ok and abs(r[i]) < tol and abs(r[4+i]) < tol
+          if ok:
+            break # close enough
+          Jr[:,:] = V
+          for i in range(4):
+            Jr[i,i] += 1
+            Jr[4+i,4+i] += 1
+            for j in range(4):
+              Jr[i,4+j] += M[i,j] / Ms[0,i]
+              Jr[4+j,i] += M[i,j] / Ms[1,j]
+          d = np.linalg.solve(Jr,r)
+          for i in range(4):
+            ab[n,p,0,i] -= d[i]
+            ab[n,p,1,i] -= d[4+i]
+      for i in range(4):
+        for j in range(4):
+          x = M[i,j] if abs(M[i,j]) >= tol else 0. # fix rounding errors
+          mixP[n,p,0,i,j] = mixP[n,p,1,j,i] = x
+          mix[n,p,0,i,j] = x * mask[n,p,0,i,j]
+          mix[n,p,1,j,i] = x * mask[n,p,1,j,i]
+
+@jit
+def apply_inc_k(mode,dX,X,mix,Phc,beta,F,A,dur,inc):
+  # see foi.get_apply_inc; mode: see modes; beta: (n, a:2, p:4, s:2, i:4, i':4, h':6, c':5)
+  for n in range(X.shape[0]):
+    for s in range(2):
+      for i in range(4):
+        xs = 0. # total X in (s,i), for mode py
+        for k in range(5):
+          for h in range(6):
+            for c in range(5):
+              xs += X[n,s,i,k,h,c]
+        dXi = 0. # new infections in (s,i), for modes lin, rd, ry
+        Pnoi = 1. # prob no infection in (s,i), for mode py
+        for p in range(4):
+          acq = 0. # acquisition, for mode base
+          s2 = 1 - s # partner
+          for i2 in range(4):
+            m = mix[n,p,s,i,i2] * Phc[n,p,s,i,0,0]
+            x = 0. if mode < 3 else 1.
+            for h in range(6):
+              for c in range(5):
+                if mode < 2: # Fbeta: sum acts
+                  b = beta[n,0,p,s,i,i2,h,c] * F[n,0,p] + beta[n,1,p,s,i,i2,h,c] * F[n,1,p]
+                else: # B_p: prod acts
+                  b = 1 - (1 - beta[n,0,p,s,i,i2,h,c])**A[n,0,p] * (1 - beta[n,1,p,s,i,i2,h,c])**A[n,1,p]
+                if mode == 0:
+                  xhc = m * b * Phc[n,p,s2,i2,h,c]
+                  dX[n,s2,i2,0,h,c] -= xhc # transmission
+                  dX[n,s2,i2,1+p,h,c] += xhc
+                  x += xhc
+                elif mode < 3:
+                  x += b * Phc[n,p,s2,i2,h,c]
+                else:
+                  x *= (1 - b * Phc[n,p,s2,i2,h,c])**(mix[n,p,s,i,i2] / xs)
+            if mode == 0:
+              inc[n,p,s,i,i2] = x
+              acq += x
+            elif mode < 3:
+              inc[n,p,s,i,i2] = m * x
+              dXi += m * x
+            else:
+              inc[n,p,s,i,i2] = 1 - x
+              Pnoi *= x
+          if mode == 0:
+            dX[n,s,i,0,0,0] -= acq # acquisition
+            dX[n,s,i,1+p,1,0] += acq
+        if mode == 3:
+          dXi = (1 - Pnoi) * X[n,s,i,0,0,0]
+        if mode > 0:
+          dX[n,s,i,0,0,0] -= dXi # sus
+          dX[n,s,i,0,1,0] += dXi # inf: acute & undx
+    if mode == 0: # new partnerships
+      for s in range(2):
+        for i in range(4):
+          for k in range(4):
+            for h in range(6):
+              for c in range(5):
+                x = X[n,s,i,1+k,h,c] / dur[n,k]
+                dX[n,s,i,1+k,h,c] -= x
+                dX[n,s,i,0,h,c] += x
+
+@jit
+def apply_lin_k(dX,X,prog,unprog,death,vx,turn,dx,tx,unvx,revx):
+  # see system.get_dX: HIV progression, CD4 recovery, deaths, turnover & cascade
+  # rates are all broadcast to (n, ...) shapes of the X they apply to, e.g. dx: (n, s:2, i:4, k:5, h:5)
+  for n in range(X.shape[0]):
+    for s in range(2):
+      for i in range(4):
+        for k in range(5):
+          for h in range(4): # HIV progression: all hiv & untreated
+            for c in range(3):
+              x = X[n,s,i,k,1+h,c] * prog[n,s,i,k,h,c]
+              dX[n,s,i,k,1+h,c] -= x
+              dX[n,s,i,k,2+h,c] += x
+          for h in range(3): # CD4 recovery: low CD4 & treated
+            for c in range(2):
+              x = X[n,s,i,k,3+h,3+c] * unprog[n,s,i,k,h,c]
+              dX[n,s,i,k,3+h,3+c] -= x
+              dX[n,s,i,k,2+h,3+c] += x
+          for h in range(6): # deaths
+            for c in range(5):
+              dX[n,s,i,k,h,c] -= X[n,s,i,k,h,c] * death[n,s,i,k,h,c]
+          for i2 in range(4): # turnover among activity groups
+            for h in range(6):
+              for c in range(5):
+                x = X[n,s,i,k,h,c] * turn[n,s,i,i2]
+                dX[n,s,i,k,h,c] -= x
+                dX[n,s,i2,k,h,c] += x
+          for h in range(5): # cascade
+            x = X[n,s,i,k,1+h,0] * dx[n,s,i,k,h] # diagnosis
+            dX[n,s,i,k,1+h,0] -= x
+            dX[n,s,i,k,1+h,1] += x
+            x = X[n,s,i,k,1+h,1] * tx[n,s,i,k,h] # treatment
+            dX[n,s,i,k,1+h,1] -= x
+            dX[n,s,i,k,1+h,3] += x
+            x = X[n,s,i,k,1+h,3] * vx[n,s,i,k,h] # viral suppression
+            dX[n,s,i,k,1+h,3] -= x
+            dX[n,s,i,k,1+h,4] += x
+            x = X[n,s,i,k,1+h,4] * unvx[n,s,i,k,h] # treatment fail / discontinue
+            dX[n,s,i,k,1+h,4] -= x
+            dX[n,s,i,k,1+h,2] += x
+            x = X[n,s,i,k,1+h,2] * revx[n,s,i,k,h] # viral re-suppression
+            dX[n,s,i,k,1+h,2] -= x
+            dX[n,s,i,k,1+h,4] += x
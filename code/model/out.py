@@ -1,9 +1,11 @@
 # functions for computing (stratified) model outputs
 
 import numpy as np
+from copy import copy
 from itertools import product as iprod
 from utils import _,deco,xdi,dtfun,itslice
 from model import system,foi,strats
+from model.strat import get_Isi
 
 # ------------------------------------------------------------------------------
 # helper data & functions
@@ -14,6 +16,7 @@ labels = {
   'Ph':         'Proportion of PLHIV',
   'prevalence': 'Prevalence',
   'incidence':  'Incidence (per person-year)',
+  'incavg':     'Incidence, period average (per person-year)',
   'cuminfect':  'Cumulative infections (\'000s)',
   'tdsc':       'Transmission-driven seroconcordance',
   'diagnosed':  'Diagnosed among PLHIV',
@@ -87,6 +90,63 @@ def aggratio(Xn,Xd,aggr,axis=None):
   else:
     return Xn / Xd
 
+class ResultSet():
+  # results (R) of many runs (e.g. from system.run_n) with the arrays (X, inc, RPts, ...)
+  # of the runs that did not fail (ok) stacked along a leading run axis, & each R viewing these;
+  # acts like the list of ok R (len, iter, RS[j]), while RS[k] gives a stacked array, so some
+  # out functions (expo, wiw, rmap) can compute over all runs at once
+  def __init__(self,Rs):
+    self.Rs = list(Rs) # all runs, incl. failed
+    self.ok = np.array(['X' in R for R in self.Rs],dtype=bool) # failed: ll = -inf & no X
+    self.ll = np.array([np.nan if R['ll'] is None else R['ll'] for R in self.Rs],dtype=float)
+    self.R  = [R for R,ok in zip(self.Rs,self.ok) if ok]
+    self.A  = {k:np.stack([R[k] for R in self.R]) for k,v in (self.R[0].items() if self.R else ())
+      if isinstance(v,np.ndarray) and all(np.shape(R.get(k)) == v.shape for R in self.R)}
+    for j,R in enumerate(self.R): # views of the stacked arrays
+      R.update({k:Ak[j] for k,Ak in self.A.items()})
+
+  def __len__(self):  return len(self.R)
+  def __iter__(self): return iter(self.R)
+  def __contains__(self,k): return k in self.A
+
+  def __getitem__(self,k):
+    # stacked array k (str) or ok run(s) k (int)
+    return self.A[k] if isinstance(k,str) else self.R[k]
+
+  def get_P(self,k):
+    # param k of the ok runs: stacked, or one str if the same for all (e.g. foi_mode)
+    vs = [R['P'][k] for R in self.R]
+    if isinstance(vs[0],str):
+      return vs[0] if len(set(vs)) == 1 else np.array(vs)
+    return np.stack(vs)
+
+  def take(self,j):
+    # subset of runs j (index or mask) among all runs (incl. failed), e.g. target.top_ll
+    b = np.zeros(len(self.Rs),dtype=bool)
+    b[j] = True
+    RS = copy(self)
+    RS.Rs,RS.ok,RS.ll = [R for R,bi in zip(self.Rs,b) if bi],self.ok[b],self.ll[b]
+    RS.R = [R for R,bi in zip(self.R,b[self.ok]) if bi]
+    RS.A = {k:Ak[b[self.ok]] for k,Ak in self.A.items()}
+    return RS
+
+def getP(R,k):
+  # param k for R or ResultSet (see ResultSet.get_P)
+  return R.get_P(k) if isinstance(R,ResultSet) else R['P'][k]
+
+def aggr_inc(R,inc,axis,Xsus):
+  # foi.aggr_inc for R or ResultSet, whose runs may have different foi_mode
+  foi_mode = getP(R,'foi_mode')
+  if isinstance(foi_mode,str):
+    return foi.aggr_inc(inc,foi_mode,axis=axis,Xsus=Xsus)
+  I = None
+  for mode in np.unique(foi_mode):
+    b = (foi_mode == mode)
+    Ib = foi.aggr_inc(inc[b],mode,axis=axis,Xsus=Xsus[b])
+    if I is None: I = np.zeros((len(b),*Ib.shape[1:]))
+    I[b] = Ib
+  return I
+
 # X.shape: (t:*, s:2, i:4, h:6, c:5)
 # Xk.shape: (t:*, s:2, i:4, k:5, h:6, c:5) - tdsc only
 
@@ -120,33 +180,68 @@ def prevalence(X,s=None,i=None,aggr=True):
 @deco.tslice(tk=['X','inc'])
 def incidence(X,inc,foi_mode,s=None,i=None,aggr=True):
   # total infections (per person-year); uses foi.aggr_inc due to FOI cases
-  # inc.shape = (t:*, p:4, s:2, i:4, s':2, i':4)
-  I = foi.aggr_inc(inc,foi_mode,axis=(1,4,5),Xsus=X[:,:,:,0,0])
+  # inc.shape = (t:*, p:4, s:2, i:4, i':4) (see foi.compact)
+  I = foi.aggr_inc(inc,foi_mode,axis=(1,4),Xsus=X[:,:,:,0,0])
   X_sus_si = xdi(X[:,:,:,0,0],{1:s,2:i}) # select sex & activity among sus (denom)
   I_si     = xdi(I,{1:s,2:i})            # select sex & activity new infs (num)
   return aggratio(I_si,X_sus_si,aggr)
 
-@deco.rmap(Rk=['X','inc'],Pk=['foi_mode'])
-def cuminfect(X,inc,foi_mode,tvec,s=None,i=None,aggr=True,t0=None):
-  dt = dtfun(tvec) # timestep sizes
+@deco.rmap(Rk=['X','inc','Ainf','dt'],Pk=['foi_mode'])
+def cuminfect(X,inc,foi_mode,tvec,s=None,i=None,aggr=True,t0=None,Ainf=None,dt=None):
+  # if R has running integrals from system.solve (Ainf, dt), tvec can be any output times
+  # & then t0 must be in tvec (see cumfrom)
+  if dt is None: dt = dtfun(tvec) # timestep sizes
   # total infections (per year); uses foi.aggr_inc due to FOI cases
-  I = foi.aggr_inc(inc,foi_mode,axis=(1,4,5),Xsus=X[:,:,:,0,0])
+  I = foi.aggr_inc(inc,foi_mode,axis=(1,4),Xsus=X[:,:,:,0,0])
   I_si = xdi(I,{1:s,2:i}) # select sex & activity new infs
   # sum new infs across sex & activity if aggr, mult by dt
   I_dt = I_si.sum(axis=(1,2)) * dt if aggr else I_si * dt[:,_,_]
+  if Ainf is not None:
+    return cumfrom(Ainf,I_dt,{1:s,2:i},aggr,tvec,t0)
   if t0: # zero new infs before t0
     I_dt[tvec < t0] = 0
   return np.cumsum(I_dt,axis=0)
 
-@deco.rmap(Rk=['X'],Pk=['death_hc'])
-def cumdeath(X,death_hc,tvec,s=None,i=None,h=None,c=None,aggr=True,t0=None):
-  dt = dtfun(tvec) # timestep sizes
+@deco.rmap(Rk=['X','Adeath','dt'],Pk=['death_hc'])
+def cumdeath(X,death_hc,tvec,s=None,i=None,h=None,c=None,aggr=True,t0=None,Adeath=None,dt=None):
+  # if R has running integrals from system.solve (Adeath, dt), see cuminfect
+  if dt is None: dt = dtfun(tvec) # timestep sizes
   D_sihc = xdi(X * death_hc[:,:,0,:,:],{1:s,2:i,3:h,4:c}) # mult by rate & select
   D_dt = D_sihc.sum(axis=(1,2,3,4)) * dt if aggr else D_sihc * dt[:,_,_,_,_]
+  if Adeath is not None:
+    return cumfrom(Adeath,D_dt,{1:s,2:i,3:h,4:c},aggr,tvec,t0)
   if t0: # zero new deaths before t0
     D_dt[tvec < t0] = 0
   return np.cumsum(D_dt,axis=0)
 
+def cumfrom(A,O_dt,di,aggr,tvec,t0=None):
+  # helper for cuminfect & cumdeath: select running integral A & (if t0) subtract A before t0,
+  # i.e. A at t0 minus the increment O_dt added at t0
+  A = xdi(A,di)
+  A = A.sum(axis=tuple(di.keys())) if aggr else A
+  if t0:
+    j = it0(tvec,t0)
+    A = A - (A[j] - O_dt[j])
+    A[tvec < t0] = 0
+  return A
+
+def it0(tvec,t0):
+  # index of t0 in tvec, for outputs from t0 via running integrals (see cumfrom, fcum):
+  # these integrals are only stored at tvec, so t0 must be one of them, e.g. via system.run(to=...)
+  if not np.isin(t0,tvec):
+    raise ValueError('out.it0: t0 = {} not in tvec: add t0 to the output times (to) of system.run'.format(t0))
+  return np.flatnonzero(tvec == t0)[0]
+
+@deco.nanzero
+@deco.rmap(Rk=['Ainf','Asus'])
+def incavg(Ainf,Asus,tvec,t=None,s=None,i=None,aggr=True):
+  # average incidence (per person-year) over each period (tvec[j-1], tvec[j]], from the running
+  # integrals of system.solve; vs incidence (above) which is instantaneous at each t
+  I_si = np.diff(xdi(Ainf,{1:s,2:i}),axis=0,prepend=0) # select sex & activity new infs (num)
+  S_si = np.diff(xdi(Asus,{1:s,2:i}),axis=0,prepend=0) # same for person-years sus (denom)
+  it = slice(None) if t is None else itslice(t,tvec)
+  return aggratio(I_si[it],S_si[it],aggr)
+
 @deco.nanzero
 @deco.rmap(Rk=['Xk'],Pk=['K_psi'])
 @deco.tslice(tk=['Xk'])
@@ -245,8 +340,105 @@ def circum(PF_circum_t,aggr=None):
 @deco.tslice(tk=['X','inc'])
 def infections(X,inc,foi_mode,p,fs,fi,ts,ti):
   # total infections (per year); uses foi.aggr_inc due to FOI cases
-  # note: p,fs,fi,ts,ti must be single values!
-  return foi.aggr_inc(inc[:,p,ts,ti,fs,fi],foi_mode,axis=(),Xsus=X[:,ts,ti,0,0])
+  # note: p,fs,fi,ts,ti must be single values! & fs = ts gives 0 (see foi.compact)
+  return foi.aggr_inc(inc[:,p,ts,ti,fi]*(fs != ts),foi_mode,axis=(),Xsus=X[:,ts,ti,0,0])
+
+def infections_all(Rs,tvec,t,**kwds):
+  # infections (R, t, p, ts, ti, fi) for a ResultSet Rs, like infections for all p,ts,ti,fi
+  it = itslice(t,tvec)
+  return aggr_inc(Rs,Rs['inc'][:,it],axis=(),Xsus=Rs['X'][:,it][:,:,_,:,:,0,0,_])
+
+# ------------------------------------------------------------------------------
+# fused output functions: many outputs & strata at once (see expo)
+
+# outputs as num / denom of group sums in the cube (see get_cube), & if nan -> 0 (like above)
+# cumulative outputs: rate & running integral from system.solve (see fcum)
+fouts = {
+  'Nsi':        ('all',None,False),
+  'prevalence': ('hiv','all',False),
+  'incidence':  ('inf','sus',False),
+  'diagnosed':  ('dia','hiv',True),
+  'treated_u':  ('tre','hiv',True),
+  'treated_c':  ('tre','dia',True),
+  'vls_u':      ('vls','hiv',True),
+  'vls_c':      ('vls','tre',True),
+  'cuminfect':  ('inf','Ainf',False),
+  'cumdeath':   ('dth','Adeath',False),
+}
+fcums = ['cuminfect','cumdeath']
+
+# (h,c) weights of the group sums in the cube (see get_cube), except inf & dth
+H,C = np.mgrid[0:6,0:5]
+fhc = dict(all=(H >= 0),hiv=(H >= 1),dia=(H >= 1)&(C >= 1),tre=(H >= 1)&(C >= 3),
+  vls=(H >= 1)&(C >= 4),sus=(H == 0)&(C == 0))
+
+def get_cube(R,gs,it=slice(None)):
+  # cube (t, s·i, g) of group sums gs from R at times it, shared by all fused outputs & strata
+  # via one matmul of X (t, s·i, h·c) with the (h,c) weights (h·c, g); for a ResultSet,
+  # all arrays have a leading run axis
+  X  = R['X'][...,it,:,:,:,:]
+  Xr = X.reshape((*X.shape[:-4],8,30))
+  cube = Xr @ np.stack([fhc[g].ravel() if g in fhc else np.zeros(30) for g in gs],axis=-1)
+  if 'inf' in gs: # new infections: uses foi.aggr_inc due to FOI cases
+    I = aggr_inc(R,R['inc'][...,it,:,:,:,:],axis=(-4,-1),Xsus=X[...,0,0])
+    cube[...,gs.index('inf')] = I.reshape(Xr.shape[:-1])
+  if 'dth' in gs: # deaths: mult by rate
+    cube[...,gs.index('dth')] = (Xr @ np.reshape(getP(R,'death_hc'),(*X.shape[:-5],1,30,1)))[...,0]
+  return cube
+
+@deco.nowarn
+def fexpo(Rs,M,onames,tvec,t,t0=None):
+  # fused outputs onames (dict of (R, t, strata) arrays) for Rs & strata (s,i) indicators M
+  # via one tensordot of the cube (get_cube) with M (strata, s·i) per R, or once if ResultSet
+  gs = list(dict.fromkeys(g for o in onames for g in fouts[o][0:2] if g in fhc or g in ('inf','dth')))
+  it = itslice(t,tvec)
+  itc = slice(None) if set(fcums).intersection(onames) else it # cube times
+  O = {o:[] for o in onames}
+  for R in ([Rs] if isinstance(Rs,ResultSet) else Rs):
+    C  = dict(zip(gs,np.moveaxis(np.tensordot(get_cube(R,gs,itc),M,axes=(-2,1)),-2,0)))
+    Ct = C if itc is it else {g:Cg[...,it,:] for g,Cg in C.items()} # at t
+    for o in onames:
+      num,den,nz = fouts[o]
+      if o in fcums:
+        O[o].append(fcum(R,C[num],den,M,tvec,t0)[...,it,:])
+      else:
+        O[o].append(Ct[num] / Ct[den] if den else Ct[num])
+  O = {o:np.concatenate(Oo) if isinstance(Rs,ResultSet) else np.array(Oo) for o,Oo in O.items()}
+  for o in onames:
+    if fouts[o][2]: O[o][np.isnan(O[o])] = 0
+  return O
+
+def fcum(R,O,akey,M,tvec,t0=None):
+  # cumulative output (t, strata) from the rate O (t, strata) & running integral R[akey]
+  # (if available) for strata M, like cuminfect & cumdeath (see cumfrom)
+  dt = R['dt'] if 'dt' in R else dtfun(tvec) # timestep sizes
+  O_dt = O * dt[...,_]
+  if akey in R:
+    A = R[akey]
+    A = A.reshape((*O.shape[:-1],8,-1)).sum(axis=-1) @ M.T
+    if t0:
+      j = it0(tvec,t0)
+      A = A - (A[...,j,:] - O_dt[...,j,:])[...,_,:]
+      A[...,tvec < t0,:] = 0
+    return A
+  if t0: # zero new outputs before t0
+    O_dt[...,tvec < t0,:] = 0
+  return np.cumsum(O_dt,axis=-2)
+
+def rmap(ofun,Rs,ind,tvec=None,t=None,**kwds):
+  # output ofun (name or function) for strata ind (dict) & all runs Rs (list or ResultSet)
+  # as a (R, t) array: at once via fexpo if possible, else per run
+  if isinstance(Rs,ResultSet) and len(Rs) and isinstance(ofun,str) and ofun in fouts and \
+      set(ind) <= {'s','i'} and set(kwds) <= {'t0'}:
+    tvec = Rs['t'][0] if tvec is None else tvec
+    M = get_Isi(ind).reshape((1,8))
+    return fexpo(Rs,M,[ofun],tvec,tvec if t is None else t,**kwds)[ofun][...,0]
+  tkwds = {k:v for k,v in dict(tvec=tvec,t=t).items() if v is not None}
+  if ofun in ['cuminfect','cumdeath'] and t is not None: # cannot use @deco.tslice (see expo)
+    tkwds.pop('t')
+    return np.array([by_name(ofun)(R,**ind,**tkwds,**kwds)[itslice(t,tvec)] for R in Rs])
+  if isinstance(ofun,str): ofun = by_name(ofun)
+  return np.array([ofun(R,**ind,**tkwds,**kwds) for R in Rs])
 
 # ------------------------------------------------------------------------------
 # output collection functions
@@ -264,10 +456,18 @@ def wiw(R1s,tvec,t,R2s=None,vsop='1-2'):
   kwds = dict(tvec=tvec,t=t)
   grid = dict(p=range(4),fs=range(2),fi=range(4),ts=range(2),ti=range(4))
   # t=time, p=ptr-type, f*=from, t*=to, *s=sex, *i=activity
+  fused = isinstance(R1s,ResultSet) and (R2s is None or isinstance(R2s,ResultSet))
+  if fused: # all runs & combinations at once (see infections_all)
+    infs = aggrop(infections_all(R1s,**kwds) if R2s is None else
+      vs_fun(infections_all(R1s,**kwds),infections_all(R2s,**kwds),vsop)) # (q, t, p, ts, ti, fi)
   for p,fs,fi,ts,ti in iprod(*grid.values()):
+    if fs == ts: continue # no such partnerships (see foi.compact)
     kwds.update(p=p,fs=fs,fi=fi,ts=ts,ti=ti)
-    inf = aggrop([infections(R1,**kwds) for R1 in R1s]) if R2s is None else \
-          aggrop([vs_fun(infections(R1,**kwds),infections(R2,**kwds),vsop) for R1,R2 in zip(R1s,R2s)])
+    if fused:
+      inf = infs[:,:,p,ts,ti,fi]
+    else:
+      inf = aggrop([infections(R1,**kwds) for R1 in R1s]) if R2s is None else \
+            aggrop([vs_fun(infections(R1,**kwds),infections(R2,**kwds),vsop) for R1,R2 in zip(R1s,R2s)])
     # append rows (all time points) for this combination of p,fs,fi,ts,ti
     data += [[tk,p,fs,fi,ts,ti]+inf[:,k].tolist() for k,tk in enumerate(t)]
   return data
@@ -287,7 +487,21 @@ def expo(R1s,tvec,t,onames,skeys,R2s=None,vsop='raw',ecols=None,mode='q',**kwds)
   E = dict(out=og,pop=sg,t=tg, # init cols: grid
     **{k:[v]*len(tg) for k,v in ecols.items()}, # extra cols
     **{k:[] for k in cols}) # empty data cols
+  # fused outputs (see fexpo) if all strata are (s,i) only
+  fnames = [o for o in onames if o in fouts] if set(kwds) <= {'t0'} and \
+    all(set(strats[skey].ind) <= {'s','i'} for skey in skeys) else []
+  if fnames:
+    M = np.array([strats[skey].Isi.ravel() for skey in skeys]) # (strata, s·i)
+    O = fexpo(R1s,M,fnames,tvec,t,**kwds)
+    if R2s is not None:
+      O2 = fexpo(R2s,M,fnames,tvec,t,**kwds)
+      O = {o:vs_fun(O[o],O2[o],vsop) for o in fnames}
   for oname in onames: # outputs
+    if oname in fnames:
+      osx = aggrop(O[oname]) # (cols, t, strata)
+      for i,col in enumerate(cols): # append to data columns (strata, t)
+        E[col] += osx[i].T.ravel().tolist()
+      continue
     ofun = by_name(oname)
     for skey in skeys: # strata
       if oname in ['cuminfect','cumdeath']: # special case: cannot use @deco.tslice
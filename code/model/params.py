@@ -3,9 +3,9 @@
 import numpy as np
 from copy import copy
 from scipy.optimize import nnls
-from utils import _,NAN,log,stats,flatten,dict_split,linear_comb,interval_qs
+from utils import _,NAN,log,fio,stats,flatten,dict_split,linear_comb,interval_qs,expand
 from utils import tarray as ta
-from model import tol
+from model import tol,foi
 
 # ------------------------------------------------------------------------------
 # sampling functions
@@ -96,24 +96,50 @@ def def_sample_distrs():
   'revx_2010':            stats.gamma(m=.7288,sd=.1279),
   }
 
-def get_lp(D,P):
-  # log prior probability of observing P under D, including constraints
-  return sum(D[k].logpdf(P[k]) for k in D.keys()) + \
-    sum(0 if constr(P) else -np.inf for constr in def_constrs())
+def get_lp(D,Pa):
+  # log prior probability of each row in Pa (n x len(D), cols in D order) under D,
+  # including constraints (def_constrs) as masks; see imis.P_array
+  P = dict(zip(D.keys(),np.atleast_2d(Pa).T))
+  lp = sum(D[k].logpdf(P[k]) for k in D.keys())
+  for constr in def_constrs():
+    lp[~constr(P)] = -np.inf
+  return lp
 
 def get_n_sample_lhs(D,n,seed):
   # get n samples (list of dicts) via Latin Hypercube Sampling (LHS)
-  # from the distribs D (dict)
+  # from the distribs D (dict); one ppf call per distrib over all n quantiles
   Qs = stats.lhs(len(D),n,seed) # Qs is (n x len(D)) array of quantiles
-  return [{k:D[k].ppf(qk) for k,qk in zip(D,Q)} for Q in Qs]
-
-def get_n_sample_constr(D,seeds,Ps=None):
-  # get n samples (list of dicts) via get_random_constr
+  X = {k:D[k].ppf(Qs[:,j]) for j,k in enumerate(D)}
+  return [{k:X[k][i] for k in D} for i in range(n)]
+
+def get_n_sample_constr(D,seeds,Ps=None,legacy=False):
+  # get n samples (list of dicts) via random sampling with constraints (def_constrs)
+  # each sample uses its own generator seeded by seeds[i], so it is reproducible
+  # for the seed alone; draws are by inverse cdf, and all samples failing
+  # a constraint are redrawn (keys of that constraint only) together
+  # legacy: draw one by one from the global stream instead (get_sample_constr), which is
+  # much slower, but gives the same samples as before, e.g. to reproduce older results
   if Ps is None: Ps = [{} for seed in seeds]
-  return [get_sample_constr(D,seed,P) for seed,P in zip(seeds,Ps)]
+  if legacy: return [get_sample_constr(D,seed,P) for seed,P in zip(seeds,Ps)]
+  gs = [np.random.default_rng(seed) for seed in seeds]
+  ks = list(D)
+  U = np.array([g.random(len(ks)) for g in gs]).reshape((len(gs),len(ks)))
+  X = {k:D[k].ppf(U[:,j]) for j,k in enumerate(ks)} # initial samples
+  Xc = {k:np.array([P[k] for P in Ps]) for k in set(Ps[0]).difference(X)} if Ps else {}
+  X.update(Xc) # other params needed for constraints
+  for constr,cks in def_constrs().items():
+    i = np.flatnonzero(~constr(X))
+    while i.size:
+      U = np.array([gs[ii].random(len(cks)) for ii in i])
+      for j,k in enumerate(cks):
+        X[k][i] = D[k].ppf(U[:,j])
+      i = i[~constr({k:x[i] for k,x in X.items()})]
+  for i,(seed,P) in enumerate(zip(seeds,Ps)):
+    P.update({k:X[k][i] for k in ks},id=seed)
+  return Ps
 
 def get_sample_constr(D,seed=None,P=None):
-  # get param set (dict) via random sampling with constraints
+  # get param set (dict) via random sampling with constraints (legacy, see get_n_sample_constr)
   if seed is not None: np.random.seed(seed)
   if P is None: P = {}
   P.update({k:Dk.rvs() for k,Dk in D.items()}) # initial samples
@@ -130,7 +156,7 @@ def resample_constr(D,P,constr,ks):
   return P
 
 def def_constrs():
-  # define constraints (dict) like {fun: [keys], ...} for resample_constr
+  # define constraints (dict) like {fun: [keys], ...} for get_n_sample_constr
   k = 'PF_condom_' # convenience
   return {
     constr_F:      ['F_swr'],
@@ -142,6 +168,9 @@ def def_constrs():
                     k+'swr_2002',k+'swr_2011',k+'swr_2014'],
   }
 
+# sampled params, which the dependent params are built from (see Params)
+ikeys = {*def_sample_distrs()}
+
 def get_depend(P,**kwds):
   # add dependent params to dict P, which already contains sampled params
   P.setdefault('foi_mode','base')
@@ -162,14 +191,149 @@ def get_depend(P,**kwds):
   P.update(get_scen(P))
   return P
 
-def get_n_all(seeds,**kwds):
+# time-varying (tarray) params used by system.get_dX & foi.get_beta (see get_Pt)
+tkeys = ['birth_t','PF_condom_t','PF_circum_t','RP_gud_t','dx_sit','tx_sit','Rtx_ht','unvx_sit','revx_t']
+
+def get_n_all(seeds,legacy=False,**kwds):
   # get a list (Ps) of n complete param dicts (P) for given seeds
+  # legacy: constrained samples from the old global stream (see get_n_sample_constr)
   log(2,'params.get_n_all: N = '+str(len(seeds)))
   D   = def_sample_distrs()
   Dc  = dict_split(D,flatten(def_constrs().values())) # split un/constrained
   Ps0 = get_n_sample_lhs(D,len(seeds),seed=seeds[0])  # unconstrained
-  Ps  = get_n_sample_constr(Dc,seeds,Ps=Ps0)          # constrained
-  return [get_depend(P,**kwds) for P in Ps]
+  Ps  = get_n_sample_constr(Dc,seeds,Ps=Ps0,legacy=legacy) # constrained
+  return get_n_depend(Ps,**kwds)
+
+def get_n_depend(Ps,**kwds):
+  # get a list of n param sets (Params) from the sampled param dicts Ps, whose dependent params
+  # are added on first access for all n at once, via get_depend on the batch (see get_batch)
+  group = []
+  group += [Params(dict(P,**kwds),group) for P in Ps]
+  return group
+
+class Params(dict):
+  # param set (dict) of sampled params (& metadata), whose dependent params (get_depend) are
+  # computed on first access, for all members of its group without them at once (see depend);
+  # setting a sampled param (ikeys) drops the dependent params, which are then recomputed alone,
+  # except overrides: scenario params (akeys, e.g. Rdx_scen, maybe edited in-place) & any
+  # dependent param set by the caller, which are kept as-is
+  def __init__(self,P=(),group=None,dkeys=None):
+    super().__init__(P)
+    self.group = [self] if group is None else group
+    self.dkeys = dkeys # keys added by depend, None if not (yet) computed
+
+  def depend(self):
+    if self.dkeys is not None: return self
+    Ps = [P for P in self.group if P.dkeys is None]
+    Pn = get_depend(get_batch([dict(dict.items(P)) for P in Ps]))
+    for j,P in enumerate(Ps): # per-P views (see take_batch) of the (n, ...) arrays
+      Pj = take_batch(Pn,j)
+      P.dkeys = [k for k in Pj if not dict.__contains__(P,k)]
+      for k in P.dkeys: dict.__setitem__(P,k,Pj[k])
+    return self
+
+  def __missing__(self,k):
+    if self.dkeys is None:
+      return self.depend()[k]
+    raise KeyError(k)
+
+  def __setitem__(self,k,v):
+    if self.dkeys is not None:
+      if k in ikeys: # invalidate dependent params, except overrides
+        for kd in self.dkeys:
+          if kd not in akeys: dict.pop(self,kd)
+        self.group,self.dkeys = [self],None
+      elif k in self.dkeys: # override: kept if invalidated
+        self.dkeys.remove(k)
+    dict.__setitem__(self,k,v)
+
+  def update(self,*args,**kwds):
+    for k,v in dict(*args,**kwds).items(): self[k] = v
+
+  def __contains__(self,k):
+    return dict.__contains__(self,k) or dict.__contains__(self.depend(),k)
+
+  def get(self,k,default=None):
+    return self[k] if k in self else default
+
+  # complete views & copies (e.g. dict(P), deepcopy, pickle) include the dependent params
+  def keys(self):     return dict.keys(self.depend())
+  def values(self):   return dict.values(self.depend())
+  def items(self):    return dict.items(self.depend())
+  def __iter__(self): return dict.__iter__(self.depend())
+  def __len__(self):  return dict.__len__(self.depend())
+  def __reduce__(self):
+    return (Params,(dict(self.items()),None,list(self.dkeys)))
+
+# params saved by save_Ps in addition to the sampled ones (def_sample_distrs), if present:
+# metadata (see imis.run, art.get_sens_sample) & scenario overrides (see get_scen)
+akeys = ['id','batch','imis','ss','foi_mode','ll','lp','wt','Rdx_scen','Rtx_scen','Rux_scen']
+
+def get_cols(Ps):
+  # get the saved params (see akeys) of the list Ps as a dict of typed columns (arrays)
+  keys = [k for k in [*def_sample_distrs(),*akeys] if k in Ps[0]]
+  return {k:np.array([P[k] for P in Ps]) for k in keys}
+
+def get_rows(cols):
+  # inverse of get_cols: list of param dicts from a dict of columns
+  return [dict(zip(cols.keys(),v)) for v in zip(*cols.values())]
+
+def save_Ps(fname,Ps):
+  # save only the sampled params & metadata of Ps as columns (see get_cols)
+  fio.save_npz(fname,get_cols(Ps))
+  return Ps
+
+def load_Ps(fname,**kwds):
+  # load Ps saved by save_Ps as Params, whose dependent params are rebuilt on first access
+  return get_n_depend(get_rows(fio.load_npz(fname)),**kwds)
+
+def get_batch(Ps):
+  # stack the param dicts Ps along a new leading (batch) axis, e.g. for system.solve_n
+  # numbers, arrays & tarrays are stacked (see ta.stack), and other values
+  # are kept as-is if equal for all P (e.g. foi_mode), else grouped in an object array
+  Pn = {}
+  for k,v in Ps[0].items():
+    vs = [P[k] for P in Ps]
+    if isinstance(v,ta.tarray):
+      Pn[k] = ta.stack(vs)
+    elif isinstance(v,(np.ndarray,np.number,int,float)):
+      Pn[k] = np.stack(vs)
+    elif all(vi == v for vi in vs):
+      Pn[k] = v
+    else:
+      Pn[k] = np.array(vs,dtype=object)
+  return Pn
+
+def get_Pt(P,t,keys=None):
+  # evaluate the time-varying (tarray) params in P at t, e.g. once per run as a "time table"
+  # if t is a vector, the t-dim is moved first, so each timestep is a contiguous Pt[k][i]
+  # with birth_t, we also add the entrant & turnover tables (see solve_turnover)
+  if keys is None: keys = tkeys
+  if np.size(t) == 1:
+    Pt = {k:P[k](t) for k in keys}
+    if 'birth_t' in keys:
+      Pt.update({k:v[0] for k,v in solve_turnover(P,Pt['birth_t'][_]).items()})
+  else:
+    Pt = {k:np.rollaxis(P[k](t),-1) for k in keys}
+    if 'birth_t' in keys:
+      Pt.update(solve_turnover(P,Pt['birth_t']))
+  return Pt
+
+def take_batch(Pn,j):
+  # select members j (index or mask) from a batch of params Pn (see get_batch)
+  return {k:v[j] if isinstance(v,(np.ndarray,ta.tarray,ta.tstack)) else v for k,v in Pn.items()}
+
+def bshape(P):
+  # batch shape of P: () for one param set, else (n,), e.g. from get_batch
+  return np.shape(P['t0_hiv'])
+
+def vec(*xs,axis=-1):
+  # stack scalars &/or per-batch values along a new last axis, like np.array([...]) for one P
+  return np.stack(np.broadcast_arrays(*xs),axis=axis)
+
+def bcopy(x,bs):
+  # copy of x for each member of a batch with shape bs (see bshape), else x as-is
+  return np.array(np.broadcast_to(x,(*bs,*np.shape(x)))) if bs else x
 
 # ------------------------------------------------------------------------------
 # population
@@ -177,6 +341,7 @@ def get_n_all(seeds,**kwds):
 def get_PX(P):
   # PX: risk group sizes (relative); N = (absolute, '000s)
   # PX.shape = (s:2, i:4, k:5, h:6, c:5)
+  bs = bshape(P)
   NX0   = np.array(243) # REF: WorldBank for Eswatini 1980 pop ('000s)
   PX0_k = np.array([1,0,0,0,0]).reshape([1,1,5,1,1])   # initial EPA
   PX0_h = np.array([1,0,0,0,0,0]).reshape([1,1,1,6,1]) # initial health
@@ -184,26 +349,26 @@ def get_PX(P):
   PX_h_hiv = np.array([0,5,65,30,0,0])*1e-6 # seed HIV; REF: assume
   PX_h_hiv[0] = 1 - PX_h_hiv.sum() # susceptible
   P = get_PX_swx(P)
-  PX_si = np.zeros((2,4)) # risk (sex/activity) groups
+  PX_si = np.zeros((*bs,2,4)) # risk (sex/activity) groups
   # FSW
-  PX_si[0,2] = P['PX_fsw'] * (1-P['PX_fsw_h'])
-  PX_si[0,3] = P['PX_fsw'] * P['PX_fsw_h']
+  PX_si[...,0,2] = P['PX_fsw'] * (1-P['PX_fsw_h'])
+  PX_si[...,0,3] = P['PX_fsw'] * P['PX_fsw_h']
   # clients
-  PX_si[1,3] = P['PX_cli'] * P['PX_cli_h']
-  PX_si[1,2] = P['PX_cli'] * (1-P['PX_cli_h'])
+  PX_si[...,1,3] = P['PX_cli'] * P['PX_cli_h']
+  PX_si[...,1,2] = P['PX_cli'] * (1-P['PX_cli_h'])
   # non-client men
-  PX_si[1,1] = P['PX_m_m'] * (1-P['PX_w'])
-  PX_si[1,0] = 1 - P['PX_w'] - PX_si[1,1:].sum()
+  PX_si[...,1,1] = P['PX_m_m'] * (1-P['PX_w'])
+  PX_si[...,1,0] = 1 - P['PX_w'] - PX_si[...,1,1:].sum(axis=-1)
   # non-FSW women
-  PX_si[0,1] = P['PX_w'] * P['PX_w_h'] - P['PX_fsw']
-  PX_si[0,0] = P['PX_w'] - PX_si[0,1:].sum()
+  PX_si[...,0,1] = P['PX_w'] * P['PX_w_h'] - P['PX_fsw']
+  PX_si[...,0,0] = P['PX_w'] - PX_si[...,0,1:].sum(axis=-1)
   return {
     'PX_m_cli': P['PX_cli'] / (1 - P['PX_w']), # % clients / men
-    'PX_s':  PX_si.sum(axis=1),                # % sex / overall
-    'PX_si': PX_si,                            # % activity & sex / pop
-    'PX_si_s': PX_si / PX_si.sum(axis=1)[:,_], # % activity / sex
-    'X0': NX0 * PX_si[:,:,_,_,_] * PX0_k * PX0_h * PX0_c, # full pop (t=0)
-    'PX_h_hiv': PX_h_hiv, # seed HIV
+    'PX_s':  PX_si.sum(axis=-1),                # % sex / overall
+    'PX_si': PX_si,                             # % activity & sex / pop
+    'PX_si_s': PX_si / PX_si.sum(axis=-1)[...,_], # % activity / sex
+    'X0': NX0 * PX_si[...,_,_,_] * PX0_k * PX0_h * PX0_c, # full pop (t=0)
+    'PX_h_hiv': bcopy(PX_h_hiv,bs), # seed HIV
   }
 
 def get_PX_swx(P):
@@ -213,9 +378,9 @@ def get_PX_swx(P):
   P['F_swo']    = 12  # see get_F()
   # calculating client size from total sex work acts
   P['PX_fsw']   = P['PX_w'] * P['PX_w_fsw']
-  P['XKF_swo']  = P['PX_fsw'] * P['C2K_p'][2] * P['F_swo'] * \
+  P['XKF_swo']  = P['PX_fsw'] * P['C2K_p'][...,2] * P['F_swo'] * \
     linear_comb(P['PX_fsw_h'],P['C1m_swo_fsw_h'],P['C1m_swo_fsw_l'])
-  P['XKF_swr']  = P['PX_fsw'] * P['C2K_p'][2] * P['F_swr'] * \
+  P['XKF_swr']  = P['PX_fsw'] * P['C2K_p'][...,2] * P['F_swr'] * \
     linear_comb(P['PX_fsw_h'],P['C1m_swr_fsw_h'],P['C1m_swr_fsw_l'])
   # XKF = total sex acts (pop x partners x sex freq)
   P['PX_cli'] = (P['XKF_swo'] + P['XKF_swr']) / P['KF_swx_cli']
@@ -224,8 +389,8 @@ def get_PX_swx(P):
 
 def get_birth_death(P):
   # birth rate: age 15+ entry; death rate: non-HIV mortality
-  death = np.array(1/35 + (1-.64)*.0144) # death rate ~ .034 for 15-49 years + non-HIV mortality
-  birth = ta.tarray([1980,2000,2010,2020,2050],np.array([.04,.03,.015,.015,P['growth_2050']])+death)
+  death = bcopy(np.array(1/35 + (1-.64)*.0144),bshape(P)) # death rate ~ .034 for 15-49 years + non-HIV mortality
+  birth = ta.tarray([1980,2000,2010,2020,2050],vec(.04,.03,.015,.015,P['growth_2050'])+death[...,_])
   return {
     'birth_t': birth,
     'death': death,
@@ -236,85 +401,120 @@ def get_turnover(P):
   # ei: size of group i among entrants; tij: turnover from i to j
   #  0, 1, 2, 3,   4,  5,  6,   7,  8,  9,  10, 11, 12,  13, 14, 15
   # e1,e2,e3,e4, t01,t02,t03, t10,t12,t13, t20,t21,t23, t30,t31,t32
-  # can't solve turnover here, because birth_t changes each timestep
-  PXe  = np.zeros((2,4))      # model entrants "e" (s,i)
-  turn = np.zeros((2,4,4))    # turnover matrix "t" (s,i.from,i.to)
-  b4   = np.eye(4,dtype=bool) # boolean I matrix (pre-compute for speed)
-  A = np.zeros((2,16,16))     # constraint matrix "A"
-  b = np.zeros((2,16))        # constraint vector "b"
+  # can't solve turnover here, because birth_t changes over time: see solve_turnover & get_Pt
+  bs = bshape(P)
+  A = np.zeros((*bs,2,16,16)) # constraint matrix "A"
+  b = np.zeros((*bs,2,16))    # constraint vector "b"
   for s in (0,1): # note: {variables} = NAN below computed at runtime in solve_turnover
-    x = P['PX_si'][s,:] # steady-state group size
+    x = [P['PX_si'][...,s,i] for i in range(4)] # steady-state group size
     p = (P['PX_fsw_h'],P['PX_cli_h'])[s] # 0.20 (assumed)
     dur = (P['dur_fsw'],P['dur_cli'])[s] # duration for FSW or clients
     # steady-state constraints
-    b[s,0:4] = NAN # x*{birth_t}
-    A[s,0,:] = (NAN,0,0,0,-x[0],-x[0],-x[0],+x[1],    0,    0,+x[2],    0,    0,+x[3],    0,    0)
-    A[s,1,:] = (0,NAN,0,0,+x[0],    0,    0,-x[1],-x[1],-x[1],    0,+x[2],    0,    0,+x[3],    0)
-    A[s,2,:] = (0,0,NAN,0,    0,+x[0],    0,    0,+x[1],    0,-x[2],-x[2],-x[2],    0,    0,+x[3])
-    A[s,3,:] = (0,0,0,NAN,    0,    0,+x[0],    0,    0,+x[1],    0,    0,+x[2],-x[3],-x[3],-x[3])
+    b[...,s,0:4] = NAN # x*{birth_t}
+    A[...,s,0,:] = vec(NAN,0,0,0,-x[0],-x[0],-x[0],+x[1],    0,    0,+x[2],    0,    0,+x[3],    0,    0)
+    A[...,s,1,:] = vec(0,NAN,0,0,+x[0],    0,    0,-x[1],-x[1],-x[1],    0,+x[2],    0,    0,+x[3],    0)
+    A[...,s,2,:] = vec(0,0,NAN,0,    0,+x[0],    0,    0,+x[1],    0,-x[2],-x[2],-x[2],    0,    0,+x[3])
+    A[...,s,3,:] = vec(0,0,0,NAN,    0,    0,+x[0],    0,    0,+x[1],    0,    0,+x[2],-x[3],-x[3],-x[3])
     # other constraints
-    A[s,4,0:4],b[s,4] = 1, x.sum() # e.sum = x.sum
-    A[s,5,1],b[s,5] = 1, x[1]*1.0 # e1 = x1
-    A[s,6,2],b[s,6] = 1, NAN # e2 = (x2+x3)*{R}
-    A[s,7,3],b[s,7] = 1, 0.0 # e3 = 0
-    A[s,8,10:12],b[s,8] = 1, (1/dur - P['death'])/(1-p) # dur 2 (adj for +3)
-    A[s,9,15],   b[s,9] = 1, (1/P['dur_sw_h'] - P['death']) # dur 3
-    A[s,10, 7],b[s,10] = 1, P['turn_xm_xl'] # t10
-    A[s,11, 6],b[s,11] = 1, 0.0 # t03 = 0
-    A[s,12, 9],b[s,12] = 1, 0.0 # t13 = 0
-    A[s,13,13],b[s,13] = 1, 0.0 # t30 = 0
-    A[s,14,14],b[s,14] = 1, 0.0 # t31 = 0
-    A[s,15, :],b[s,15] = (0,0,0,0, 0,0,0, 0,0,0, 0,0,1-p, 0,0,-p), p # t23*x2 - t32*x3 = x3*{birth_t}
+    A[...,s,4,0:4],b[...,s,4] = 1, sum(x) # e.sum = x.sum
+    A[...,s,5,1],b[...,s,5] = 1, x[1]*1.0 # e1 = x1
+    A[...,s,6,2],b[...,s,6] = 1, NAN # e2 = (x2+x3)*{R}
+    A[...,s,7,3],b[...,s,7] = 1, 0.0 # e3 = 0
+    A[...,s,8,10:12],b[...,s,8] = 1, (1/dur - P['death'])/(1-p) # dur 2 (adj for +3)
+    A[...,s,9,15],   b[...,s,9] = 1, (1/P['dur_sw_h'] - P['death']) # dur 3
+    A[...,s,10, 7],b[...,s,10] = 1, P['turn_xm_xl'] # t10
+    A[...,s,11, 6],b[...,s,11] = 1, 0.0 # t03 = 0
+    A[...,s,12, 9],b[...,s,12] = 1, 0.0 # t13 = 0
+    A[...,s,13,13],b[...,s,13] = 1, 0.0 # t30 = 0
+    A[...,s,14,14],b[...,s,14] = 1, 0.0 # t31 = 0
+    A[...,s,15, :],b[...,s,15] = (0,0,0,0, 0,0,0, 0,0,0, 0,0,1-p, 0,0,-p), p # t23*x2 - t32*x3 = x3*{birth_t}
   # print(np.array(sympy.Matrix(A[s,:,:]).rref()[0],dtype=float).round(3)) # DEBUG @ NAN = 0.03
   # print(np.linalg.matrix_rank(A)) # DEBUG ~= [16,16] @ NAN = 0.03
   return {
-    'PXe_si': PXe,
-    'turn_sii': turn,
     'turn_A_s': A,
     'turn_b_s': b,
-    'b4': b4,
   }
 
-def solve_turnover(P,t):
-  # replace NAN with runtime values (depend on birth_t) & solve "w" in A*w = b
-  v = P['birth_t'](t)
-  P['turn_b_s'][:,0:4]     = v * P['PX_si']
-  P['turn_A_s'][:,0:4,0:4] = v * P['b4']
+def solve_turnover(P,v):
+  # replace NAN with runtime values (depend on v = birth_t(t)) & solve "w" in A*w = b
+  # v.shape = (t:*, ...), e.g. (t:*, n:*) for a batch of params (see get_batch & get_Pt)
+  # returns entrant & turnover tables, e.g. (t:*, s:2, i:4) & (t:*, s:2, i:4, i':4)
+  # if we cannot solve (err > tol), entrants = -inf, so system.solve fails up front
+  b4 = np.eye(4,dtype=bool)
+  A = np.array(np.broadcast_to(P['turn_A_s'],np.broadcast_shapes(v.shape+(1,1,1),P['turn_A_s'].shape)))
+  b = np.array(np.broadcast_to(P['turn_b_s'],A.shape[:-1]))
+  b[...,0:4]     = v[...,_,_] * P['PX_si']
+  A[...,0:4,0:4] = v[...,_,_,_] * b4
   for s,R,dur in zip((0,1),(2.0,1.5),(P['dur_fsw'],P['dur_cli'])):
-    P['turn_b_s'][s,6]  = P['PX_si'][s,2:].sum() * np.minimum(R, (v - P['death'] + 1/dur) / v)
-    P['turn_b_s'][s,15] = v * P['PX_fsw_h']
-    w,err = nnls(P['turn_A_s'][s],P['turn_b_s'][s])  # non-negative least squares
-    P['PXe_si'][s] = w[0:4]                          # e: entrant group sizes
-    P['turn_sii'][s,np.logical_not(P['b4'])] = w[4:] # t: turnover matrix
-    if err > tol:
-      P['PXe_si'][s] = -np.inf # then system.solve will fail (gracefully)
-      # raise Exception('Cannot solve turnover (s={},t={},seed={}) error: {}'.format(s,t,P['id'],err))
-  return v,P['PXe_si'],P['turn_sii']
+    b[...,s,6]  = P['PX_si'][...,s,2:].sum(axis=-1) * np.minimum(R, (v - P['death'] + 1/dur) / v)
+    b[...,s,15] = v * P['PX_fsw_h']
+  w,err = nnls_t(A,b)
+  w[...,0:4][err > tol] = -np.inf
+  turn = np.zeros((*w.shape[:-1],4,4))
+  turn[...,~b4] = w[...,4:]
+  return {
+    'PXe_si': w[...,0:4], # e: entrant group sizes
+    'turn_sii': turn,     # t: turnover matrix
+  }
+
+def nnls_t(A,b):
+  # solve w in A*w = b for w >= 0 (nnls: non-negative least squares) for all t (first axis)
+  # A*w = b is rank-deficient, so nnls picks one of many solutions, but this choice (support)
+  # only changes at a few t, so we use nnls at the ends of t & then bisect until the support
+  # is the same at both ends, then solve the interior via least squares on that support
+  T,shape = A.shape[0],A.shape[1:-2]
+  A,b = A.reshape(T,-1,*A.shape[-2:]),b.reshape(T,-1,b.shape[-1])
+  w,err = np.zeros(b.shape[:-1]+A.shape[-1:]),np.zeros(b.shape[:-1])
+  def solve(i,j):
+    for ij in zip(np.ravel(i),np.ravel(j)):
+      w[ij],err[ij] = nnls(A[ij],b[ij])
+  js = np.arange(w.shape[1])
+  solve(*np.broadcast_arrays([0,T-1],js[:,_]))
+  segs = [(0,T-1,js)] # stack of (t-start, t-end, series)
+  while segs:
+    i0,i1,js = segs.pop()
+    if i1 - i0 < 2: continue
+    S = w[i0,js] > tol # support
+    same = (S == (w[i1,js] > tol)).all(axis=-1) & (err[i0,js] <= tol) & (err[i1,js] <= tol)
+    if same.any(): # interior via normal equations on the support, checked below
+      i,j,S = np.arange(i0+1,i1)[:,_],js[same],S[same]
+      Ai = A[i,j]
+      AA = np.where(S[:,:,_] & S[:,_,:],Ai.swapaxes(-1,-2) @ Ai,np.eye(S.shape[-1]))
+      wi = np.linalg.solve(AA,(Ai.swapaxes(-1,-2) @ b[i,j][...,_])[...,0] * S)
+      ok = (wi > -tol).all(axis=-1) & (abs((Ai @ wi[...,_])[...,0] - b[i,j]) < tol).all(axis=-1)
+      w[i,j] = np.maximum(wi,0)
+      same[same] = ok.all(axis=0)
+    if not same.all(): # bisect
+      im,js = (i0+i1)//2,js[~same]
+      solve(np.full(js.size,im),js)
+      segs += [(i0,im,js),(im,i1,js)]
+  return w.reshape(T,*shape,-1),err.reshape(T,*shape)
 
 # ------------------------------------------------------------------------------
 # force of infection
 
 def get_beta_a(P):
   # beta: probability of transmission per sex act
-  # beta_a.shape = (a:2, p:4, s:2, i:4, s':2, i':4, h':6, c':5, (t))
+  # beta_a.shape = (a:2, p:4, s:2, i:4, i':4, h':6, c':5, (t)), where s' = 1 - s (see foi.compact)
+  bs = bshape(P)
   Rbeta_ar = 10 # ar = anal receptive
-  Rbeta_as = np.array([[P['Rbeta_vi_rec'],1],[Rbeta_ar,1]]).reshape([2,1,2,1,1,1,1,1])
-  Rbeta_as = Rbeta_as / Rbeta_as[0,:].mean() # as = act, sex
+  Rbeta_as = vec(vec(P['Rbeta_vi_rec'],1),vec(Rbeta_ar,1),axis=-2)
+  Rbeta_as = (Rbeta_as / Rbeta_as[...,0,:].mean(axis=-1)[...,_,_]).reshape([*bs,2,1,2,1,1,1,1]) # as = act, sex
   # prevalence of GUD (genital ulcer disease)
   P_gud_0     = .07 # REF: SDHS2006
   P_gud_m     = linear_comb(P['iP_gud_h:l'],P_gud_0,P['P_gud_fsw_l'])
   P_gud_cli_l = linear_comb(.5,P_gud_m,P['P_gud_fsw_l'])
   P_gud_cli_h = P['P_gud_fsw_l']
-  P_gud = np.array([ # TODO: rename P_gud_si (?)
-    [P_gud_0, P_gud_m, P['P_gud_fsw_l'], P['P_gud_fsw_l']*P['RP_gud_fsw_h:l']], # MAN
-    [P_gud_0, P_gud_m, P_gud_cli_l, P_gud_cli_h], # MAN
-  ])
-  RP_gud_t = ta.tarray([1980,2000,2010,2030,2051],[1,1,1,*2*[P['RP_gud_2030']]])
+  P_gud = np.stack([ # TODO: rename P_gud_si (?)
+    vec(P_gud_0, P_gud_m, P['P_gud_fsw_l'], P['P_gud_fsw_l']*P['RP_gud_fsw_h:l']), # MAN
+    vec(P_gud_0, P_gud_m, P_gud_cli_l, P_gud_cli_h), # MAN
+  ],axis=-2)
+  RP_gud_t = ta.tarray([1980,2000,2010,2030,2051],vec(1,1,1,*2*[P['RP_gud_2030']])).reshape([*bs,1,1])
   # relative beta: health & care
-  Rbeta_h = np.array([0,P['Rbeta_acute'],1,1,P['Rbeta_350'],P['Rbeta_200']]).reshape([1,1,1,1,1,1,6,1])
-  Rbeta_c = np.array([1,1,1-(1-P['Rbeta_uvls'])/2,P['Rbeta_uvls'],.00]).reshape([1,1,1,1,1,1,1,5])
+  Rbeta_h = vec(0,P['Rbeta_acute'],1,1,P['Rbeta_350'],P['Rbeta_200']).reshape([*bs,1,1,1,1,1,6,1])
+  Rbeta_c = vec(1,1,1-(1-P['Rbeta_uvls'])/2,P['Rbeta_uvls'],.00).reshape([*bs,1,1,1,1,1,1,5])
   return {
-    'beta_a': P['beta_0'] * Rbeta_as * Rbeta_h * Rbeta_c,
+    'beta_a': expand(P['beta_0'],7) * Rbeta_as * Rbeta_h * Rbeta_c,
     'Rbeta_as': Rbeta_as,
     'Rbeta_h': Rbeta_h,
     'P_gud': P_gud,
@@ -323,28 +523,32 @@ def get_beta_a(P):
   }
 
 def constr_acute(P):
-  return 1 <= P['Rbeta_acute'] * P['dur_acute'] <= 63 # REF: Bellan2015
+  Rbeta_dur = P['Rbeta_acute'] * P['dur_acute']
+  return (1 <= Rbeta_dur) & (Rbeta_dur <= 63) # REF: Bellan2015
 
 def constr_gud(P):
   return (
-    P['P_gud_fsw_l'] > .07 and # REF: SDHS2006
-    P['P_gud_fsw_l'] * P['RP_gud_fsw_h:l'] < 1
+    (P['P_gud_fsw_l'] > .07) & # REF: SDHS2006
+    (P['P_gud_fsw_l'] * P['RP_gud_fsw_h:l'] < 1)
   )
 
 def get_F(P):
   # F: frequency of sex per-partnership, dur: partnership duration
   # F_ap.shape = (a:2, p:4)
-  PF_ai = P['PF_ai_mcx'] * np.array([1,1,P['RPF_ai_swx:mcx'],P['RPF_ai_swx:mcx']])
-  F_p   = np.array([ P['F_msp'], P['F_msp']*P['RF_cas:msp'], 12, P['F_swr'] ])
-  F_ap  = F_p.reshape([1,4]) * np.array([1-PF_ai,PF_ai]).reshape([2,4])
-  dur_p = np.array([ P['dur_msp'], P['dur_cas'], 1/12, P['dur_swr'] ])
+  PF_ai = expand(P['PF_ai_mcx'],1) * vec(1,1,P['RPF_ai_swx:mcx'],P['RPF_ai_swx:mcx'])
+  F_p   = vec( P['F_msp'], P['F_msp']*P['RF_cas:msp'], 12, P['F_swr'] )
+  F_ap  = F_p[...,_,:] * np.stack([1-PF_ai,PF_ai],axis=-2)
+  dur_p = vec( P['dur_msp'], P['dur_cas'], 1/12, P['dur_swr'] )
   dur_p_1 = np.minimum(dur_p,1) # for foi.cases = ('ry','py')
+  A_ap, A_ap_1 = F_ap * dur_p[...,_,:], F_ap * dur_p_1[...,_,:] # sex acts per partnership, as for dur_p
   # C2K = factor to convert reported (C) -> current (K) given recall periods (in years)
   C2K_p = dur_p / (dur_p + np.array([1, 1, 1/12, 1/12]))
   return {
     'F_ap': F_ap,
     'dur_p': dur_p,
     'dur_p_1': dur_p_1,
+    'A_ap': A_ap,
+    'A_ap_1': A_ap_1,
     'C2K_p': C2K_p,
   }
 
@@ -360,40 +564,41 @@ def get_K(P):
   # K: current partner numbers
   # K.shape = (p:4, s:2, i:4)
   PX_si = P['PX_si']
-  F = np.squeeze(P['F_ap'].sum(axis=0))
-  K_psi = np.zeros((4,2,4,1)) # TODO: need singleton?
+  F = P['F_ap'].sum(axis=-2)
+  K_psi = np.zeros((*bshape(P),4,2,4))
   # main / spousal
-  K_psi[0,0,0] = P['C12m_msp_xl']
-  K_psi[0,0,1] = P['C12m_msp_xl']
-  K_psi[0,0,2] = 0.5
-  K_psi[0,0,3] = 0.5
-  K_psi[0,1,0] = P['C12m_msp_xl']
-  K_psi[0,1,2] = P['C12m_msp_xl'] * .5
-  K_psi[0,1,3] = P['C12m_msp_xl'] * .5
-  K_psi[0,1,1] = (K_psi[0,0,:] * PX_si[0,:,_] - K_psi[0,1,:] * PX_si[1,:,_]).sum() / PX_si[1,1]
-  K_psi[0] *= P['C2K_p'][0]
+  K_psi[...,0,0,0] = P['C12m_msp_xl']
+  K_psi[...,0,0,1] = P['C12m_msp_xl']
+  K_psi[...,0,0,2] = 0.5
+  K_psi[...,0,0,3] = 0.5
+  K_psi[...,0,1,0] = P['C12m_msp_xl']
+  K_psi[...,0,1,2] = P['C12m_msp_xl'] * .5
+  K_psi[...,0,1,3] = P['C12m_msp_xl'] * .5
+  K_psi[...,0,1,1] = (K_psi[...,0,0,:] * PX_si[...,0,:] - K_psi[...,0,1,:] * PX_si[...,1,:]).sum(axis=-1) / PX_si[...,1,1]
+  K_psi[...,0,:,:] *= P['C2K_p'][...,0,_,_]
   # casual
-  K_psi[1,0,0] = P['C12m_cas_xl']
-  K_psi[1,0,1] = P['C12m_cas_wm']
-  K_psi[1,0,2] = 0.5
-  K_psi[1,0,3] = 1.0
-  K_psi[1,1,0] = P['C12m_cas_xl']
-  K_psi[1,1,2] = P['C12m_cas_wm'] * P['RC_cas_cli:wm']
-  K_psi[1,1,3] = P['C12m_cas_wm'] * P['RC_cas_cli:wm']
-  K_psi[1,1,1] = (K_psi[1,0,:] * PX_si[1,:,_] - K_psi[1,1,:] * PX_si[1,:,_]).sum() / PX_si[1,1]
-  K_psi[1] *= P['C2K_p'][1]
+  K_psi[...,1,0,0] = P['C12m_cas_xl']
+  K_psi[...,1,0,1] = P['C12m_cas_wm']
+  K_psi[...,1,0,2] = 0.5
+  K_psi[...,1,0,3] = 1.0
+  K_psi[...,1,1,0] = P['C12m_cas_xl']
+  K_psi[...,1,1,2] = P['C12m_cas_wm'] * P['RC_cas_cli:wm']
+  K_psi[...,1,1,3] = P['C12m_cas_wm'] * P['RC_cas_cli:wm']
+  K_psi[...,1,1,1] = (K_psi[...,1,0,:] * PX_si[...,1,:] - K_psi[...,1,1,:] * PX_si[...,1,:]).sum(axis=-1) / PX_si[...,1,1]
+  K_psi[...,1,:,:] *= P['C2K_p'][...,1,_,_]
   # swx: fsw
-  K_psi[2,0,2] = P['C2K_p'][2] * P['C1m_swo_fsw_l']
-  K_psi[2,0,3] = P['C2K_p'][2] * P['C1m_swo_fsw_h']
-  K_psi[3,0,2] = P['C2K_p'][3] * P['C1m_swr_fsw_l']
-  K_psi[3,0,3] = P['C2K_p'][3] * P['C1m_swr_fsw_h']
+  K_psi[...,2,0,2] = P['C2K_p'][...,2] * P['C1m_swo_fsw_l']
+  K_psi[...,2,0,3] = P['C2K_p'][...,2] * P['C1m_swo_fsw_h']
+  K_psi[...,3,0,2] = P['C2K_p'][...,3] * P['C1m_swr_fsw_l']
+  K_psi[...,3,0,3] = P['C2K_p'][...,3] * P['C1m_swr_fsw_h']
   # swx: clients
-  wPX = (PX_si[1,2] + P['RKF_swx_cli_h:l'] * PX_si[1,3])
-  K_psi[2,1,2] = P['XKF_swo'] / F[2] / wPX
-  K_psi[2,1,3] = P['XKF_swo'] / F[2] / wPX * P['RKF_swx_cli_h:l']
-  K_psi[3,1,2] = P['XKF_swr'] / F[3] / wPX
-  K_psi[3,1,3] = P['XKF_swr'] / F[3] / wPX * P['RKF_swx_cli_h:l']
-  KF_psi = K_psi.sum(axis=3) * F[:,_,_]
+  wPX = (PX_si[...,1,2] + P['RKF_swx_cli_h:l'] * PX_si[...,1,3])
+  K_psi[...,2,1,2] = P['XKF_swo'] / F[...,2] / wPX
+  K_psi[...,2,1,3] = P['XKF_swo'] / F[...,2] / wPX * P['RKF_swx_cli_h:l']
+  K_psi[...,3,1,2] = P['XKF_swr'] / F[...,3] / wPX
+  K_psi[...,3,1,3] = P['XKF_swr'] / F[...,3] / wPX * P['RKF_swx_cli_h:l']
+  K_psi = K_psi[...,_] # TODO: need singleton?
+  KF_psi = K_psi.sum(axis=-1) * F[...,:,_,_]
   # aK_pk: K reduction for ptr-type "p" in EPA stratum "k"
   aK_pk = np.array([[0,1,0,0,0],[0,0,1,0,0],[0,0,0,1,0],[0,0,0,0,1]]).reshape([4,1,1,5])
   aK_pk = aK_pk * (K_psi > 0) # don't reduce partners that don't exist
@@ -406,13 +611,14 @@ def get_K(P):
 def get_condom(P):
   k = 'PF_condom_' # convenience
   R = P['RPF_condom_1996'] # allow more variation vs linear interp to 2002/06
-  PF_condom_t = ta.tarray([1980,1988,1996,2002,2006,2011,2014,2016,2050],
-    [[0,  0,R*P[k+'msp_2006'],NAN,P[k+'msp_2006'],NAN,NAN,*2*[P[k+'msp_2016']] ], # main
-     [0,  0,R*P[k+'cas_2006'],NAN,P[k+'cas_2006'],NAN,NAN,*2*[P[k+'cas_2016']] ], # casual
-     [0,NAN,R*P[k+'swo_2002'],P[k+'swo_2002'],NAN,P[k+'swo_2011'],*3*[P[k+'swo_2014']] ], # sw-new
-     [0,NAN,R*P[k+'swr_2002'],P[k+'swr_2002'],NAN,P[k+'swr_2011'],*3*[P[k+'swr_2014']] ]] # sw-reg
-  ).reshape([1,4,1,1,1,1,1,1])
-  RPF_condom_a = np.array([1,P['RPF_condom_a:v']]).reshape([2,1,1,1,1,1,1,1])
+  bs = bshape(P)
+  PF_condom_t = ta.tarray([1980,1988,1996,2002,2006,2011,2014,2016,2050],np.stack(
+    [vec(0,  0,R*P[k+'msp_2006'],NAN,P[k+'msp_2006'],NAN,NAN,*2*[P[k+'msp_2016']] ), # main
+     vec(0,  0,R*P[k+'cas_2006'],NAN,P[k+'cas_2006'],NAN,NAN,*2*[P[k+'cas_2016']] ), # casual
+     vec(0,NAN,R*P[k+'swo_2002'],P[k+'swo_2002'],NAN,P[k+'swo_2011'],*3*[P[k+'swo_2014']] ), # sw-new
+     vec(0,NAN,R*P[k+'swr_2002'],P[k+'swr_2002'],NAN,P[k+'swr_2011'],*3*[P[k+'swr_2014']] )],axis=-2) # sw-reg
+  ).reshape([*bs,1,4,1,1,1,1,1])
+  RPF_condom_a = vec(1,P['RPF_condom_a:v']).reshape([*bs,2,1,1,1,1,1,1])
   return {
     'PF_condom_t': PF_condom_t,
     'RPF_condom_a': RPF_condom_a,
@@ -423,58 +629,61 @@ def constr_condom(P):
   k = 'PF_condom_'
   return (
     # across years (same type)
-    P[k+'msp_2006'] < P[k+'msp_2016'] and
-    P[k+'cas_2006'] < P[k+'cas_2016'] and
-    P[k+'swo_2002'] < P[k+'swo_2011'] < P[k+'swo_2014'] and
-    P[k+'swr_2002'] < P[k+'swr_2011'] < P[k+'swr_2014'] and
+    (P[k+'msp_2006'] < P[k+'msp_2016']) &
+    (P[k+'cas_2006'] < P[k+'cas_2016']) &
+    (P[k+'swo_2002'] < P[k+'swo_2011']) & (P[k+'swo_2011'] < P[k+'swo_2014']) &
+    (P[k+'swr_2002'] < P[k+'swr_2011']) & (P[k+'swr_2011'] < P[k+'swr_2014']) &
     # across types (same year)
-    P[k+'msp_2006'] < P[k+'cas_2006'] and
-    P[k+'msp_2016'] < P[k+'cas_2016'] and
-    P[k+'swr_2002'] < P[k+'swo_2002'] and
-    P[k+'swr_2011'] < P[k+'swo_2011'] and
-    P[k+'swr_2014'] < P[k+'swo_2014']
+    (P[k+'msp_2006'] < P[k+'cas_2006']) &
+    (P[k+'msp_2016'] < P[k+'cas_2016']) &
+    (P[k+'swr_2002'] < P[k+'swo_2002']) &
+    (P[k+'swr_2011'] < P[k+'swo_2011']) &
+    (P[k+'swr_2014'] < P[k+'swo_2014'])
   )
 
 def get_circumcision(P):
   # Rbeta_circum.shape = (a:2, s:2)
   # REF: (SHIMS2), SDHS2006, Bicego2013, MICS2014, SHIMS2, "COP20", assume
+  bs = bshape(P)
   PF_circum_t = ta.tarray(
      [1980.0,2006.5,2011.0,2014.8,2016.5,2020.0,2050,2051],
-     [  .007,  .082,  .171,  .250,  .300,  .370,*2*[P['PF_circum_2050']]]
-  ).reshape([1,1,1,1,1,1,1,1])
+  vec(  .007,  .082,  .171,  .250,  .300,  .370,*2*[P['PF_circum_2050']])
+  ).reshape([*bs,1,1,1,1,1,1,1])
   Rbeta_circum =  np.array([ # women, men
       [1,.50], # vaginal; REF: Boily2009,Hughes2012,Patel2014
       [1,.27], # anal; REF Wiysonge2011
-    ]).reshape([2,1,2,1,1,1,1,1])
+    ]).reshape([2,1,2,1,1,1,1])
   return {
     'PF_circum_t': PF_circum_t,
-    'Rbeta_circum': Rbeta_circum,
+    'Rbeta_circum': bcopy(Rbeta_circum,bs),
   }
 
 def get_mix(P):
   # pref_pii: log-likelihood of mixing of i with i' for ptr-type p
   # pref_pii.shape = (p:4, i:4, i':4)
-  pref_pii = np.zeros((4,4,4))
-  pref_pii[0,0,0] = np.exp(P['lpref_msp_xl'])
-  pref_pii[0:2,2:,2:] = np.exp(P['lpref_mcx_swx'])
+  bs = bshape(P)
+  pref_pii = np.zeros((*bs,4,4,4))
+  pref_pii[...,0,0,0] = np.exp(P['lpref_msp_xl'])
+  pref_pii[...,0:2,2:,2:] = expand(np.exp(P['lpref_mcx_swx']),3)
   return {
     'pref_pii': pref_pii,
-    'mix': np.zeros((4,2,4,2,4)), # initialize
-    'mix_mask': np.ones((4,2,4,2,4)), # for tpaf
-    't0_tpaf': np.inf,
+    'mix': np.zeros((*bs,4,2,4,4)), # initialize (see foi.compact)
+    'mix_mask': np.ones((*bs,4,2,4,4)), # for tpaf
+    't0_tpaf': bcopy(np.inf,bs),
   }
 
 def get_mix_mask(mask=None,p=None,fs=None,fi=None,ts=None,ti=None):
   # disable (mask) transmission via selected pathways;
   # p: ptr-type; f*: from; t*: to; *s: sex; *i: activity
-  if mask is None: mask = np.ones((4,2,4,2,4))
+  # mask is compact (see foi.compact), but we select pathways as if it were full
+  mask = np.ones((4,2,4,2,4)) if mask is None else foi.full(mask)
   if p  is None: p  = slice(None)
   if fs is None: fs = slice(None)
   if fi is None: fi = slice(None)
   if ts is None: ts = slice(None)
   if ti is None: ti = slice(None)
   mask[p,ts,ti,fs,fi] = 0
-  return mask
+  return foi.compact(mask)
 
 # ------------------------------------------------------------------------------
 # HIV
@@ -482,7 +691,8 @@ def get_mix_mask(mask=None,p=None,fs=None,fi=None,ts=None,ti=None):
 def get_hiv_prog(P):
   # h: sus, acute, >500, <500, <350, <200 (AIDS)
   # c: undiag, diag, unlinked, on art, vls
-  dur_h  = np.array([P['dur_acute'],3.5-P['dur_acute'],3.74,5.26]).reshape([1,1,1,4,1]) # REF: Lodi2011,Mangal2017
+  bs = bshape(P)
+  dur_h  = vec(P['dur_acute'],3.5-P['dur_acute'],3.74,5.26).reshape([*bs,1,1,1,4,1]) # REF: Lodi2011,Mangal2017
   prog_h = 1/dur_h # progression rate = 1 / mean duration
   unprog_h = np.array([[2,.1],[2,.1],[1.5,.1]]).reshape([1,1,1,3,2]) # REF: Battegay2006,Lawn2006
   death_h = np.array([0,0,.004,.02,.04,.20]).reshape([1,1,1,6,1]) # REF: Badri2006,Anglaret2012,Mangal2017
@@ -490,8 +700,8 @@ def get_hiv_prog(P):
   return {
     'dur_h': dur_h,
     'prog_h': prog_h, # untreated HIV progression
-    'unprog_h': unprog_h, # treated HIV
-    'death_hc': death_h * Rdeath_c, # HIV death
+    'unprog_h': bcopy(unprog_h,bs), # treated HIV
+    'death_hc': bcopy(death_h * Rdeath_c,bs), # HIV death
   }
 
 # ------------------------------------------------------------------------------
@@ -499,40 +709,42 @@ def get_hiv_prog(P):
 
 def get_diag(P):
   # dx: diagnosis rates (by group & time)
+  bs = bshape(P)
   t_dx = [1980,1990,2002,2006,2011,2016,2051]
-  dx_wq_t = np.array([0,0,P['dx_w_2002'],P['dx_w_2006'],P['dx_wq_2011'],
-    *2*[P['dx_wq_2011']*(1+P['aRdx_wq_16:11'])]])
-  Rdx_wq_t  = np.array([1,1,1,1,1,1,1]) # dummy
-  Rdx_fsw_t = np.array([1,1,1,1,1+P['aRdx_fsw:wq_2011'],*2*[1+P['aRdx_fsw:wq_2016']]])
-  Rdx_m_t   = np.array([1,1,0.1,P['Rdx_m:w_2006'],*3*[P['Rdx_m:wq_2011']]])
-  dx_sit = ta.tarray(t_dx,P['Rdx_global']*dx_wq_t*np.array(
-    [[Rdx_wq_t,Rdx_wq_t,Rdx_fsw_t,Rdx_fsw_t],
-     [ Rdx_m_t, Rdx_m_t,  Rdx_m_t,  Rdx_m_t]])).reshape([2,4,1,1])
+  dx_wq_t = vec(0,0,P['dx_w_2002'],P['dx_w_2006'],P['dx_wq_2011'],
+    *2*[P['dx_wq_2011']*(1+P['aRdx_wq_16:11'])])
+  Rdx_wq_t  = bcopy(np.array([1,1,1,1,1,1,1]),bs) # dummy
+  Rdx_fsw_t = vec(1,1,1,1,1+P['aRdx_fsw:wq_2011'],*2*[1+P['aRdx_fsw:wq_2016']])
+  Rdx_m_t   = vec(1,1,0.1,P['Rdx_m:w_2006'],*3*[P['Rdx_m:wq_2011']])
+  dx_sit = ta.tarray(t_dx,expand(P['Rdx_global'],3)*dx_wq_t[...,_,_,:]*np.stack(
+    [np.stack([Rdx_wq_t,Rdx_wq_t,Rdx_fsw_t,Rdx_fsw_t],axis=-2),
+     np.stack([ Rdx_m_t, Rdx_m_t,  Rdx_m_t,  Rdx_m_t],axis=-2)],axis=-3)).reshape([*bs,2,4,1,1])
   return {
     'dx_sit': dx_sit,
   }
 
 def get_treat(P):
   # tx: treatment rates (by group, HIV stage, & time)
-  Rtx_si = np.array([[1,1,P['Rtx_fsw:wq'],P['Rtx_fsw:wq']],[1,1,1,1]]).reshape([2,4,1,1,1])
+  bs = bshape(P)
+  Rtx_si = vec(vec(1,1,P['Rtx_fsw:wq'],P['Rtx_fsw:wq']),vec(1,1,1,1),axis=-2).reshape([*bs,2,4,1,1,1])
   tx_sit = ta.tarray([1980,2003,2010,2012,2018,2051],
-    Rtx_si * np.array([0,0,P['tx_2010'],P['tx_2012'],12,12]).reshape([1,1,1,1,6]))
+    Rtx_si * vec(0,0,P['tx_2010'],P['tx_2012'],12,12).reshape([*bs,1,1,1,1,6]))
   Rtx_ht = ta.tarray(
-     [1980,2003,2004,2010,2011,2015,2016,2017,2018,2051],
+     [1980,2003,2004,2010,2011,2015,2016,2017,2018,2051],bcopy(np.array(
     [[   0,   0,   0,   0,   0,   0,   0,   0,   1,   1], # acute:           scale-up 2017-2018
      [   0,   0,   0, .05, .05, .05, .05, .15,   1,   1], # cd4 > 500:       scale-up 2017-2018
      [   0,   0, .15, .15, .15, .15,   1,   1,   1,   1], # 350 < cd4 < 500: scale-up 2015-2016
      [   0,   0, .35, .35,   1,   1,   1,   1,   1,   1], # 200 < cd4 < 350: scale-up 2010-2011
-     [   0,   0,   1,   1,   1,   1,   1,   1,   1,   1]] # cd4 < 200:       scale-up 2003-2004
-  ).reshape([1,1,1,5])
+     [   0,   0,   1,   1,   1,   1,   1,   1,   1,   1]]),bs) # cd4 < 200:       scale-up 2003-2004
+  ).reshape([*bs,1,1,1,5])
   # vx: viral suppression; unvx: treatment fail/discontinue; revx: re-suppress
   vx = np.array(1/P['ivx'])
-  Runvx_si = np.array([
-    [1,1,P['Runvx_fsw:wq'],P['Runvx_fsw:wq']],
-    [P['Runvx_m:wq'],P['Runvx_m:wq'],P['Runvx_m:wq'],P['Runvx_m:wq']]]).reshape([2,4,1,1,1])
+  Runvx_si = np.stack([
+    vec(1,1,P['Runvx_fsw:wq'],P['Runvx_fsw:wq']),
+    vec(P['Runvx_m:wq'],P['Runvx_m:wq'],P['Runvx_m:wq'],P['Runvx_m:wq'])],axis=-2).reshape([*bs,2,4,1,1,1])
   unvx_sit = ta.tarray([1980,2010,2018,2051],
     Runvx_si * np.array([.15,.15,.05,.05]).reshape([1,1,1,1,4]))
-  revx_t = ta.tarray([1980,2010,2018,2051],P['revx_2010']*np.array([1,1,1.5,1.5]))
+  revx_t = ta.tarray([1980,2010,2018,2051],expand(P['revx_2010'],1)*np.array([1,1,1.5,1.5])).reshape([*bs,1,1,1,1])
   return {
     'tx_sit': tx_sit,
     'Rtx_ht': Rtx_ht,
@@ -542,9 +754,6 @@ def get_treat(P):
   }
 
 def get_scen(P):
-  # relative rates (dx, tx, unvx) for scenarios
-  return {
-    'Rdx_scen': np.ones((2,4,1,1)),
-    'Rtx_scen': np.ones((2,4,1,1)),
-    'Rux_scen': np.ones((2,4,1,1)),
-  }
+  # relative rates (dx, tx, unvx) for scenarios; overrides already in P are kept (see load_Ps)
+  bs = bshape(P)
+  return {k:P.get(k,np.ones((*bs,2,4,1,1))) for k in ('Rdx_scen','Rtx_scen','Rux_scen')}
@@ -124,11 +124,11 @@ def plot_S(fun,t,R,skey,box=False,**kwds):
   kwds.update(color=kwds.pop('color',S.color))
   kwds.update(label=kwds.pop('label',S.label))
   fkwds = dict_split(kwds,fkeys) # pop non-plotting kwds
-  if isinstance(fun,str): fun = out.by_name(fun)
-  if isinstance(R,list):
-    xs = [fun(Ri,**S.ind,**fkwds) for Ri in R]
+  if isinstance(R,(list,out.ResultSet)):
+    xs = out.rmap(fun,R,S.ind,**fkwds)
     ribbon_or_box(t,xs,box=box,**kwds)
   else:
+    if isinstance(fun,str): fun = out.by_name(fun)
     x = fun(R,**S.ind,**fkwds)
     line(t,x,**kwds)
 
@@ -140,7 +140,10 @@ def plot_vS(fun,t,R,skey1,skey2,vsop,box=False,**kwds):
   kwds.update(color=kwds.pop('color',clr_interp(S1.color,S2.color)))
   kwds.update(label=kwds.pop('label',out.vs_label(S1.label,S2.label,vsop)))
   fkwds = dict_split(kwds,fkeys)
-  if isinstance(R,list):
+  if isinstance(R,out.ResultSet):
+    xs = out.vs_fun(out.rmap(fun,R,S1.ind,**fkwds),out.rmap(fun,R,S2.ind,**fkwds),vsop)
+    ribbon_or_box(t,xs,box=box,**kwds)
+  elif isinstance(R,list):
     xs = [out.vs_ind(fun,Ri,S1.ind,S2.ind,vsop,**fkwds) for Ri in R]
     ribbon_or_box(t,xs,box=box,**kwds)
   else:
@@ -154,7 +157,10 @@ def plot_SvR(fun,t,R1,R2,skey,vsop,box=False,**kwds):
   kwds.update(color=kwds.pop('color',S.color))
   kwds.update(label=kwds.pop('label',S.label))
   fkwds = dict_split(kwds,fkeys)
-  if isinstance(R1,list):
+  if isinstance(R1,out.ResultSet): # paired runs
+    xs = out.vs_fun(out.rmap(fun,R1,S.ind,**fkwds),out.rmap(fun,R2,S.ind,**fkwds),vsop)
+    ribbon_or_box(t,xs,box=box,**kwds)
+  elif isinstance(R1,list):
     xs = [out.vs_R(fun,R1i,R2i,vsop,**S.ind,**fkwds) for R1i,R2i in zip(R1,R2)]
     ribbon_or_box(t,xs,box=box,**kwds)
   else:
@@ -20,7 +20,7 @@ tvec = dict(
 )
 
 def fname(ftype,phase,key,case='base',b='all'):
-  # ftype: file type (npy, csv, fig)
+  # ftype: file type (npy, npz, csv, fig)
   # phase: stage of analysis pipeline (e.g. imis, fit, art-*, foi-*)
   # key:   unique id for the thing to save / load (e.g. Ps, expo, wiw)
   # case:  unique id for param variant used (e.g. base, foi-*, ...)
@@ -28,11 +28,13 @@ def fname(ftype,phase,key,case='base',b='all'):
   subdirs = [uid,nid]
   if ftype=='npy':
     path,ext = ['data','npy',*subdirs],'.npy'
+  if ftype=='npz':
+    path,ext = ['data','npy',*subdirs],'.npz'
   if ftype=='csv':
     path,ext = ['data','csv',*subdirs],'.csv'
   if ftype=='fig':
     path,ext = ['out','fig',*subdirs],'.pdf'
-  # e.g. data/npy/2023-01-01/h1000i25b50/fit_Ps_base_3.npy
+  # e.g. data/npy/2023-01-01/h1000i25b50/fit_Ps_base_3.npz
   return genpath(rootpath(*path,'{}_{}_{}_{}{}'.format(phase,key,case,b,ext)))
 
 def get_seeds(b):
@@ -21,11 +21,11 @@ ekwds = dict(
 def run_rf(b):
   case = cases[b]
   log(0,'art.run_rf: {}'.format(case))
-  P0s = fio.load_npy(fname('npy','fit','Ps',case='base'))
+  P0s = params.load_Ps(fname('npz','fit','Ps',case='base'))
   T = get_refit_T(case+'all-')
   fun = lambda P: run_rf_1(P,T,tvec['cal'])
   Ps = ppool().map(fun,P0s); log(1)
-  fio.save_npy(fname('npy','art-rf','Ps',case=case),Ps)
+  params.save_Ps(fname('npz','art-rf','Ps',case=case),Ps)
 
 def rerun_rf():
   log(0,'art.rerun_rf')
@@ -33,8 +33,8 @@ def rerun_rf():
     log(1,case)
     base = (case == 'base')
     T = get_refit_T('all+' if base else case+'all-')
-    Ps = fio.load_npy(fname('npy','fit' if base else 'art-rf','Ps',case=case))
-    R1s = system.run_n(Ps,t=tvec['main'],T=T)
+    Ps = params.load_Ps(fname('npz','fit' if base else 'art-rf','Ps',case=case))
+    R1s = out.ResultSet(system.run_n(Ps,t=tvec['main'],T=T))
     fio.save_csv(fname('csv','art-rf','wiw',case=case),out.wiw(R1s,**tkp))
     fio.save_csv(fname('csv','art-rf','expo',case=case),out.expo(R1s,**tkp,**ekwds))
     fit.plot_sets(tvec['main'],R1s,T=T,tfname=fname('fig','art-rf','{}',case=case),
@@ -92,15 +92,15 @@ def Rxs_update(P,Pu,q=None,**kwds):
 
 def run_ss(Ns=10,seed=0):
   log(0,'art.run_ss')
-  P0s = fio.load_npy(fname('npy','fit','Ps'))
+  P0s = params.load_Ps(fname('npz','fit','Ps'))
   Ps = get_sens_sample(P0s,Ns,seed=seed)
-  Rs = system.run_n(Ps,t=tvec['main'])
+  Rs = out.ResultSet(system.run_n(Ps,t=tvec['main']))
   fio.save_csv(fname('csv','art-ss','wiw',case='sens'),out.wiw(Rs,**tkp))
   fio.save_csv(fname('csv','art-ss','P0s',case='sens'),get_par_expo(P0s,
     keys=[*params.def_sample_distrs().keys(),'PX_fsw','PX_cli','EHY_acute']))
   # TODO: base expo too?
   fio.save_csv(fname('csv','art-ss','expo',case='sens'),merge_expo([
-      out.expo([R for R in Rs if R['P']['ss']==ss],ecols=dict(ss=ss),**tko,**ekwds)
+      out.expo(Rs.take([R['P']['ss']==ss for R in Rs.Rs]),ecols=dict(ss=ss),**tko,**ekwds)
       for ss in range(Ns)]))
   fit.plot_sets(tvec['main'],Rs,tfname=fname('fig','art-ss','{}',case='sens'),
     sets='cascade',skeys=['all','aq','fsw','cli'])
@@ -1,6 +1,6 @@
 from copy import copy
 from utils import log,fio,dict_list_update
-from model import system,out,tpaf
+from model import system,params,out,tpaf
 from model.scenario import tvec,fname
 
 cases = ['base','foi-rd','foi-ry','foi-py']
@@ -31,10 +31,10 @@ tpaf_kwds = dict(
 
 def run_ep():
   log(0,'foi.run_ep: '+', '.join(cases))
-  Ps = fio.load_npy(fname('npy','fit','Ps',case='base'))
+  Ps = params.load_Ps(fname('npz','fit','Ps',case='base'))
   for case in cases:
     log(1,case)
-    R1s = system.run_n(dict_list_update(Ps,foi_mode=case.replace('foi-','')),t=tvec['main'])
+    R1s = out.ResultSet(system.run_n(dict_list_update(Ps,foi_mode=case.replace('foi-','')),t=tvec['main']))
     E = out.expo(R1s,**tkp,**ep_ekwds)
     fio.save_csv(fname('csv','foi-ep','wiw',case=case),out.wiw(R1s,**tkp))
     if case == 'base':
@@ -47,6 +47,6 @@ def run_ep():
 
 def run_tpaf(case):
   log(0,'foi.run_tpaf: '+case)
-  Ps = fio.load_npy(fname('npy','fit','Ps',case=case))
+  Ps = params.load_Ps(fname('npz','fit','Ps',case=case))
   E = tpaf.run(Ps,**tkp,**tpaf_kwds)
   fio.save_csv(fname('csv','tpaf','expo',case=case),E)
@@ -1,7 +1,7 @@
 import numpy as np
 from copy import deepcopy
 from utils import _,log,tarray,fio
-from model import system,out,fit
+from model import system,params,out,fit
 from model.scenario import fname
 
 tf = 2050
@@ -40,7 +40,8 @@ def edit_tarray(Xo,te,xe):
     np.concatenate((Xo.xi[...,b],xe),axis=-1))
 
 def apply_RR4(x4,RR,recov):
-  RR = np.reshape(RR,x4[...,0].shape)
+  # x4 is batched (see get_scen), so RR has the shape of each P's tarray
+  RR = np.reshape(RR,x4.shape[1:-1])
   x4[...,-4] *= RR
   x4[...,-3] *= RR
   x4[...,-2] *= (RR + (1-RR)*recov)
@@ -48,37 +49,46 @@ def apply_RR4(x4,RR,recov):
   return x4
 
 def get_scen(Ps,adjs,t5,recov=1):
-  for P in Ps:
-    if 'cdm' in adjs:
-      x4 = P['PF_condom_t']([t5[0]]*4)
-      x4 = apply_RR4(x4,[.75,.50,.25,.50],recov)
-      P['PF_condom_t'] = edit_tarray(P['PF_condom_t'],t5,x4)
-    # TODO: PF_circum_t ?
-    if 'dx' in adjs:
-      x4 = P['dx_sit']([t5[0]]*4)
-      x4 = apply_RR4(x4,[[.60,.60,.40,.40],[.40,.40,.40,.40]],recov)
-      P['dx_sit'] = edit_tarray(P['dx_sit'],t5,x4)
-    if 'unvx' in adjs:
-      x4 = P['unvx_sit']([t5[0]]*4)
-      x4 = apply_RR4(x4,[[1.5,1.5,3.0,3.0],[2.0,2.0,2.0,2.0]],recov)
-      P['unvx_sit'] = edit_tarray(P['unvx_sit'],t5,x4)
-    if 'revx' in adjs:
-      # special case, since revx_t did not support groups (si)
-      b = P['revx_t'].ti < t5[0]
-      ti = [*P['revx_t'].ti[b],*t5]
-      xi = np.concatenate((
-        P['revx_t'].xi[b],      # original xi
-        P['revx_t']([t5[0]]*5), # repeat (t5[0]) like edit_tarray
-      ),axis=-1) * np.ones((2,4,1,1,1))
-      xi = apply_RR4(xi,[[0.75,0.75,0.50,0.50],[.50,.50,.50,.50]],recov)
-      P['revx_t'] = tarray.tarray(ti,xi)
+  # edits are applied to all Ps at once, via the tarrays of all Ps stacked (see tarray.stack)
+  keys = {'cdm':'PF_condom_t','dx':'dx_sit','unvx':'unvx_sit','revx':'revx_t'}
+  X = {keys[a]:tarray.stack([P[keys[a]] for P in Ps]) for a in adjs}
+  if 'cdm' in adjs:
+    x4 = X['PF_condom_t']([t5[0]]*4)
+    x4 = apply_RR4(x4,[.75,.50,.25,.50],recov)
+    X['PF_condom_t'] = edit_tarray(X['PF_condom_t'],t5,x4)
+  # TODO: PF_circum_t ?
+  if 'dx' in adjs:
+    x4 = X['dx_sit']([t5[0]]*4)
+    x4 = apply_RR4(x4,[[.60,.60,.40,.40],[.40,.40,.40,.40]],recov)
+    X['dx_sit'] = edit_tarray(X['dx_sit'],t5,x4)
+  if 'unvx' in adjs:
+    x4 = X['unvx_sit']([t5[0]]*4)
+    x4 = apply_RR4(x4,[[1.5,1.5,3.0,3.0],[2.0,2.0,2.0,2.0]],recov)
+    X['unvx_sit'] = edit_tarray(X['unvx_sit'],t5,x4)
+  if 'revx' in adjs:
+    # special case, since revx_t did not support groups (si)
+    b = X['revx_t'].ti < t5[0]
+    ti = [*X['revx_t'].ti[b],*t5]
+    xi = np.concatenate((
+      X['revx_t'].xi[...,b],  # original xi
+      X['revx_t']([t5[0]]*5), # repeat (t5[0]) like edit_tarray
+    ),axis=-1) * np.ones((2,4,1,1,1))
+    xi = apply_RR4(xi,[[0.75,0.75,0.50,0.50],[.50,.50,.50,.50]],recov)
+    X['revx_t'] = tarray.tarray(ti,xi)
+  for j,P in enumerate(Ps):
+    P.update({k:Xk[j] for k,Xk in X.items()})
   return Ps
 
 def run(base=True):
   log(0,'future.run')
-  P0s = fio.load_npy(fname('npy','fit','Ps',case='base'))
+  P0s = params.load_Ps(fname('npz','fit','Ps',case='base'))
+  # all scenarios are the same as base until t5[0], so we solve base once with a snapshot
+  # there (ts), & then solve each scenario from the snapshot (Ss) onwards
+  ts = min(kwds['t5'][0] for kwds in tlines.values())
+  R0s = system.run_n(P0s,t=tvec['main'],ts=ts)
+  Ss = [R0.pop('S',None) for R0 in R0s] # None if base failed before ts
+  R0s = out.ResultSet(R0s)
   if base:
-    R0s = system.run_n(P0s,t=tvec['main'])
     fio.save_csv(fname('csv','future','expo',case='base'),
       out.expo(R0s,**ekwds,ecols=dict(serv='base',tline='base')))
     fit.plot_sets(tvec['main'],R0s,tfname=fname('fig','future','{}',case='base'),sets='future')
@@ -86,7 +96,7 @@ def run(base=True):
     for tline,kwds in tlines.items():
       case = serv+tline[0]
       Ps = get_scen(deepcopy(P0s),adjs,**kwds)
-      Rs = system.run_n(Ps,t=tvec['main'])
+      Rs = out.ResultSet(system.run_n(Ps,t=tvec['main'],Ss=Ss))
       fio.save_csv(fname('csv','future','expo',case=case),
         out.expo(Rs,**ekwds,ecols=dict(serv=serv,tline=tline)))
       fit.plot_sets(tvec['main'],Rs,tfname=fname('fig','future','{}',case=case),sets='future')
@@ -1,5 +1,5 @@
 import numpy as np
-from utils import log,fio,stats,ppool
+from utils import log,fio,stats
 from model import system,params,target,fit,out
 from model.scenario import N,tvec,fname,get_seeds
 
@@ -26,8 +26,8 @@ def update_weights(Ps,Rs,Gs,zi):
   log(2,'imis.update_weights: N = '+str(len(Rs)))
   wp = N['hsam'] / len(Rs)
   Pa = P_array(Ps)
-  for P,R in zip(Ps[zi],Rs[zi]):
-    P.update(ll=R['ll'],lp=params.get_lp(D,P))
+  for P,R,lp in zip(Ps[zi],Rs[zi],params.get_lp(D,Pa[zi])):
+    P.update(ll=R['ll'],lp=lp)
   lls = [P['ll'] for P in Ps] # log-likelihoods
   lps = [P['lp'] for P in Ps] # original log-priors
   lgs = np.sum([G.logpdf(Pa) for G in Gs],axis=0) # mvn log-priors
@@ -49,52 +49,70 @@ def get_mvn(wts,Pa):
 def sample_mvn(G,gsam=10,jmax=100,**kwds):
   # sample from G but ensure valid samples (prior > 0)
   log(2,'imis.sample_mvn: N = '+str(N['isam']))
-  # expensive so we do in parallel + batches (gsam)
-  def sample_fun(z):
-    for j in range(jmax): # attempt
-      Ps  = P_dict(G.rvs(gsam,random_state=jmax*z+j))
-      lps = [params.get_lp(D,P) for P in Ps]
-      if np.max(lps) > -np.inf: break # success: prior > 0
-    log(3,str(z).rjust(9)+' ')
-    return params.get_depend(Ps[np.argmax(lps)],id=z,**kwds)
-  return log(-1,ppool().map(sample_fun,range(N['isam'])))
+  # each sample z draws batches (gsam) until one is valid & takes the best;
+  # all samples still invalid are drawn & checked together (params.get_lp),
+  # but each attempt j keeps its own random_state, so we get the same samples as one by one
+  Pa = np.zeros((N['isam'],len(D)))
+  zs = np.arange(N['isam'])
+  for j in range(jmax): # attempt
+    Pzs = np.array([G.rvs(gsam,random_state=jmax*z+j).reshape((gsam,len(D))) for z in zs])
+    lps = params.get_lp(D,Pzs.reshape((-1,len(D)))).reshape((zs.size,gsam))
+    g = np.argmax(lps,axis=1)
+    Pa[zs] = Pzs[np.arange(zs.size),g]
+    zs = zs[lps[np.arange(zs.size),g] == -np.inf]
+    if not zs.size: break # success: prior > 0
+  # dependent params for all samples at once (see params.get_n_depend)
+  return params.get_n_depend([dict(P,id=z) for z,P in enumerate(P_dict(Pa))],**kwds)
 
-def run(case,b,**kwds):
+def get_llcut(lls,wfloor):
+  # ll below which a run would have weight < wfloor x that of the quantile run in xform_ll;
+  # such runs can abort (system.get_llstop) & get weight 0 instead (ll = -inf);
+  # aborted runs stay below the quantile, so it does not change (if wfloor <= 1)
+  q = np.quantile(np.nan_to_num(lls,nan=-np.inf),N['isam']/N['hsam'])
+  return q / wfloor if wfloor and np.isfinite(q) else -np.inf
+
+def run(case,b,wfloor=1e-2,**kwds):
+  # wfloor: runs stop after the last target & abort once their weight must be < wfloor
+  # (see get_llcut); wfloor = 0 only stops after the last target
+  # the first runs are not cut: most priors score llmin for some target, so the quantile is too low
   log(0,'imis.run: {} @ b = {}'.format(case,b))
   # initialize & first run
   seeds = get_seeds(b)
   T = target.get_all_esw()
   Gs = []
   Ps = params.get_n_all(seeds,batch=b,imis=0,**kwds)
-  Rs = system.run_n(Ps,t=tvec['cal'],T=T)
+  Rs = system.run_n(Ps,t=tvec['cal'],T=T,to=[],llcut=-np.inf) # only need ll
   wts = update_weights(Ps,Rs,Gs,slice(N['hsam']))
   # iterations
   for i in range(N['imis']):
     log(1,'imis.iter: i = {}'.format(i+1))
     zi = slice(len(Ps),len(Ps)+N['isam'])
+    llcut = get_llcut([P['ll'] for P in Ps],wfloor)
     Gs += get_mvn(wts,P_array(Ps))
     Ps += sample_mvn(Gs[-1],batch=b,imis=i+1,**kwds)
-    Rs += system.run_n(Ps[zi],t=tvec['cal'],T=T)
+    Rs += system.run_n(Ps[zi],t=tvec['cal'],T=T,to=[],llcut=llcut)
     wts = update_weights(Ps,Rs,Gs,zi)
   kxs = ('id','batch','imis',*D.keys(),'foi_mode','ll','lp')
   Pxs = [dict({k:P[k] for k in kxs},wt=wt) for P,wt in zip(Ps,wts)]
-  fio.save_npy(fname('npy','imis','Ps',case=case,b=b),Pxs)
+  params.save_Ps(fname('npz','imis','Ps',case=case,b=b),Pxs)
   fio.save_csv(fname('csv','imis','Ps',case=case,b=b),Pxs)
 
 def sample_post(case,seed=0):
   log(0,'imis.sample_post: {}'.format(case))
-  P0xs = [P for b in range(N['batch']) for P in fio.load_npy(fname('npy','imis','Ps',case=case,b=b))]
+  C0s = [fio.load_npz(fname('npz','imis','Ps',case=case,b=b)) for b in range(N['batch'])]
+  C0x = {k:np.concatenate([C0[k] for C0 in C0s]) for k in C0s[0]} # columns
   np.random.seed(seed)
-  wll = rescale(xform_ll([P['ll'] for P in P0xs])) # weights
-  Pxs = np.random.choice(P0xs,N['post'],replace=False,p=wll) # sample
-  for P in Pxs: P.update(id='{}.{}.{}'.format(P['batch'],P['imis'],P['id']))
-  fio.save_csv(fname('csv','fit','Ps',case=case),Pxs)
-  fio.save_npy(fname('npy','fit','Ps',case=case),[params.get_depend(P) for P in Pxs])
+  wll = rescale(xform_ll(C0x['ll'])) # weights
+  z = np.random.choice(len(wll),N['post'],replace=False,p=wll) # sample
+  Cx = {k:C0k[z] for k,C0k in C0x.items()}
+  Cx['id'] = np.array(['{}.{}.{}'.format(*bii) for bii in zip(Cx['batch'],Cx['imis'],Cx['id'])])
+  fio.save_csv(fname('csv','fit','Ps',case=case),Cx)
+  fio.save_npz(fname('npz','fit','Ps',case=case),Cx) # dependent params rebuilt on load
 
 def rerun(case):
   log(0,'imis.rerun: {}'.format(case))
   T = target.get_all_esw()
-  Ps = fio.load_npy(fname('npy','fit','Ps',case=case))
-  Rs = system.run_n(Ps,t=tvec['main'],Xk=True)
+  Ps = params.load_Ps(fname('npz','fit','Ps',case=case))
+  Rs = out.ResultSet(system.run_n(Ps,t=tvec['main'],Xk=True))
   fio.save_csv(fname('csv','fit','wiw',case=case),out.wiw(Rs,tvec['main'],tvec['plot']))
   fit.plot_sets(tvec['main'],Rs,T=T,tfname=fname('fig','fit','{}',case=case))
@@ -1,5 +1,6 @@
 # a collection of strata meta-data for plotting
 
+import numpy as np
 from utils import dict_str
 
 class Strat():
@@ -9,6 +10,7 @@ class Strat():
     self.ind   = ind # dimension indices defining the stratification
     self.color = color # color in (r,g,b) format
     self.label = label # long label for plot legends & facets
+    self.Isi   = get_Isi(ind) # (s,i) indicator matrix
 
   def __str__(self):
     return 'Strat: {} {{{}}} [{}]'.format(self.key,dict_str(self.ind),self.label)
@@ -16,6 +18,12 @@ class Strat():
   def __repr__(self):
     return 'S: {} {{{}}}'.format(self.key,dict_str(self.ind))
 
+def get_Isi(ind):
+  # (s,i) indicator matrix, e.g. to sum (s,i) outputs for many Strats at once (see out.fexpo)
+  Isi = np.zeros((2,4))
+  Isi[np.ix_(np.atleast_1d(ind.get('s',(0,1))),np.atleast_1d(ind.get('i',(0,1,2,3))))] = 1
+  return Isi
+
 # define and collect all Strats in a dict
 strats = {Si.key:Si for Si in [
   Strat('*',     dict(),                   (.40,.00,.40),''),
@@ -1,114 +1,699 @@
 import numpy as np
-from model import params,target,foi
-from utils import _,log,deco,ppool,rk4step
+from scipy import sparse
+from model import params,target,foi,kernel
+from utils import _,log,deco,ppool,rk4step,dp45,dp45step,dp45dense,rkc,rkcstep,rkcrho,hermite,expand,dtfun,itslice
 
 def get_t(t0=1980,tf=2025,dt=0.05):
   # define a time vector with some defaults
   return np.round(np.arange(t0,tf+dt,dt),9)
 
 @deco.nowarn
-def get_X(X0,t):
+def get_X(X0,t,nb=0,dtype=None):
   # initialize a population-time array X: all nan but X[0,...] = X0
-  X = np.nan * np.ndarray([*t.shape,*X0.shape])
-  X[0] = X0
+  # if X0 has nb leading batch dims, these stay first: X[...,0,...] = X0
+  # dtype: for storage only, e.g. np.float32 to save memory (default: float64)
+  X = np.full([*X0.shape[:nb],*t.shape,*X0.shape[nb:]],np.nan,dtype=dtype)
+  X[(slice(None),)*nb+(0,)] = X0
   return X
 
-def run_n(Ps,t=None,T=None,para=True,**kwds):
+def run_n(Ps,t=None,T=None,para=True,batch=0,Ss=None,**kwds):
   # run the model once for each param set P in Ps, usually in parallel
+  # if batch > 0, solve groups of (batch) Ps together via solve_n (below), which is euler only,
+  # so other methods (e.g. method='rkc') need batch = 0
+  # Ss: snapshots to resume from, one per P (see get_S), e.g. R['S'] from run(...,ts=ts)
   log(2,'system.run_n: N = '+str(len(Ps)))
+  if Ss is None: Ss = [None]*len(Ps)
+  if kwds.get('llcut') is not None: # cache Ti.llmax before copying T to workers
+    [Ti.llmax for Ti in T]
+  if batch:
+    Pbs = [Ps[b:b+batch] for b in range(0,len(Ps),batch)]
+    Sbs = [Ss[b:b+batch] for b in range(0,len(Ps),batch)]
+    fun = lambda Pb,Sb: run_b(Pb,t=t,T=T,Ss=None if Sb[0] is None else Sb,**kwds)
+    Rbs = ppool().map(fun,Pbs,Sbs) if para else [fun(Pb,Sb) for Pb,Sb in zip(Pbs,Sbs)]
+    return log(-1,[R for Rb in Rbs for R in Rb])
   if para:
-    fun = lambda P: run(P,t=t,T=T,**kwds)
-    return log(-1,ppool().map(fun,Ps))
+    fun = lambda P,S: run(P,t=t,T=T,S=S,**kwds)
+    return log(-1,ppool().map(fun,Ps,Ss))
   else:
-    return log(-1,[run(P,t=t,T=T,**kwds) for P in Ps])
+    return log(-1,[run(P,t=t,T=T,S=S,**kwds) for P,S in zip(Ps,Ss)])
 
-def run(P,t=None,T=None,RPts=None,Xk=False):
+def run(P,t=None,T=None,RPts=None,Xk=False,to=None,S=None,llcut=None,**kwds):
   # wrapper for solve (below) with some setup & cleanup
+  # to: output times (see get_to), e.g. to=[] to keep only the times of targets T
+  # S: snapshot to resume from (see get_S), so P may differ from the original P only after S['t']
+  # kwds are passed to solve, e.g. dtype=np.float32 to store X, Xk, inc in float32 (see get_out)
+  # or ts=2025 to also return a snapshot R['S'] at t = 2025 (ts can also be a list)
+  # llcut: calibration mode, see get_llstop
   if t is None: t = get_t()
+  if llcut is not None: t,kwds['llstop'] = get_llstop(T,t,llcut)
+  to = get_to(t,to,T)
+  if S is not None: kwds.update(S=S)
+  Pt = params.get_Pt(P,t) # time table, also re-used for RPts
+  return get_R(P,solve(P,t,Pt,to=to,**kwds),t,Pt,T=T,RPts=RPts,Xk=Xk)
+
+def run_b(Ps,t=None,T=None,RPts=None,Xk=False,to=None,dtype=None,linop=False,jit=False,ts=None,Ss=None,
+    llcut=None,method='euler'):
+  # like run, but for a batch of Ps, which are solved together via solve_n
+  # solve_n only steps euler on the shared t grid; the adaptive solvers (dp45, rkc) choose steps
+  # per P, so they cannot share steps & we raise for these, rather than silently use euler
+  if method != 'euler':
+    raise ValueError('system.run_b: only method = euler can be batched (see solve_n)')
+  if t is None: t = get_t()
+  llstop = None
+  if llcut is not None: t,llstop = get_llstop(T,t,llcut)
+  to = get_to(t,to,T)
+  Rs = solve_n(Ps,t,to=to,dtype=dtype,linop=linop,jit=jit,ts=ts,Ss=Ss,llstop=llstop)
+  return [get_R(P,R,t,R and R.pop('Pt'),T=T,RPts=RPts,Xk=Xk) for P,R in zip(Ps,Rs)]
+
+def get_to(t,to=None,T=None):
+  # output times: to (default: all t) plus the times of any targets T, which must all be in t
+  if to is None: return None
+  to = np.union1d(to,target.get_t(T) if T else [])
+  if not all(itslice(t,to)):
+    raise ValueError('system.get_to: output times must be in t')
+  return to
+
+def get_llstop(T,t,llcut):
+  # calibration mode: solve t only until the last target in T, & score each target as soon as
+  # the solver passes its time (see get_lls), so we can abort once the ll of the run
+  # cannot reach llcut, even if all remaining targets score their max (Ti.llmax)
+  # returns the truncated t & llstop for the solver, incl. T grouped by the index in t to score
+  t = t[t <= max(Ti.tmax() for Ti in T)]
+  Ti = {}
+  for i,Tj in zip(np.searchsorted(t,[Tj.tmax() for Tj in T]),T):
+    Ti.setdefault(i,[]).append(Tj)
+  return t,{'T':T,'Ti':Ti,'llcut':llcut}
+
+def get_lls(llstop,lls,O,i,P,j=()):
+  # score the targets due at t[i] (see get_llstop) for batch member j if any, adding them to lls,
+  # & return whether the upper bound on the ll of the run (scored + max of unscored) >= llcut
+  if i not in llstop['Ti']: return True
+  R = {'P':P,**get_out_R(O,j)}
+  R['X'] = R.pop('Xk').sum(axis=3)
+  lls.update(target.get_model_ll(llstop['Ti'][i],R,O['to'],aggr=False))
+  llmax = sum(lls.values()) + sum(Ti.llmax for Ti in llstop['T'] if repr(Ti) not in lls)
+  return not llmax < llstop['llcut'] # nan: keep going
+
+def get_R(P,R,t,Pt,T=None,RPts=None,Xk=False):
+  # cleanup the result R of solve for param set P, with time table Pt (for all t)
   if RPts is None:
     # RPts are tarray params which we add to R to make some out.functions easier
     RPts = ['PF_condom_t','PF_circum_t','dx_sit','tx_sit','Rtx_ht','unvx_sit','revx_t']
-  R = solve(P,t)
   log(3,str(P['id']).rjust(9)+(' ' if R else '!'))
   if not R: # if aborted/failed for any reason
     return {'P':P,'t':t,'ll':-np.inf}
+  to = R['t'] # output times
   # sum k (EPA) dimension & possibly remove Xk to save memory
   R['X'] = (R.get('Xk') if Xk else R.pop('Xk')).sum(axis=3)
-  R['lls'] = target.get_model_ll(T,R,t,aggr=False) if T else {} # ll per target
+  if T: # ll per target, incl. any already scored by the solver (see get_llstop), in T order
+    lls = R.pop('lls',{})
+    lls.update(target.get_model_ll([Ti for Ti in T if repr(Ti) not in lls],R,to,aggr=False))
+    R['lls'] = {repr(Ti):lls[repr(Ti)] for Ti in T}
+  else: R['lls'] = {}
   R['ll'] = sum(R['lls'].values()) if T else None # overall ll (log-likelihood)
-  if RPts: # evaluate tarray params for all t & reshape so t-dim is first
-    R.update({k:np.rollaxis(P[k](t),-1) for k in RPts})
+  if RPts: # tarray params for all to (t-dim first), from Pt if possible
+    R.update(params.get_Pt(P,to,keys=[k for k in RPts if k not in Pt]))
+    R.update({k:Pt[k][itslice(to,t)] for k in RPts if k in Pt})
   return R
 
+def solve(P,t,Pt=None,method='euler',**kwds):
+  # solve the model for param set P & time vector t using an integrator in solvers (below)
+  # kwds are passed to the integrator, e.g. solve(P,t,method='rkc',rtol=1e-4)
+  # euler: the default & the only one with a batched version (solve_n, see run_b);
+  # rkc: adaptive & ~1.5x faster than euler; dp45: adaptive, slower, for accuracy checks
+  return solvers[method](P,t,Pt=Pt,**kwds)
+
+def get_out(X0,t,to=None,nb=0,dtype=None):
+  # initialize the outputs O of solve: Xk & inc at output times to (default: all t),
+  # plus running integrals (A*) at to of quantities needing every t (see add_out)
+  # if X0 has nb leading batch dims, these stay first, as in get_X
+  # dtype: for storing Xk & inc (see get_X), while A* stay float64, as does solve itself
+  if to is None: to = t
+  b = X0.shape[:nb]
+  O = {
+    'to':     to,
+    'io':     np.cumsum(itslice(to,t)) * itslice(to,t) - 1, # index in to for each t, else -1
+    'dt':     dtfun(t),
+    'Xk':     get_X(X0,to,nb,dtype),                      # (..., to:*, s:2, i:4, k:5, h:6, c:5)
+    'inc':    get_X(np.zeros([*b,4,2,4,4]),to,nb,dtype), # (..., to:*, p:4, s:2, i:4, i':4) (see foi.compact)
+  }
+  for k,shape in (('inf',[2,4]),('sus',[2,4]),('death',[2,4,6,5])):
+    O['a'+k] = np.zeros([*b,*shape])         # running integral
+    O['A'+k] = np.zeros([*b,to.size,*shape]) # running integral at to
+  return O
+
+def add_out(O,i,Xk,inc,P,ix=()):
+  # add Xk & inc at t[i] to the outputs O (see get_out); ix: batch index, e.g. (active members,)
+  # accumulate (*dt): new infections (s,i), person-years susceptible (s,i), HIV deaths (s,i,h,c)
+  # as in out.cuminfect & out.cumdeath, which then need only Xk & inc at to
+  X  = Xk.sum(axis=-3) # (..., s:2, i:4, h:6, c:5)
+  dt = O['dt'][i]
+  O['ainf'][ix]   += foi.aggr_inc(inc,P['foi_mode'],axis=(-4,-1),Xsus=X[...,0,0]) * dt
+  O['asus'][ix]   += X[...,0,0] * dt
+  O['adeath'][ix] += X * P['death_hc'][...,0,:,:] * dt
+  j = O['io'][i]
+  if j >= 0:
+    O['Xk'][ix+(j,)] = Xk
+    O['inc'][ix+(j,)] = inc
+    for k in ('inf','sus','death'):
+      O['A'+k][ix+(j,)] = O['a'+k][ix]
+
+def get_out_R(O,j=()):
+  # results of solve from the outputs O (see get_out), for batch member j if any
+  return {
+    't':      O['to'],         # output times
+    'Xk':     O['Xk'][j],      # population-time array (keep k dim for now)
+    'inc':    O['inc'][j],     # incidence-time array
+    'Ainf':   O['Ainf'][j],    # cumulative new infections (to:*, s:2, i:4)
+    'Asus':   O['Asus'][j],    # cumulative person-years susceptible (to:*, s:2, i:4)
+    'Adeath': O['Adeath'][j],  # cumulative HIV deaths (to:*, s:2, i:4, h:6, c:5)
+    'dt':     O['dt'][O['io'] >= 0], # solver step size at to
+  }
+
+def get_is(t,ts=None):
+  # indices of the snapshot time(s) ts in t (see get_S), if any
+  if ts is None: return []
+  i = np.flatnonzero(itslice(ts,t[:-1]))
+  if i.size < np.size(ts):
+    raise ValueError('system.get_is: snapshot times ts must be in t (before the end)')
+  return i
+
+def get_R_S(Ss,ts):
+  # snapshot(s) for R['S'], as ts: one snapshot if ts is a number, else a list
+  return {} if ts is None else {'S': Ss if np.ndim(ts) else Ss[0]}
+
+def get_S(t,i,O,X,inc,b_hiv,b_tpaf,mix,mix_mask,mix_ab,j=()):
+  # snapshot of the solver state at t[i], before the step to t[i+1], for batch member j if any:
+  # X, inc, event toggles, mutable P state (mix, mix_mask), warm start for foi.get_mix (mix_ab)
+  # & the outputs O so far (see set_S)
+  n = np.sum(O['io'][:i] >= 0) # number of outputs so far
+  return {
+    'i':        i,
+    't':        t[i],
+    'to':       O['to'],
+    'X':        X[j].copy(),
+    'inc':      inc[j].copy(),
+    'b_hiv':    np.array(b_hiv)[j],
+    'b_tpaf':   np.array(b_tpaf)[j],
+    'mix':      mix.copy(),
+    'mix_mask': mix_mask.copy(),
+    'mix_ab':   mix_ab.copy(),
+    'O': {
+      **{k:O[k][j][:n].copy() for k in ('Xk','inc','Ainf','Asus','Adeath')}, # to so far
+      **{k:O[k][j].copy() for k in ('ainf','asus','adeath')},
+    }
+  }
+
+def stack_S(Ss):
+  # stack snapshots (see get_S) along a leading batch axis, e.g. to resume via solve_n
+  if len({S['i'] for S in Ss}) > 1:
+    raise ValueError('system.stack_S: all snapshots must be at the same time')
+  return {
+    **Ss[0], # i, t, to
+    **{k:np.stack([S[k] for S in Ss]) for k in ('X','inc','b_hiv','b_tpaf','mix','mix_mask','mix_ab')},
+    'O': {k:np.stack([S['O'][k] for S in Ss]) for k in Ss[0]['O']},
+  }
+
+def set_S(S,P,W,t,to=None,nb=0,dtype=None):
+  # restore the solver state from snapshot S (see get_S) & return (O, X, inc, b_hiv, b_tpaf),
+  # setting the mutable state of P & workspace W in-place; nb = 1 if S is stacked (see stack_S)
+  if t[S['i']] != S['t'] or not np.array_equal(t if to is None else to,S['to']):
+    raise ValueError('system.set_S: snapshot does not match t or to')
+  O = get_out(S['X'],t,to,nb,dtype)
+  for k,v in S['O'].items():
+    if k in ('ainf','asus','adeath'): O[k][...] = v
+    else: O[k][(slice(None),)*nb+(slice(0,v.shape[nb]),)] = v # to so far
+  P['mix'] = S['mix'].copy()
+  P['mix_mask'] = S['mix_mask'].copy()
+  W['mix_ab'][...] = S['mix_ab']
+  return O,S['X'].copy(),S['inc'].copy(),S['b_hiv'].copy(),S['b_tpaf'].copy()
+
+def set_events(X,t,P,b_hiv,b_tpaf):
+  # events at time t: introduce HIV (t >= t0_hiv) & start accumulating TPAF (t >= t0_tpaf)
+  # X & P are modified in-place; b_hiv, b_tpaf: toggles so we do each event only once
+  if b_hiv and t >= P['t0_hiv']: # introduce HIV
+    b_hiv = False
+    X[:,:,0,:,0] = X[:,:,0,0,0,_] * P['PX_h_hiv'][_,_,:]
+  if b_tpaf and t >= P['t0_tpaf']: # start accumulating TPAF
+    b_tpaf = False
+    P['mix_mask'] = P['mix_mask_tpaf']
+  return b_hiv,b_tpaf
+
+def set_events_n(X,t,P,b_hiv,b_tpaf,a):
+  # like set_events, but for a batch with active members a (see solve_n), all in-place
+  b = b_hiv[a] & (t >= P['t0_hiv'])
+  if b.any(): # introduce HIV
+    b_hiv[a[b]] = False
+    X[a[b],:,:,0,:,0] = X[a[b],:,:,0,0,0,_] * P['PX_h_hiv'][b,_,_,:]
+  b = b_tpaf[a] & (t >= P['t0_tpaf'])
+  if b.any(): # start accumulating TPAF
+    b_tpaf[a[b]] = False
+    P['mix_mask'][b] = P['mix_mask_tpaf'][b]
+
 #@profile
-def solve(P,t):
-  # solve the model for param set P & time vector t
-  X   = get_X(P['X0'],t)               # (t:*, s:2, i:4, k:5, h:6, c:5)
-  inc = get_X(np.zeros([4,2,4,2,4]),t) # (t:*, p:4, s:2, i:4, s':2, i':4)
-  b_hiv,b_tpaf = True,True # toggles so we only introduce HIV & start TPAF once
-  for i in range(1,t.size):
-    # Ri = rk4step(X[i-1],t[i-1],(t[i]-t[i-1]),get_dX,P=P)
-    Ri = get_dX(X[i-1],t[i-1],P) # DEBUG: Euler
-    X[i] = X[i-1] + (t[i] - t[i-1]) * Ri['dX'] # X(t) = X(t-dt) + dt * dX/dt(t-dt)
-    inc[i] = Ri['inc']
-    if b_hiv and t[i] >= P['t0_hiv']: # introduce HIV
-      b_hiv = False
-      X[i,:,:,0,:,0] = X[i,:,:,0,0,0,_] * P['PX_h_hiv'][_,_,:]
-    if b_tpaf and t[i] >= P['t0_tpaf']: # start accumulating TPAF
-      b_tpaf = False
-      P['mix_mask'] = P['mix_mask_tpaf']
-    if np.any(X[i].sum(axis=2) < 0) or np.any(inc[i] < 0): # abort / fail
+def solve_euler(P,t,Pt=None,to=None,dtype=None,linop=False,jit=False,ts=None,S=None,llstop=None):
+  # solve the model for param set P & time vector t with fixed steps (t) of Euler's method
+  # Pt: time table of tarray params, evaluated for all t (see params.get_Pt)
+  # to, dtype: output times (default: all t) & storage dtype, see get_out
+  # linop: apply the linear terms of get_dX via a sparse operator (see get_L)
+  # jit: compute get_dX via JIT-compiled kernels (see kernel.get_J), if numba is installed
+  # ts: also return snapshot(s) R['S'] at time(s) ts (see get_S); S: resume from snapshot S
+  # llstop: score targets during the solve & abort if the ll bound < llcut (see get_llstop)
+  if Pt is None: Pt = params.get_Pt(P,t)
+  if not np.isfinite(Pt['PXe_si']).all(): # infeasible turnover (see params.solve_turnover)
+    return False
+  W = get_W(P['X0']) # workspace for get_dX
+  if S is None:
+    O = get_out(P['X0'],t,to,dtype=dtype)
+    Xi,inci = P['X0'].copy(),np.zeros([4,2,4,4]) # current X & inc
+    b_hiv,b_tpaf = True,True # toggles so we only introduce HIV & start TPAF once
+  else: # events at S['t'] may be new for this P, e.g. t0_tpaf = S['t']
+    O,Xi,inci,b_hiv,b_tpaf = set_S(S,P,W,t,to,dtype=dtype)
+    b_hiv,b_tpaf = set_events(Xi,S['t'],P,b_hiv,b_tpaf)
+  L = get_L(P) if linop else None
+  if linop: Pt = dict(Pt,L_rates=get_Lt_table(P,Pt))
+  J = kernel.get_J(P) if jit else None
+  i0,i_s,Ss,lls = 0 if S is None else S['i'],get_is(t,ts),[],{}
+  for i in range(i0+1,t.size):
+    if i-1 in i_s: # snapshot
+      Ss.append(get_S(t,i-1,O,Xi,inci,b_hiv,b_tpaf,P['mix'],P['mix_mask'],W['mix_ab']))
+    # Ri = rk4step(Xi,t[i-1],(t[i]-t[i-1]),get_dX,P=P)
+    Ri = get_dX(Xi,t[i-1],P,{k:v[i-1] for k,v in Pt.items()},W,L,J) # DEBUG: Euler
+    add_out(O,i-1,Xi,inci,P) # after changes from foi.fix_XK
+    if llstop and not get_lls(llstop,lls,O,i-1,P): # abort: ll < llcut
+      return False
+    Xi = Xi + (t[i] - t[i-1]) * Ri['dX'] # X(t) = X(t-dt) + dt * dX/dt(t-dt)
+    inci = Ri['inc'].copy()
+    b_hiv,b_tpaf = set_events(Xi,t[i],P,b_hiv,b_tpaf)
+    if np.any(Xi.sum(axis=2) < 0) or np.any(inci < 0): # abort / fail
       return False
+  add_out(O,t.size-1,Xi,inci,P)
+  if llstop and not get_lls(llstop,lls,O,t.size-1,P):
+    return False
+  return {'P':P,**get_out_R(O),**get_R_S(Ss,ts),**({'lls':lls} if llstop else {})}
+
+#@profile
+def solve_dp45(P,t,Pt=None,to=None,dtype=None,linop=False,jit=False,ts=None,S=None,llstop=None,
+    rtol=1e-4,atol=1e-6,dt0=None,dtmax=1):
+  # solve the model for param set P with adaptive Dormand-Prince 5(4) steps (see utils.dp45step)
+  # step sizes are set by the error control (rtol, atol), independent of t, and X is then
+  # interpolated at t (dense output); inc[i] is the rate at t[i-1], as in solve_euler;
+  # we also step exactly to t0_hiv, t0_tpaf (X & mix_mask change there) & any snapshot times ts
+  # this is an accuracy reference for solve_euler, not a faster path: the model is mildly stiff
+  # (d(dX)/dX has eigenvalues down to ~ -20 to -30 / year, mostly from turnover & partnership
+  # changes in the k dim), so dp45 steps are limited by stability to dt < ~0.15 for any rtol,
+  # i.e. ~40 get_dX / year vs 20 for euler on the default t (see get_t): see solve_rkc instead
+  # Pt is not used, since the steps are off the t grid, except to check turnover on the t grid;
+  # instead we evaluate the tarray params for all stages of each step together (see get_Pt_c)
+  # ts, S, llstop: as in solve_euler
+  if Pt is None: Pt = params.get_Pt(P,t,keys=['birth_t'])
+  if not np.isfinite(Pt['PXe_si']).all(): # infeasible turnover (see params.solve_turnover)
+    return False
+  W = get_W(P['X0']) # workspace for get_dX, whose results we copy, since dp45step keeps all stages
+  if S is None:
+    O = get_out(P['X0'],t,to,dtype=dtype)
+    Xi,inci,ti,i = P['X0'].copy(),np.zeros([4,2,4,4]),t[0],0 # current X, inc at t[i-1], t, next output
+    b_hiv,b_tpaf = True,True # toggles so we only introduce HIV & start TPAF once
+  else:
+    O,Xi,inci,b_hiv,b_tpaf = set_S(S,P,W,t,to,dtype=dtype)
+    ti,i,dt0 = S['t'],S['i'],S.get('dt',dt0) # next step size, if S is from solve_dp45
+  L = get_L(P) if linop else None
+  J = kernel.get_J(P) if jit else None
+  Ptc = {} # Pt for the stages of the current step (see get_Pt_c)
+  dXfun = lambda X,t,P: {k:v.copy() for k,v in get_dX(X,t,P,Ptc.get(t),W,L,J).items()}
+  # abort / fail if X < 0, beyond rounding & error tolerance (unlike solve_euler)
+  neg = lambda X: np.any(X.sum(axis=2) < -rtol*X.sum(axis=(2,3,4))[:,:,_,_])
+  i_s,Ss,lls = get_is(t,ts),[],{}
+  dt = t[1]-t[0] if dt0 is None else dt0
+  Ri = None if S is None else S.get('R') # last stage result at ti, if S is from solve_dp45
+  while True:
+    b = (b_hiv,b_tpaf)
+    b_hiv,b_tpaf = set_events(Xi,ti,P,b_hiv,b_tpaf)
+    if (b_hiv,b_tpaf) != b: Ri = None # X or mix_mask changed
+    if i in i_s and ti == t[i] and not (Ss and Ss[-1]['i'] == i): # snapshot
+      Ss.append(dict(get_S(t,i,O,Xi,inci,b_hiv,b_tpaf,P['mix'],P['mix_mask'],W['mix_ab']),dt=dt,R=Ri))
+    if ti >= t[-1]: break
+    # next stop: end of t, next discontinuity, or next snapshot
+    tf = min([t[-1]]+[tb for b,tb in ((b_hiv,P['t0_hiv']),(b_tpaf,P['t0_tpaf'])) if b and tb > ti]
+      +[t[k] for k in i_s if t[k] > ti])
+    dt = min(dt,dtmax,tf-ti)
+    Ptc = get_Pt_c(P,[ti+c*dt for c in dp45['c']])
+    Rs,Xf,E = dp45step(Xi,ti,dt,dXfun,R1=Ri,P=P)
+    err = np.sqrt(np.mean((E / (atol + rtol*np.maximum(abs(Xi),abs(Xf))))**2))
+    if err > 1: # reject & retry with smaller step
+      dt *= max(.2,.9*err**-.2)
+      if dt < 1e-9: return False # abort / fail: stiff or broken
+      continue
+    # accept: output at t in [ti, ti+dt)
+    tj = tf if ti+dt >= tf else ti+dt # avoid rounding errors at stops
+    while i < t.size and t[i] < tj:
+      Xo = Xi + dp45dense(Rs,dt,(t[i]-ti)/dt)
+      if neg(Xo): # abort / fail
+        return False
+      add_out(O,i,Xo,inci,P)
+      if llstop and not get_lls(llstop,lls,O,i,P): # abort: ll < llcut
+        return False
+      # the interpolant of inc can dip below 0 where inc rises from ~0 (e.g. after t0_hiv)
+      inci = np.maximum(dp45dense(Rs,dt,(t[i]-ti)/dt,key='inc',deriv=True),0)
+      i += 1
+    Xi,ti,Ri = Xf,tj,Rs[-1]
+    if neg(Xi): # abort / fail
+      return False
+    dt *= min(10,.9*err**-.2) if err > 0 else 10
+  add_out(O,t.size-1,Xi,inci,P)
+  if llstop and not get_lls(llstop,lls,O,t.size-1,P):
+    return False
+  return {'P':P,**get_out_R(O),**get_R_S(Ss,ts),**({'lls':lls} if llstop else {})}
+
+def solve_rkc(P,t,Pt=None,to=None,dtype=None,linop=False,jit=False,ts=None,S=None,llstop=None,
+    rtol=1e-3,atol=1e-6,dt0=None,dtmax=1):
+  # solve the model for param set P with adaptive Runge-Kutta-Chebyshev steps (see utils.rkcstep)
+  # like solve_dp45, but these 2nd order steps are stabilized for our stiffness (see solve_dp45):
+  # each step uses s stages, chosen from the spectral radius rho of d(dX)/dX (see utils.rkcrho),
+  # so dt is set by the error control (rtol, atol) & dtmax, not by stability; e.g. 6 param sets
+  # to 2050 need 5.4k get_dX (5.1 s) vs 8.4k (7.6 s) for euler & 19k (18 s) for dp45, with
+  # 1.3-10x less error than euler vs euler with dt = 0.005
+  # X is interpolated at t by cubic Hermite (see utils.hermite) & inc linearly
+  # ts, S, llstop: as in solve_euler
+  if Pt is None: Pt = params.get_Pt(P,t,keys=['birth_t'])
+  if not np.isfinite(Pt['PXe_si']).all(): # infeasible turnover (see params.solve_turnover)
+    return False
+  W = get_W(P['X0']) # workspace for get_dX, whose results we copy, since rkcstep keeps some
+  if S is None:
+    O = get_out(P['X0'],t,to,dtype=dtype)
+    Xi,inci,ti,i = P['X0'].copy(),np.zeros([4,2,4,4]),t[0],0 # current X, inc at t[i-1], t, next output
+    b_hiv,b_tpaf = True,True # toggles so we only introduce HIV & start TPAF once
+  else:
+    O,Xi,inci,b_hiv,b_tpaf = set_S(S,P,W,t,to,dtype=dtype)
+    ti,i,dt0 = S['t'],S['i'],S.get('dt',dt0) # next step size etc., if S is from solve_rkc
+  L = get_L(P) if linop else None
+  J = kernel.get_J(P) if jit else None
+  Ptc = {} # Pt for the stages of the current step (see get_Pt_c)
+  dXfun = lambda X,t,P: {k:v.copy() for k,v in get_dX(X,t,P,Ptc.get(t),W,L,J).items()}
+  # abort / fail if X < 0, beyond rounding & error tolerance (unlike solve_euler)
+  neg = lambda X: np.any(X.sum(axis=2) < -rtol*X.sum(axis=(2,3,4))[:,:,_,_])
+  i_s,Ss,lls = get_is(t,ts),[],{}
+  dt = t[1]-t[0] if dt0 is None else dt0
+  Ri,rho,nrho = (S.get('R'),S['rho'],S['nrho']) if S and 'rho' in S else (None,None,0)
+  while True:
+    b = (b_hiv,b_tpaf)
+    b_hiv,b_tpaf = set_events(Xi,ti,P,b_hiv,b_tpaf)
+    if (b_hiv,b_tpaf) != b: Ri,rho = None,None # X or mix_mask changed
+    if i in i_s and ti == t[i] and not (Ss and Ss[-1]['i'] == i): # snapshot
+      Ss.append(dict(get_S(t,i,O,Xi,inci,b_hiv,b_tpaf,P['mix'],P['mix_mask'],W['mix_ab']),
+        dt=dt,R=Ri,rho=rho,nrho=nrho))
+    if ti >= t[-1]: break
+    # next stop: end of t, next discontinuity, or next snapshot
+    tf = min([t[-1]]+[tb for b,tb in ((b_hiv,P['t0_hiv']),(b_tpaf,P['t0_tpaf'])) if b and tb > ti]
+      +[t[k] for k in i_s if t[k] > ti])
+    dt = min(dt,dtmax,tf-ti)
+    if rho is None or nrho >= 25: # (re-)estimate rho: initially, after events & every 25 steps
+      Ptc = get_Pt_c(P,[ti])
+      Ri = Ri if Ri else dXfun(Xi,ti,P)
+      rho,nrho = rkcrho(Xi,ti,dXfun,Ri,P=P),0
+    s = max(2,1+int(np.sqrt(1+1.54*dt*rho))) # stages for stability (see utils.rkc)
+    Ptc = get_Pt_c(P,[ti+c*dt for c in rkc(s)['c']])
+    Rs,Xf,E = rkcstep(Xi,ti,dt,s,dXfun,R1=Ri,P=P)
+    err = np.sqrt(np.mean((E / (atol + rtol*np.maximum(abs(Xi),abs(Xf))))**2))
+    if err > 1: # reject & retry with smaller step
+      dt *= max(.1,.8*err**(-1/3))
+      if dt < 1e-9: return False # abort / fail: broken
+      continue
+    # accept: output at t in [ti, ti+dt)
+    tj = tf if ti+dt >= tf else ti+dt # avoid rounding errors at stops
+    while i < t.size and t[i] < tj:
+      theta = (t[i]-ti)/dt
+      Xo = hermite(Xi,Xf,Rs,dt,theta)
+      if neg(Xo): # abort / fail
+        return False
+      add_out(O,i,Xo,inci,P)
+      if llstop and not get_lls(llstop,lls,O,i,P): # abort: ll < llcut
+        return False
+      inci = (1-theta)*Rs[0]['inc'] + theta*Rs[1]['inc']
+      i += 1
+    Xi,ti,Ri,nrho = Xf,tj,Rs[-1],nrho+1
+    if neg(Xi): # abort / fail
+      return False
+    dt *= min(10,.8*err**(-1/3)) if err > 0 else 10
+  add_out(O,t.size-1,Xi,inci,P)
+  if llstop and not get_lls(llstop,lls,O,t.size-1,P):
+    return False
+  return {'P':P,**get_out_R(O),**get_R_S(Ss,ts),**({'lls':lls} if llstop else {})}
+
+def get_Pt_c(P,tc):
+  # Pt at the few times tc, e.g. the stages of an adaptive step, as {t: Pt at t}, via one
+  # get_Pt call (vs one per get_dX call, which is ~2/3 the cost of get_dX itself)
+  if len(tc) == 1: return {tc[0]:params.get_Pt(P,tc[0])}
+  Pt = params.get_Pt(P,np.array(tc))
+  return {tj:{k:v[j] for k,v in Pt.items()} for j,tj in enumerate(tc)}
+
+solvers = {
+  'euler': solve_euler,
+  'dp45': solve_dp45,
+  'rkc': solve_rkc,
+}
+
+#@profile
+def solve_n(Ps,t,to=None,dtype=None,linop=False,jit=False,ts=None,Ss=None,llstop=None):
+  # solve the model for a batch of param sets Ps & time vector t, like solve
+  # but all Ps step together along a leading batch axis (n), so each numpy op is
+  # done once per step for all Ps; aborted / failed Ps drop out of the batch (R = False)
+  # ts, Ss: snapshot time & snapshots to resume from, one per P, like ts, S in solve_euler
+  # llstop: as in solve_euler, with targets scored per member
+  P = params.get_batch(Ps)
+  if not isinstance(P['foi_mode'],str):
+    raise ValueError('system.solve_n: all Ps must have the same foi_mode')
+  Pt  = params.get_Pt(P,t)  # (t:*, n:*, ...) time table
+  Pta = Pt                  # time table for active members
+  n   = len(Ps)
+  a   = np.arange(n) # active members
+  W   = get_W(P['X0']) # workspace for get_dX (for active members)
+  if Ss is None:
+    O = get_out(P['X0'],t,to,nb=1,dtype=dtype)
+    X,inc = P['X0'].copy(),np.zeros([n,4,2,4,4]) # current X & inc (n:*, ...)
+    b_hiv,b_tpaf = np.ones(n,dtype=bool),np.ones(n,dtype=bool) # toggles per member (as in solve)
+  else: # events at S['t'] may be new for these Ps (see solve_euler)
+    O,X,inc,b_hiv,b_tpaf = set_S(stack_S(Ss),P,W,t,to,nb=1,dtype=dtype)
+    set_events_n(X,Ss[0]['t'],P,b_hiv,b_tpaf,a)
+  ok = np.isfinite(Pt['PXe_si']).all(axis=(0,2,3))
+  if not ok.all(): # infeasible turnover (see params.solve_turnover): fail up front
+    a = a[ok]
+    if a.size:
+      P = params.take_batch(P,ok)
+      Pta = {k:v[:,ok] for k,v in Pta.items()}
+      W = dict(get_W(P['X0']),mix_ab=W['mix_ab'][ok])
+  L = get_L(P) if linop else None
+  if linop and a.size: Pta = dict(Pta,L_rates=get_Lt_table(P,Pta)) # (t:*, n:*, rates)
+  J = kernel.get_J(P) if jit else None
+  i0,i_s,Sos = 0 if Ss is None else Ss[0]['i'],get_is(t,ts),[[] for j in range(n)]
+  llss = [{} for j in range(n)] # scored targets per member, if llstop
+  getok = lambda i: np.array([get_lls(llstop,llss[j],O,i,Ps[j],j) for j in a],dtype=bool) \
+    if llstop else np.ones(a.size,dtype=bool)
+  for i in range(i0+1,t.size if a.size else 0):
+    if i-1 in i_s: # snapshot
+      for k,j in enumerate(a):
+        Sos[j].append(get_S(t,i-1,O,X,inc,b_hiv,b_tpaf,P['mix'][k],P['mix_mask'][k],W['mix_ab'][k],j))
+    Xi = X[a]
+    Ri = get_dX(Xi,t[i-1],P,{k:v[i-1] for k,v in Pta.items()},W,L,J) # Euler
+    add_out(O,i-1,Xi,inc[a],P,(a,)) # after changes from foi.fix_XK, as in solve
+    ok = getok(i-1)
+    X[a] = Xi + (t[i] - t[i-1]) * Ri['dX']
+    inc[a] = Ri['inc']
+    set_events_n(X,t[i],P,b_hiv,b_tpaf,a)
+    ok &= ~(np.any(X[a].sum(axis=3) < 0,axis=(1,2,3,4)) | np.any(inc[a] < 0,axis=(1,2,3,4)))
+    if not ok.all(): # abort / fail some members
+      a = a[ok]
+      if not a.size: break
+      P = params.take_batch(P,ok)
+      Pta = {k:v[:,ok] for k,v in Pta.items()}
+      W = dict(get_W(P['X0']),mix_ab=W['mix_ab'][ok])
+      L = get_L(P) if linop else None
+      J = kernel.get_J(P) if jit else None
+  if a.size:
+    add_out(O,t.size-1,X[a],inc[a],P,(a,))
+    a = a[getok(t.size-1)]
+  return [{
+    'P': Ps[j], # param set
+    **get_out_R(O,j),
+    'Pt': {k:v[:,j] for k,v in Pt.items()}, # time table (see params.get_Pt)
+    **get_R_S(Sos[j],ts), # snapshot(s) at ts
+    **({'lls':llss[j]} if llstop else {}), # scored targets
+  } if j in a else False for j in range(n)]
+
+def get_W(X):
+  # workspace for get_dX: preallocated buffers & pre-sliced views, plus those for foi (see foi.get_W)
+  # X.shape = (..., s:2, i:4, k:5, h:6, c:5), so W must be rebuilt if the batch dims (...) change
+  # NOTE: get_dX(...,W=W) returns buffers in W, so results must be used / copied before the next call
+  dX = np.zeros(X.shape)
+  W = foi.get_W(X)
+  W.update({
+    'dX': dX,
+    'dXi':       np.zeros(X.shape),
+    'dXi_prog':  np.zeros(X[...,1:5,0:3].shape),
+    'dXi_unprog':np.zeros(X[...,3:6,3:5].shape),
+    'dXi_turn':  np.zeros([*X.shape[:-4],*X.shape[-4:-3],*X.shape[-4:]]),
+    'dXi_c':     np.zeros(X[...,1:6,0].shape),
+    'dX_prog-':  dX[...,1:5,0:3],
+    'dX_prog+':  dX[...,2:6,0:3],
+    'dX_unprog-':dX[...,3:6,3:5],
+    'dX_unprog+':dX[...,2:5,3:5],
+    'dX_sus':    dX[...,0,0,0],
+    'dX_c':      [dX[...,1:6,c] for c in range(5)],
+  })
+  return W
+
+def get_L(P):
+  # sparse (CSR) operator for the linear terms of get_dX, except births: dX = L @ X.ravel()
+  # X is flattened over all dims, incl. any batch dims, so L is block-diagonal for batches
+  # L has a fixed sparsity pattern: flows with constant rates (progression, recovery,
+  # deaths, viral suppression) are summed here, & flows with time-varying rates
+  # (turnover & the rest of the cascade, see get_Lt_rates) are added at each t by get_Lt,
+  # from the rates of all t, tabled once per run by get_Lt_table (solve_euler & solve_n)
+  # e.g. for 1 P, the linear terms take ~40 us per step vs ~150 us in numpy (get_dX below),
+  # so serial runs are ~12% faster, incl. the setup (get_L, get_M & get_Lt_table: ~3 ms)
+  I = np.arange(P['X0'].size).reshape(P['X0'].shape) # (..., s:2, i:4, k:5, h:6, c:5)
+  N = I.size
+  rows,cols,rates,shapes = [],[],[],[]
+  def flow(src,dst,rate=None): # flow from X[src] to X[dst] (None: exit) at rate (per X[src])
+    if dst is None: ij = [src.ravel()]
+    else:
+      src,dst = np.broadcast_arrays(src,dst)
+      ij = [dst.ravel(),src.ravel()]
+    rows.extend(ij)
+    cols.extend([src.ravel()]*len(ij))
+    if rate is None: shapes.append(src.shape)
+    else:
+      rate = np.broadcast_to(rate,src.shape).ravel()
+      rates.extend([rate,-rate][-len(ij):])
+  flow(I[...,1:5,0:3],I[...,2:6,0:3],P['prog_h'])                 # HIV progression
+  flow(I[...,3:6,3:5],I[...,2:5,3:5],P['unprog_h'])               # CD4 recovery
+  flow(I,None,expand(P['death'],5) + P['death_hc'])               # deaths
+  flow(I[...,1:6,3],I[...,1:6,4],expand(P['vx'],4))               # cascade: viral suppression
+  nc = sum(r.size for r in rates) # time-varying flows below, same order as get_Lt_rates
+  flow(I[...,:,:,_,:,:,:],I[...,:,_,:,:,:,:]) # turnover among activity groups
+  flow(I[...,1:6,0],I[...,1:6,1])             # cascade: diagnosis
+  flow(I[...,1:6,1],I[...,1:6,3])             # cascade: treatment
+  flow(I[...,1:6,4],I[...,1:6,2])             # cascade: treatment fail / discontinue
+  flow(I[...,1:6,2],I[...,1:6,4])             # cascade: viral re-suppression
+  # unique (row,col) -> CSR pattern; pos: index of each entry in L.data
+  ij,pos = np.unique(np.concatenate(rows)*N + np.concatenate(cols),return_inverse=True)
+  indptr = np.concatenate([[0],np.cumsum(np.bincount(ij // N,minlength=N))])
   return {
-    'P': P,     # param set
-    't': t,     # time vector
-    'Xk': X,    # population-time array (keep k dim for now)
-    'inc': inc, # incidence-time array
+    'L': sparse.csr_matrix((np.zeros(ij.size),ij % N,indptr),shape=(N,N)),
+    'data': np.bincount(pos[:nc],weights=np.concatenate(rates),minlength=ij.size),
+    'pos': pos[nc:], # time-varying entries
+    'shapes': shapes,
   }
 
+def get_Lt_rates(P,Pt,turn):
+  # time-varying rates for get_L, in the same order: turnover & cascade
+  return [
+    turn[...,_,_,_],                                  # turnover among activity groups
+    Pt['dx_sit'] * P['Rdx_scen'],                     # cascade: diagnosis
+    Pt['tx_sit'] * Pt['Rtx_ht'] * P['Rtx_scen'],      # cascade: treatment
+    Pt['unvx_sit'] * P['Rux_scen'],                   # cascade: treatment fail / discontinue
+    Pt['revx_t'],                                     # cascade: viral re-suppression
+  ]
+
+def get_Lt_table(P,Pt):
+  # time-varying rates for get_L (see get_Lt_rates) for all t of the time table Pt
+  # (see params.get_Pt) at once, as 1 (t:*, ..., rates) table with any batch dims
+  # so each step of get_Lt is a row of this table & 1 sparse matvec (see get_M)
+  # we pad the dims of Pt after t to those of the rates at 1 t, so the t-dim broadcasts first
+  nt,bs = Pt['turn_sii'].shape[0],params.bshape(P)
+  D = max(np.ndim(rate) for rate in get_Lt_rates(P,{k:v[0] for k,v in Pt.items()},Pt['turn_sii'][0]))
+  Ptd = {k:v.reshape(nt,*(1,)*max(0,D+1-v.ndim),*v.shape[1:]) for k,v in Pt.items()}
+  return np.concatenate([np.reshape(rate,(nt,*bs,-1)) for rate in get_Lt_rates(P,Ptd,Ptd['turn_sii'])],axis=-1)
+
+def get_M(L,rates,bs):
+  # sparse matrix from the time-varying rates (flat, as in get_Lt_table) to L.data (see get_L),
+  # i.e. the broadcast to each flow & its (+,-) scatter, as in get_L, all in 1 matrix
+  nb = int(np.prod(bs))
+  I = np.arange(sum(np.size(rate) for rate in rates)).reshape((*bs,-1)) # flat index per member
+  rows,cols,vals,j,c = [],[],[],0,0
+  for rate,shape in zip(rates,L['shapes']):
+    n = np.size(rate) // nb
+    r = np.broadcast_to(I[...,c:c+n].reshape(np.shape(rate)),shape).ravel()
+    rows.extend([L['pos'][j:j+r.size],L['pos'][j+r.size:j+2*r.size]])
+    cols.extend([r,r])
+    vals.extend([np.ones(r.size),-np.ones(r.size)])
+    j,c = j+2*r.size,c+n
+  return sparse.csr_matrix((np.concatenate(vals),(np.concatenate(rows),np.concatenate(cols))),
+    shape=(L['data'].size,I.size))
+
+def get_Lt(L,P,Pt,turn):
+  # patch L (see get_L) for time t in-place, given Pt & turn (see params.solve_turnover)
+  # using the rates in Pt['L_rates'] if any (see get_Lt_table), else from get_Lt_rates
+  bs = params.bshape(P)
+  if 'M' not in L: # on first use, since it needs the shapes of the rates
+    L['M'] = get_M(L,get_Lt_rates(P,Pt,turn),bs)
+  r = Pt['L_rates'] if 'L_rates' in Pt else \
+    np.concatenate([np.reshape(rate,(*bs,-1)) for rate in get_Lt_rates(P,Pt,turn)],axis=-1)
+  np.add(L['data'],L['M'] @ r.reshape(-1),out=L['L'].data)
+  return L['L']
+
 #@profile
-def get_dX(X,t,P):
-  # initialize dX (fastest)
-  dX = 0*X # (s:2, i:4, k:5, h:6, c:5)
+def get_dX(X,t,P,Pt=None,W=None,L=None,J=None):
+  # X.shape = (..., s:2, i:4, k:5, h:6, c:5), where (...) are any batch dims (see solve_n)
+  # Pt: time-varying params at t (see params.get_Pt), else we evaluate them here
+  # W: workspace (see get_W), else we allocate a new one
+  # L: sparse operator for all linear terms except births (see get_L), else we apply these below
+  # J: context for JIT-compiled kernels (see kernel.get_J), which then do everything instead
+  if Pt is None: Pt = params.get_Pt(P,t)
+  if W is None: W = get_W(X)
+  if J is not None:
+    return kernel.get_dX(X,P,Pt,W,J)
+  dX,dXc = W['dX'],W['dX_c']
+  dX.fill(0)
   # force of infection - modifies dX internally
-  inc = foi.get_apply_inc(dX,X,t,P) # (p:4, s:2, i:4, s':2, i':4)
+  inc = foi.get_apply_inc(dX,X,P,Pt,W) # (..., p:4, s:2, i:4, i':4)
+  # births (entry)
+  W['dX_sus'] += expand(X.sum(axis=(-5,-4,-3,-2,-1)) * Pt['birth_t'],2) * Pt['PXe_si']
+  if L is not None: # all the rest in one sparse matvec
+    dX += (get_Lt(L,P,Pt,Pt['turn_sii']) @ X.reshape(-1)).reshape(X.shape)
+    return {
+      'dX': dX,
+      'inc': inc,
+    }
   # HIV progression
-  dXi = X[:,:,:,1:5,0:3] * P['prog_h'] # all hiv & untreated
-  dX[:,:,:,1:5,0:3] -= dXi
-  dX[:,:,:,2:6,0:3] += dXi
+  dXi = np.multiply(X[...,1:5,0:3],P['prog_h'],out=W['dXi_prog']) # all hiv & untreated
+  W['dX_prog-'] -= dXi
+  W['dX_prog+'] += dXi
   # CD4 recovery
-  dXi = X[:,:,:,3:6,3:5] * P['unprog_h'] # low CD4 & treated
-  dX[:,:,:,3:6,3:5] -= dXi
-  dX[:,:,:,2:5,3:5] += dXi
-  # births & deaths (entry & exit)
-  birth, PXe_si, turn = params.solve_turnover(P,t)
-  dX[:,:,0,0,0] += X.sum() * birth * PXe_si
-  dX -= X * P['death']
-  dX -= X * P['death_hc']
+  dXi = np.multiply(X[...,3:6,3:5],P['unprog_h'],out=W['dXi_unprog']) # low CD4 & treated
+  W['dX_unprog-'] -= dXi
+  W['dX_unprog+'] += dXi
+  # deaths (exit)
+  dX -= np.multiply(X,expand(P['death'],5),out=W['dXi'])
+  dX -= np.multiply(X,P['death_hc'],out=W['dXi'])
   # turnover among activity groups
-  dXi = turn[:,:,:,_,_,_] * X[:,:,_,:,:,:]
-  dX -= dXi.sum(axis=2) # (s:2, i:4, k:5, h:6, c:5)
-  dX += dXi.sum(axis=1) # (s:2, i':4, k:5, h:6, c:5)
+  dXi = np.multiply(Pt['turn_sii'][...,_,_,_],X[...,_,:,:,:],out=W['dXi_turn'])
+  dX -= dXi.sum(axis=-4,out=W['dXi']) # (..., s:2, i:4, k:5, h:6, c:5)
+  dX += dXi.sum(axis=-5,out=W['dXi']) # (..., s:2, i':4, k:5, h:6, c:5)
   # cascade: diagnosis
-  dXi = X[:,:,:,1:6,0] * P['dx_sit'](t) * P['Rdx_scen']
-  dX[:,:,:,1:6,0] -= dXi # undiag
-  dX[:,:,:,1:6,1] += dXi # diag
+  dXi = np.multiply(X[...,1:6,0],Pt['dx_sit'],out=W['dXi_c'])
+  dXi *= P['Rdx_scen']
+  dXc[0] -= dXi # undiag
+  dXc[1] += dXi # diag
   # cascade: treatment
-  dXi = X[:,:,:,1:6,1] * P['tx_sit'](t) * P['Rtx_ht'](t) * P['Rtx_scen']
-  dX[:,:,:,1:6,1] -= dXi # diag
-  dX[:,:,:,1:6,3] += dXi # treat
+  dXi = np.multiply(X[...,1:6,1],Pt['tx_sit'],out=W['dXi_c'])
+  dXi *= Pt['Rtx_ht']
+  dXi *= P['Rtx_scen']
+  dXc[1] -= dXi # diag
+  dXc[3] += dXi # treat
   # cascade: viral suppression
-  dXi = X[:,:,:,1:6,3] * P['vx']
-  dX[:,:,:,1:6,3] -= dXi # treat
-  dX[:,:,:,1:6,4] += dXi # vls
+  dXi = np.multiply(X[...,1:6,3],expand(P['vx'],4),out=W['dXi_c'])
+  dXc[3] -= dXi # treat
+  dXc[4] += dXi # vls
   # cascade: treatment fail / discontinue
-  dXi = X[:,:,:,1:6,4] * P['unvx_sit'](t) * P['Rux_scen']
-  dX[:,:,:,1:6,4] -= dXi # vls
-  dX[:,:,:,1:6,2] += dXi # fail
+  dXi = np.multiply(X[...,1:6,4],Pt['unvx_sit'],out=W['dXi_c'])
+  dXi *= P['Rux_scen']
+  dXc[4] -= dXi # vls
+  dXc[2] += dXi # fail
   # cascade: viral re-suppression
-  dXi = X[:,:,:,1:6,2] * P['revx_t'](t)
-  dX[:,:,:,1:6,2] -= dXi # fail
-  dX[:,:,:,1:6,4] += dXi # vls
+  dXi = np.multiply(X[...,1:6,2],Pt['revx_t'],out=W['dXi_c'])
+  dXc[2] -= dXi # fail
+  dXc[4] += dXi # vls
   return {
     'dX': dX,
     'inc': inc,
@@ -2,6 +2,8 @@
 
 import numpy as np
 from inspect import signature
+from functools import cached_property
+from scipy.optimize import minimize_scalar
 from utils import deco,stats,flatten,dict_str
 from model import out
 
@@ -55,6 +57,21 @@ class Target():
     else: # False-y
       return self.weight
 
+  @cached_property
+  def llmax(self):
+    # max of self.ll(x) over all x, e.g. to bound the ll of a model run before it is done
+    # all dists are unimodal, so we find the mode numerically (also check mean & median)
+    if not self.weight:
+      return self.weight
+    xlo,xhi = self.dist.interval(1-1e-9)
+    x = minimize_scalar(lambda x: -self.dist.logpdf(x),bounds=(xlo,xhi),method='bounded',
+      options=dict(xatol=1e-12*(xhi-xlo))).x
+    return self.weight * np.maximum(llmin,np.max(self.dist.logpdf([x,self.mean(),self.dist.median()])))
+
+  def tmax(self):
+    # latest time of this target, i.e. when a model run can be scored for it
+    return max(ind['t'] for ind in (self.ind,self.ind1,self.ind2) if ind and 't' in ind)
+
   def mean(self):
     return self.dist.mean()
 
@@ -85,11 +102,17 @@ def get_model_ll(T,R,t,interval=None,aggr=True):
     ll.update({repr(Ti):float(Ti.ll(x,interval=interval))})
   return sum(ll.values()) if aggr else ll
 
+def get_t(T):
+  # get all unique times of targets T, e.g. for system.run(...,to=[]) (outputs only at these)
+  return np.unique([ind['t'] for Ti in T for ind in (Ti.ind,Ti.ind1,Ti.ind2) if ind and 't' in ind])
+
 def top_ll(Rs,top=.1,ll='ll'):
-  # subset Rs by R['ll'], chosing the top % or #
-  if isinstance(top,int): top = top / len(Rs)
-  llcut = np.nanquantile([R[ll] for R in Rs],1-top)
-  return [R for R in Rs if R[ll] >= llcut]
+  # subset Rs (list or out.ResultSet) by R['ll'], chosing the top % or # (of all runs, incl. failed)
+  Ra = Rs.Rs if isinstance(Rs,out.ResultSet) else Rs
+  if isinstance(top,int): top = top / len(Ra)
+  lls = np.array([R[ll] for R in Ra],dtype=float)
+  b = lls >= np.nanquantile(lls,1-top)
+  return Rs.take(b) if isinstance(Rs,out.ResultSet) else [R for R,bi in zip(Rs,b) if bi]
 
 def get_all_esw(T=None,**kwds):
   # collect all Eswatini targets
@@ -1,6 +1,7 @@
 # function to compute TPAFs by running model with vs without masked transmission
 
-from utils import log,dict_list_update
+import numpy as np
+from utils import log
 from model import system,params,out
 
 ekwds = dict( # default kwds for out.expo
@@ -9,19 +10,30 @@ ekwds = dict( # default kwds for out.expo
   vsop = '1-2/1',
   mode = 'q')
 
-def run(Ps,tvec,t,paths,t0s):
+def run(Ps,tvec,t,paths,t0s,**kwds):
   # runs the model for Ps & tvec, then again for all combinations of paths (dict) & t0s (list)
   # and computes the corresponding TPAFs for years t in the list-of-lists E from out.expo
   # e.g. paths = dict(msp=dict(p=0,...), t0 = [2000], t = [2010] computes
   # the 10-year TPAF starting from 2000 named 'msp' defined as in get_mix_mask(p=0)
-  ekwds.update(tvec=tvec,t=t)
-  R1s = system.run_n(Ps,t=tvec)
+  # each counterfactual is the same as the baseline until t0, so we resume from a snapshot
+  # of the baseline at t0 (see system.get_S) & solve all paths together for each P & t0
+  # (system.solve_n), i.e. with a leading batch axis of mix_mask; kwds are passed to run_n
+  to = np.union1d(t,t0s) # output times, incl. t0s so cuminfect from t0 is exact
+  ekwds.update(tvec=to,t=t)
+  R1s = system.run_n(Ps,t=tvec,to=to,ts=t0s,**kwds)
+  S1s = [R1.pop('S',[None]*len(t0s)) for R1 in R1s] # None if baseline failed before t0
   E = out.expo(R1s,[],[],[],[],ecols={'tpaf.path':None,'tpaf.t0':None},mode=ekwds['mode'])
-  for name,inds in paths.items():
+  masks = [params.get_mix_mask(**inds) for inds in paths.values()]
+  Eis = {}
+  for j,t0 in enumerate(t0s):
+    log(1,'tpaf: '+', '.join(paths)+' @ '+str(t0))
+    P2s = [dict(P,mix_mask_tpaf=mask,t0_tpaf=t0) for P in Ps for mask in masks]
+    S2s = [S1[j] for S1 in S1s for mask in masks]
+    R2s = system.run_n(P2s,t=tvec,to=to,batch=len(masks),Ss=S2s,**kwds)
+    for k,name in enumerate(paths):
+      Eis[(name,t0)] = out.expo(R1s=R1s,R2s=R2s[k::len(masks)],**ekwds,t0=t0,
+        ecols={'tpaf.path':name,'tpaf.t0':str(t0)})
+  for name in paths: # rows by path, then t0
     for t0 in t0s:
-      log(1,'tpaf: '+name+' @ '+str(t0))
-      P2s = dict_list_update(Ps,mix_mask_tpaf=params.get_mix_mask(**inds),t0_tpaf=t0)
-      R2s = system.run_n(P2s,t=tvec)
-      Ei = out.expo(R1s=R1s,R2s=R2s,**ekwds,t0=t0,ecols={'tpaf.path':name,'tpaf.t0':str(t0)})
-      E = {col:E[col]+Ei[col] for col in E}
+      E = {col:E[col]+Eis[(name,t0)][col] for col in E}
   return E
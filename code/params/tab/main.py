@@ -19,12 +19,12 @@ tex = dict(
 
 PX = fio.load_csv(tfname('par.defs.csv'),fmt='dict') # definitions
 PD = params.def_sample_distrs()                      # prior
-Ps = fio.load_npy(fname('npy','fit','Ps'))           # posterior
+Ps = fio.load_npz(fname('npz','fit','Ps'))           # posterior (columns)
 
 for X in PX:
   k = X['parameter']
   print(k)
-  v = np.array([P[k] for P in Ps])
+  v = Ps[k]
   X.update(
     imu=fmt(PD[k].mean()),
     ilo=fmt(PD[k].ppf(.025)),
@@ -0,0 +1,172 @@
+# equivalence checks of the optional / faster paths vs the default path, for a few param sets
+# run from code/: python3 -m pytest -q test (or make do.test)
+import numpy as np
+import pytest
+from utils import _
+from model import tol,params,system,target,foi,out
+from model.scenario import art,imis
+
+seeds = range(3)
+
+def test_params_lazy():
+  # dependent params are built on first access, for the whole group, same as one by one
+  Ps = params.get_n_all(seeds)
+  assert all(P.dkeys is None for P in Ps)
+  Ps[0]['PX_fsw']
+  assert all(P.dkeys is not None for P in Ps)
+  P1 = params.get_depend(dict(dict.items(params.get_n_all(seeds)[1])))
+  for k,v in P1.items():
+    if isinstance(v,np.ndarray): assert np.allclose(Ps[1][k],v,rtol=1e-12,atol=0,equal_nan=True), k
+
+def test_params_foi_mode_keeps_depend():
+  # foi_mode is not read by any dependent param, so setting it keeps them & the group batch
+  Ps = params.get_n_all(seeds)
+  Ps[0]['PX_fsw']
+  Ps[0]['foi_mode'] = 'lin'
+  assert Ps[0].dkeys is not None and len(Ps[0].group) == len(Ps)
+
+def test_params_invalidate_keeps_overrides():
+  # setting a sampled param rebuilds the dependent params, but keeps scenario edits & overrides
+  P = params.get_n_all(seeds)[0]
+  art.Rxs_update(P,{'Rdx:fsw':.3})
+  P['foi_mode'] = 'lin'
+  assert P['Rdx_scen'][0,2].item() == .3
+  P['PX_fsw'] = .01
+  k = next(iter(params.def_sample_distrs()))
+  P[k] = P[k]
+  assert P['Rdx_scen'][0,2].item() == .3 and P['PX_fsw'] == .01
+  assert P.depend().dkeys is not None and P['Rdx_scen'][0,2].item() == .3
+
+t = system.get_t(tf=2005)
+T = [Ti for Ti in target.get_all_esw() if Ti.tmax() <= t[-1]]
+close = lambda R1,R2,rtol=1e-9,keys=('X','inc'): \
+  all(np.allclose(R1[k],R2[k],rtol=rtol,atol=rtol*np.abs(R2[k]).max()) for k in keys)
+
+def get_R(**kwds):
+  return [system.run(P,t,**kwds) for P in params.get_n_all(seeds)]
+
+def test_solve_n():
+  # all Ps stepping together (solve_n) vs one by one (solve), incl. ll per target
+  Rs = get_R(T=T)
+  for batch in (1,len(seeds)):
+    for R1,R2 in zip(system.run_n(params.get_n_all(seeds),t,T,para=False,batch=batch),Rs):
+      assert close(R1,R2) and np.isclose(R1['ll'],R2['ll'],rtol=1e-9)
+
+def test_linop():
+  for R1,R2 in zip(get_R(linop=True),get_R()):
+    assert close(R1,R2)
+
+def test_jit():
+  pytest.importorskip('numba')
+  # same Newton steps for foi.get_mix (kernel.get_mix_k), incl. P['mix']
+  Ps1,Ps2 = params.get_n_all(seeds),params.get_n_all(seeds)
+  for P1,P2 in zip(Ps1,Ps2):
+    assert close(system.run(P1,t,jit=True),system.run(P2,t))
+    assert np.allclose(P1['mix'],P2['mix'],rtol=1e-9,atol=tol)
+
+def test_float32():
+  for R1,R2 in zip(get_R(dtype=np.float32),get_R()):
+    assert R1['X'].dtype == np.float32 and close(R1,R2,rtol=1e-5)
+
+def test_resume():
+  # resume from snapshots, one by one & as a batch
+  Rs = get_R(ts=1995)
+  for P,R in zip(params.get_n_all(seeds),Rs):
+    assert close(system.run(P,t,S=R['S']),R,rtol=0)
+  Ss = [R['S'] for R in Rs]
+  for R1,R2 in zip(system.run_n(params.get_n_all(seeds),t,para=False,batch=len(seeds),Ss=Ss),Rs):
+    assert close(R1,R2)
+
+def test_rkc():
+  # adaptive solvers vs euler: only as close as euler is to the solution, esp. for inc,
+  # which euler lags by one step, so we compare total inc
+  for method in ('rkc','dp45'):
+    for R1,R2 in zip(get_R(method=method),get_R()):
+      assert close(R1,R2,rtol=1e-3,keys=['X'])
+      assert np.allclose(R1['inc'].sum(axis=0),R2['inc'].sum(axis=0),rtol=5e-2,atol=1e-9)
+
+def test_llstop():
+  # calibration mode: same ll if we never abort, else -inf
+  for R1,R2 in zip(get_R(T=T,llcut=-np.inf),get_R(T=T)):
+    assert R1['lls'] == pytest.approx(R2['lls'],rel=1e-12)
+  for R1,R2 in zip(get_R(T=T,llcut=0),get_R(T=T)): # ll < 0 always
+    assert R1['ll'] == -np.inf and R2['ll'] > -np.inf
+  Rs = system.run_n(params.get_n_all(seeds),t,T,para=False,batch=len(seeds),llcut=-np.inf)
+  for R1,R2 in zip(Rs,get_R(T=T)):
+    assert R1['lls'] == pytest.approx(R2['lls'],rel=1e-9)
+  # imis: abort exactly the runs with ll < llcut
+  lls = [R['ll'] for R in get_R(T=T)]
+  llcut = imis.get_llcut(lls,.5)
+  for R,ll in zip(get_R(T=T,llcut=llcut),lls):
+    assert R['ll'] == (-np.inf if ll < llcut else pytest.approx(ll,rel=1e-12))
+  assert imis.get_llcut(lls,0) == -np.inf
+
+def test_cumfrom():
+  # cumulative outputs from t0 via running integrals: output times to vs all t
+  to = [1990,2000,2005]
+  for P in params.get_n_all(seeds):
+    R1,R2 = system.run(P,t,to=to),system.run(P,t)
+    for fun in (out.cuminfect,out.cumdeath):
+      C1,C2 = fun(R1,tvec=R1['t'],t0=2000),fun(R2,tvec=t,t0=2000)
+      assert np.allclose(C1,C2[np.isin(t,to)],rtol=1e-9,atol=0)
+    with pytest.raises(ValueError): # t0 not in to
+      out.cuminfect(R1,tvec=R1['t'],t0=1995)
+
+def ipf(M0,pref,n=1000):
+  # reference for foi.get_mix: iterative proportional fitting of M0 * exp(pref) to the margins of M0
+  M = M0 * np.exp(pref)
+  for k in range(n):
+    M *= (M0.sum(axis=-1) / M.sum(axis=-1))[...,_]
+    M *= (M0.sum(axis=-2) / M.sum(axis=-2))[...,_,:]
+  return M
+
+def test_get_mix():
+  # Newton (warm & cold start) vs IPF
+  for P in params.get_n_all(seeds):
+    XC = (P['X0'][_] * P['K_psi'][...,_,_]).sum(axis=(-3,-2,-1)) # (p:4, s:2, i:4)
+    M0 = XC[:,0,:,_] * XC[:,1,_,:] / XC.sum(axis=-1).mean(axis=-1)[:,_,_] + tol/10
+    ab = np.zeros(XC.shape)
+    for k in range(2):
+      mix = foi.get_mix(XC,dict(P,mix=np.zeros([4,2,4,4])),ab)
+      assert np.allclose(mix[:,0],ipf(M0,P['pref_pii']),rtol=1e-6,atol=tol) # get_mix: 0 if < tol
+      assert np.allclose(mix[:,1],mix[:,0].swapaxes(-2,-1))
+
+def test_nnls_t():
+  # turnover tables via nnls_t (nnls at a few t only) vs nnls at every t
+  for P in params.get_n_all(seeds):
+    v = P['birth_t'](t) # (t:*)
+    R1 = params.solve_turnover(P,v)
+    for i in range(0,t.size,25):
+      R2 = params.solve_turnover(P,v[i:i+1])
+      for k in R1:
+        assert np.allclose(R1[k][i],R2[k][0],rtol=1e-6,atol=1e-9), (k,i)
+
+def sample_mvn(G,gsam=10,jmax=100):
+  # reference for imis.sample_mvn: each sample z draws & checks its attempts one by one
+  D,Ps = imis.D,[]
+  for z in range(imis.N['isam']):
+    for j in range(jmax): # attempt
+      Pzs = imis.P_dict(G.rvs(gsam,random_state=jmax*z+j))
+      lps = [params.get_lp(D,imis.P_array([P]))[0] for P in Pzs]
+      if np.max(lps) > -np.inf: break # success: prior > 0
+    Ps.append(dict(Pzs[np.argmax(lps)],id=z))
+  return Ps
+
+def test_sample_mvn(monkeypatch):
+  # the same draws (random_state) & selected samples, incl. some invalid attempts
+  monkeypatch.setitem(imis.N,'isam',5)
+  Pa = imis.P_array(params.get_n_all(range(50)))
+  G = imis.stats.mvn(Pa[0],np.cov(Pa.T)/4)
+  for P1,P2 in zip(imis.sample_mvn(G),sample_mvn(G)):
+    assert P1['id'] == P2['id'] and all(P1[k] == P2[k] for k in imis.D)
+
+def test_sample_constr():
+  # constrained samples (default & legacy) meet all constraints; the default is reproducible per seed
+  D = params.def_sample_distrs()
+  Dc = {k:D[k] for k in set().union(*params.def_constrs().values())}
+  Ps0 = params.get_n_sample_lhs(D,5,seed=0)
+  for legacy in (False,True):
+    Ps = params.get_n_sample_constr(Dc,range(5),Ps=[dict(P) for P in Ps0],legacy=legacy)
+    assert all(constr(P) for P in Ps for constr in params.def_constrs())
+  P3 = params.get_n_sample_constr(Dc,[3],Ps=[dict(Ps0[3])])[0]
+  assert all(P3[k] == v for k,v in params.get_n_sample_constr(Dc,range(5),Ps=Ps0)[3].items())
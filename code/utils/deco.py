@@ -16,9 +16,10 @@ def rmap(Rk=[],Pk=[]):
   # e.g. if we define @rmap(Rk=['X']) def fun(X,a):
   # we can use it like fun(R,a) but it acts like fun(a,X=R['X'])
   # this allows us to call all out functions like out(R,...)
+  # Rk missing from R are skipped, so fun can give these defaults (optional)
   def wrapper(fun):
     def decorator(R,**kwds):
-      kwds.update({k:R[k] for k in Rk})
+      kwds.update({k:R[k] for k in Rk if k in R})
       kwds.update({k:R['P'][k] for k in Pk})
       return fun(**kwds)
     return decorator
@@ -34,6 +34,18 @@ def load_npy(fname):
     return obj[()]
   return obj # array-like
 
+def save_npz(fname,cols):
+  # save a dict of typed columns (arrays with the same leading dim) to file via numpy
+  log(2,'fio.save_npz: '+fname)
+  np.savez(genpath(fname),**cols)
+  return cols
+
+def load_npz(fname,keys=None):
+  # load a dict of columns from file via numpy; only the columns in keys are read
+  log(2,'fio.load_npz: '+fname)
+  with np.load(fname) as f:
+    return {k:f[k] for k in (f.files if keys is None else keys)}
+
 def save_csv(fname,obj):
   # equivalent formats (ordered as implemented below)
   # 1. cols: {'A':[0,1,2],'B':[3,4,5]}
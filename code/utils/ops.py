@@ -52,6 +52,11 @@ def dict_list_update(ds,lkwds=None,**kwds):
       d.update({k:v[i] for k,v in lkwds.items()})
   return ds
 
+def expand(x,n):
+  # append n singleton dims to x, e.g. so per-batch scalars broadcast like scalars
+  # e.g. expand(np.ones(3),2).shape = (3,1,1)
+  return np.reshape(x,np.shape(x)+(1,)*n)
+
 def dtfun(t):
   # compute dt from t, repeating the last dt so lengths match
   return np.diff(t,append=2*t[-1]-t[-2])
@@ -79,6 +84,104 @@ def rk4step(Xi,ti,dt,dXfun,keys=None,**kwds):
   if keys is None: keys = R1.keys()
   return { key: (R1[key] + 2*R2[key] + 2*R3[key] + R4[key])/6 for key in keys }
 
+# Dormand-Prince 5(4) coefficients: c (nodes), a (stages), e (error = 5th - 4th order),
+# and d (dense output: weights b(theta) = d @ [theta,theta^2,theta^3,theta^4]; Shampine 1986)
+dp45 = {
+  'c': [0,1/5,3/10,4/5,8/9,1,1],
+  'a': [[],[1/5],[3/40,9/40],[44/45,-56/15,32/9],
+        [19372/6561,-25360/2187,64448/6561,-212/729],
+        [9017/3168,-355/33,46732/5247,49/176,-5103/18656],
+        [35/384,0,500/1113,125/192,-2187/6784,11/84]],
+  'e': [-71/57600,0,71/16695,-71/1920,17253/339200,-22/525,1/40],
+  'd': np.array([
+    [1,-8048581381/2820520608,8663915743/2820520608,-12715105075/11282082432],
+    [0,0,0,0],
+    [0,131558114200/32700410799,-68118460800/10900136933,87487479700/32700410799],
+    [0,-1754552775/470086768,14199869525/1410260304,-10690763975/1880347072],
+    [0,127303824393/49829197408,-318862633887/49829197408,701980252875/199316789632],
+    [0,-282668133/205662961,2019193451/616988883,-1453857185/822651844],
+    [0,40617522/29380423,-110615467/29380423,69997945/29380423]]),
+}
+
+def dp45step(Xi,ti,dt,dXfun,R1=None,**kwds):
+  # Dormand-Prince 5(4) step, assuming dXfun returns a dict with at least 'dX'
+  # R1: dXfun(Xi,ti) if already known (the last stage of the previous step)
+  # returns the 7 stage results Rs, the 5th order X(ti+dt), and the error estimate
+  Rs = [R1 if R1 else dXfun(Xi,ti,**kwds)]
+  for a,c in zip(dp45['a'][1:],dp45['c'][1:]):
+    Xj = Xi + dt * sum(aj*Rj['dX'] for aj,Rj in zip(a,Rs) if aj)
+    Rs.append(dXfun(Xj,ti+c*dt,**kwds))
+  return Rs, Xj, dt * sum(ej*Rj['dX'] for ej,Rj in zip(dp45['e'],Rs) if ej)
+
+def dp45dense(Rs,dt,theta,key='dX',deriv=False):
+  # dense output within a dp45step at ti + theta*dt (0 <= theta <= 1): the increment X - Xi,
+  # or if deriv, the interpolated Rs[key], e.g. dX/dt or other rates returned by dXfun
+  if deriv: b = dp45['d'] @ (np.arange(1,5) * theta**np.arange(0,4))
+  else:     b = dp45['d'] @ (theta**np.arange(1,5)) * dt
+  return sum(bj*Rj[key] for bj,Rj in zip(b,Rs) if bj)
+
+def rkc(s,eps=2/13):
+  # Runge-Kutta-Chebyshev 2nd order coefficients for s >= 2 stages with damping eps
+  # (Sommeijer, Shampine & Verwer 1997): c (nodes), and per stage j: mu, nu, mt, gt
+  # the step is stable for dt * rho <= ~0.65 s^2, where rho is the spectral radius of d(dX)/dX
+  w0 = 1 + eps/s**2
+  T,dT,ddT = [1,w0],[0,1],[0,0] # Chebyshev polynomials T_j(w0) & derivatives
+  for j in range(2,s+1):
+    T.append(2*w0*T[j-1] - T[j-2])
+    dT.append(2*T[j-1] + 2*w0*dT[j-1] - dT[j-2])
+    ddT.append(4*dT[j-1] + 2*w0*ddT[j-1] - ddT[j-2])
+  w1 = dT[s]/ddT[s]
+  b = [ddT[j]/dT[j]**2 if j > 1 else ddT[2]/dT[2]**2 for j in range(s+1)]
+  c = [w1*ddT[j]/dT[j] if j > 1 else 0 for j in range(s+1)]
+  c[1] = c[2]/dT[2]
+  k = {'c':c,'mu':[0,0],'nu':[0,0],'mt':[0,b[1]*w1],'gt':[0,0]}
+  for j in range(2,s+1):
+    k['mu'].append(2*b[j]*w0/b[j-1])
+    k['nu'].append(-b[j]/b[j-2])
+    k['mt'].append(2*b[j]*w1/b[j-1])
+    k['gt'].append(-(1-b[j-1]*T[j-1]) * k['mt'][j])
+  return k
+
+def rkcstep(Xi,ti,dt,s,dXfun,R1=None,**kwds):
+  # Runge-Kutta-Chebyshev step with s stages (see rkc), assuming dXfun returns a dict with 'dX'
+  # R1: dXfun(Xi,ti) if already known (the last result of the previous step)
+  # returns the results R1 & Rf = dXfun(Xf,ti+dt), the 2nd order X(ti+dt) = Xf, and the error estimate
+  # if dXfun modifies X in-place (e.g. foi.fix_XK), we only let it do so for Xf (via Rf), and not
+  # for the error estimate, which would otherwise count such changes as O(dt) error
+  k = rkc(s)
+  R1 = R1 if R1 else dXfun(Xi,ti,**kwds)
+  Xj2,Xj1 = Xi,Xi + k['mt'][1]*dt*R1['dX']
+  for j in range(2,s+1):
+    Rj = dXfun(Xj1.copy(),ti+k['c'][j-1]*dt,**kwds)
+    Xj = (1-k['mu'][j]-k['nu'][j])*Xi + k['mu'][j]*Xj1 + k['nu'][j]*Xj2 \
+       + k['mt'][j]*dt*Rj['dX'] + k['gt'][j]*dt*R1['dX']
+    Xj2,Xj1 = Xj1,Xj
+  Xf = Xj1.copy()
+  Rf = dXfun(Xf,ti+dt,**kwds)
+  return [R1,Rf], Xf, (12*(Xi-Xj1) + 6*dt*(R1['dX']+Rf['dX']))/15
+
+def rkcrho(Xi,ti,dXfun,R1,n=20,tol=.01,**kwds):
+  # estimate the spectral radius of d(dX)/dX at Xi (for rkc) by nonlinear power iteration,
+  # given R1 = dXfun(Xi,ti); we return 1.2x the estimate, as a safety margin
+  # we start from a sign-alternating perturbation of Xi, which (unlike dX) excites all modes
+  nx = np.sqrt(np.mean(Xi**2))
+  dv = (Xi + nx) * (-1)**np.arange(Xi.size).reshape(Xi.shape)
+  d = 1e-7 * max(nx,1e-7)
+  rho = 0
+  for j in range(n):
+    dv = dv * (d / np.sqrt(np.mean(dv**2)))
+    dv = dXfun(Xi+dv,ti,**kwds)['dX'] - R1['dX']
+    rhoj,rho = rho,np.sqrt(np.mean(dv**2)) / d
+    if not rho: return 0
+    if abs(rho-rhoj) <= tol*rho: break
+  return 1.2 * rho
+
+def hermite(Xi,Xf,Rs,dt,theta):
+  # dense output within an rkcstep at ti + theta*dt (0 <= theta <= 1) by cubic Hermite interpolation
+  # of Xi, Xf & the results Rs = [R1,Rf] at ti, ti+dt
+  return (1-theta)**2 * ((1+2*theta)*Xi + theta*dt*Rs[0]['dX']) \
+       + theta**2 * ((3-2*theta)*Xf - (1-theta)*dt*Rs[1]['dX'])
+
 def xdi(X,di):
   # slice X using {dim:index, ...} or x.sum(axis=d) if index=None
   # never changing the number of dimensions (keepdims=True)
@@ -1,26 +1,37 @@
-from utils import deco
+from utils import _,deco
+from copy import copy
 import numpy as np
 
 class tarray:
   # subclass of np.ndarray for on-the-fly spline interpolation along 1 (time) dimension
-  # at initialization, we pre-compute monotonic cubic spline coeffs for each element
-  # we can later evaluate the splines by 'calling' the tarray like X(t)
+  # at initialization, we pre-compute monotonic cubic spline coeffs for each element (e),
+  # stacked as C (4 x e x knots), and knot times tk (e x knots), after any NaN knots are dropped
+  # we can later evaluate the splines by 'calling' the tarray like X(t), for all e at once
   # see toy/tarray-demo for an example, including how NaNs are ignored
   def __init__(self,ti,xi):
     self.ti = np.array(ti)
     self.xi = np.array(xi)
     self.shape = self.xi.shape[0:-1] # t dim (last) is removed
-    self.params = self.fit(self.ti,self.xi)
+    self.tk,self.nk,self.C = self.fit(self.ti,self.xi)
 
   def __call__(self,t):
-    tsize = np.array(t).size
-    if tsize == 1: # single time point
-      return np.reshape([eval_spline(t,**p) for p in self.params],self.shape)
+    tv = np.reshape(t,-1)
+    X = eval_spline(tv,self.tk,self.nk,self.C,shared=(self.nk.min() == self.ti.size))
+    if tv.size == 1: # single time point
+      return X.reshape(self.shape)
     else: # time vector: t dim will be last
-      return np.reshape([eval_spline(ti,**p) for p in self.params for ti in t],(*self.shape,tsize))
+      return X.reshape((*self.shape,tv.size))
 
   def fit(self,ti,xi):
-    return [fit_spline(ti,xi[(*i,slice(None))]) for i in np.ndindex(self.shape)]
+    return fit_spline(ti,xi.reshape((-1,ti.size)))
+
+  def __getitem__(self,j):
+    # select along the leading axis, e.g. one param set from a batch (see params.take_batch)
+    X = copy(self)
+    k = np.arange(self.nk.size).reshape(self.shape)[j]
+    X.xi,X.shape = self.xi[j],k.shape
+    X.tk,X.nk,X.C = self.tk[k.ravel()],self.nk[k.ravel()],self.C[:,k.ravel()]
+    return X
 
   def reshape(self,shape):
     size = np.prod(self.shape)
@@ -30,28 +41,70 @@ class tarray:
     self.shape = tuple(shape)
     return self
 
+def stack(tas):
+  # stack tarrays (same shape) along a new leading axis, e.g. one per param set
+  # if all have the same ti, we get 1 tarray whose (already fitted) coeffs are stacked,
+  # so all are evaluated together, else a tstack
+  X0 = tas[0]
+  if not all(X.shape == X0.shape and np.array_equal(X.ti,X0.ti) for X in tas):
+    return tstack(tas)
+  X = copy(X0)
+  X.xi,X.shape = np.stack([Xj.xi for Xj in tas]),(len(tas),*X0.shape)
+  X.tk,X.nk = np.concatenate([Xj.tk for Xj in tas]),np.concatenate([Xj.nk for Xj in tas])
+  X.C = np.concatenate([Xj.C for Xj in tas],axis=1)
+  return X
+
+class tstack:
+  # stack of tarrays (same shape) along a new leading axis, e.g. one per param set
+  # calling it like X(t) stacks the results of each tarray
+  def __init__(self,tas):
+    self.tas = np.array(tas,dtype=object)
+    self.shape = (len(self.tas),*self.tas[0].shape)
+
+  def __call__(self,t):
+    return np.stack([X(t) for X in self.tas])
+
+  def __getitem__(self,j):
+    # int j: that tarray; slice or mask: a (sub) tstack
+    return self.tas[j] if isinstance(j,(int,np.integer)) else tstack(self.tas[j])
+
 # fit & eval from: https://wikipedia.org/wiki/Monotone_cubic_interpolation
+# both are vectorized over elements (rows of xi): the finite knots of each row are moved first,
+# so row e uses knots 0,...,nk[e]-1, & the rest (tk = inf) are never evaluated
 
 @deco.nowarn
 def fit_spline(ti,xi):
-  i = np.isfinite(xi)
-  ti,xi = ti[i],xi[i]
-  n = len(ti)
-  dti = np.diff(ti)
-  dxi = np.diff(xi)
+  ok = np.isfinite(xi)
+  o = np.argsort(~ok,axis=1,kind='stable') # finite knots first, in order
+  nk = ok.sum(axis=1)
+  e = np.arange(xi.shape[0])
+  ti = np.where(ok[e[:,_],o],ti[o],np.inf)
+  xi = np.take_along_axis(xi,o,axis=1)
+  dti = np.diff(ti,axis=1)
+  dxi = np.diff(xi,axis=1)
   di = dxi/dti
-  qi = dti[0:n-2]+dti[1:n-1]
-  c1 = 3*qi / ((qi+dti[1:n-1])/di[0:n-2] + (qi+dti[0:n-2])/di[1:n-1])
-  c1 = np.array([di[0],*c1,di[-1]])
-  qi = c1[0:n-1] + c1[1:n] - 2*di[0:n-1]
-  c2 = (di-c1[0:n-1]-qi)/dti
-  c2 = np.array([*c2,c2[-1]])
+  qi = dti[:,:-1]+dti[:,1:]
+  c1 = 3*qi / ((qi+dti[:,1:])/di[:,:-1] + (qi+dti[:,:-1])/di[:,1:])
+  c1 = np.concatenate((di[:,:1],c1,di[:,-1:]),axis=1)
+  c1[e,nk-1] = di[e,nk-2]
+  qi = c1[:,:-1] + c1[:,1:] - 2*di
+  c2 = (di-c1[:,:-1]-qi)/dti
+  c2 = np.concatenate((c2,c2[:,-1:]),axis=1)
+  c2[e,nk-1] = c2[e,nk-2]
   c3 = qi/dti/dti
-  c3 = np.array([*c3,c3[-1]])
-  return dict(ti=ti,xi=xi,c1=c1,c2=c2,c3=c3)
-
-def eval_spline(t,ti,xi,c1,c2,c3):
-  i = ti.searchsorted(t)-1
-  i = np.clip(i,0,len(ti)-2)
-  dt = t - ti[i]
-  return xi[i] + c1[i]*dt + c2[i]*dt**2 + c3[i]*dt**3
+  c3 = np.concatenate((c3,c3[:,-1:]),axis=1)
+  c3[e,nk-1] = c3[e,nk-2]
+  return ti,nk,np.stack((xi,c1,c2,c3))
+
+def eval_spline(t,tk,nk,C,shared=False):
+  # shared: all rows have the same (all finite) knots, so 1 searchsorted will do
+  if shared:
+    i = np.clip(tk[0].searchsorted(t)-1,0,tk.shape[1]-2)
+    x,c1,c2,c3 = C[:,:,i]
+    dt = t - tk[0,i]
+  else:
+    i = np.clip((tk[:,:,_] < t).sum(axis=1)-1,0,nk[:,_]-2)
+    e = np.arange(tk.shape[0])[:,_]
+    x,c1,c2,c3 = C[:,e,i]
+    dt = t - tk[e,i]
+  return x + dt*(c1 + dt*(c2 + dt*c3)) # Horner